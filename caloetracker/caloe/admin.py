@@ -1,13 +1,17 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
 from .models import CustomUser, FoodItem, Meal, MealFoodItem, DailyProgress, WeightLog, ProgressPhoto, WaterIntake, WaterGoal
+from .tracking import remove_meal, remove_meal_line, save_meal_line
 
 @admin.register(CustomUser)
 class CustomUserAdmin(UserAdmin):
-    list_display = ('username', 'email', 'age', 'gender', 'height', 'weight', 'goal')
+    list_display = ('username', 'email', 'age', 'gender', 'height', 'weight', 'goal', 'daily_calorie_target')
     list_filter = ('gender', 'goal')
+    # Recomputed by CustomUser.save() whenever the profile is edited here
+    readonly_fields = ('maintenance_calories', 'daily_calorie_target')
     fieldsets = UserAdmin.fieldsets + (
         ('Personal Info', {'fields': ('age', 'gender', 'height', 'weight', 'goal', 'activity_level', 'protein_goal', 'carbs_goal', 'fat_goal')}),
+        ('Calorie Targets', {'fields': ('maintenance_calories', 'daily_calorie_target')}),
     )
 
 @admin.register(FoodItem)
@@ -18,12 +22,41 @@ class FoodItemAdmin(admin.ModelAdmin):
 
 @admin.register(Meal)
 class MealAdmin(admin.ModelAdmin):
-    list_display = ('user', 'meal_type', 'date', 'created_at')
+    list_display = ('user', 'meal_type', 'date', 'total_calories', 'created_at')
+    # Maintained from the line items
+    readonly_fields = ('total_calories', 'total_protein', 'total_carbs', 'total_fat')
     list_filter = ('meal_type', 'date')
+    
+    def get_readonly_fields(self, request, obj=None):
+        # The totals were added to this user's day; moving them is not supported
+        if obj is not None:
+            return self.readonly_fields + ('user', 'date')
+        return self.readonly_fields
+    
+    # Deletes go through caloe.tracking so the day's totals follow
+    def delete_model(self, request, obj):
+        remove_meal(obj)
+    
+    def delete_queryset(self, request, queryset):
+        for meal in queryset.select_related('user'):
+            remove_meal(meal)
 
 @admin.register(MealFoodItem)
 class MealFoodItemAdmin(admin.ModelAdmin):
-    list_display = ('meal', 'food_item', 'quantity', 'total_calories')
+    list_display = ('meal', 'food_name', 'quantity', 'total_calories')
+    # Snapshots taken when the line was logged
+    readonly_fields = ('food_name', 'total_calories', 'total_protein', 'total_carbs', 'total_fat')
+    
+    # Through caloe.tracking so the meal, its day and the ledger follow the line
+    def save_model(self, request, obj, form, change):
+        save_meal_line(obj)
+    
+    def delete_model(self, request, obj):
+        remove_meal_line(obj)
+    
+    def delete_queryset(self, request, queryset):
+        for item in queryset.select_related('meal__user'):
+            remove_meal_line(item)
 
 @admin.register(DailyProgress)
 class DailyProgressAdmin(admin.ModelAdmin):
@@ -0,0 +1,357 @@
+"""
+Columnar analytics over a user's daily tracking data.
+
+A date range is loaded with one values_list() query per source and laid out
+as NumPy arrays on a dense day axis, with NaN marking days where nothing was
+logged. Grouping, rolling averages, target adherence and period comparisons
+are array operations over those columns instead of per-row Python loops, and
+chart series keep gaps explicit (None, serialized as JSON null) so a missed
+day is not drawn as if the neighbouring days were consecutive. Long ranges
+are downsampled with LTTB to a fixed number of points before serialization.
+"""
+import calendar
+from datetime import timedelta
+
+import numpy as np
+from django.db.models import Sum
+
+from .models import DailyProgress, NutritionRollup, WaterIntake, WeightLog
+from .rollups import NUTRITION, SOURCES, WATER, WEIGHT
+
+GROUPINGS = ('day', 'week', 'month')
+
+# A logged day counts as on target when it is within this fraction of the target
+ADHERENCE_TOLERANCE = 0.1
+
+# Trailing window of the calorie trend line, in groups
+ROLLING_WINDOWS = {'day': 7, 'week': 4, 'month': 3}
+
+# Chart series: the source they load and the columns they return
+CHART_SERIES = {
+    'calories': (NUTRITION, ('calories', 'target')),
+    'macros': (NUTRITION, ('protein', 'carbs', 'fat')),
+    'water': (WATER, ('water',)),
+    'weight': (WEIGHT, ('weight',)),
+}
+DEFAULT_POINTS = 300
+
+# NutritionRollup column holding the monthly value of each daily column
+ROLLUP_COLUMNS = {
+    'calories': 'calories_avg',
+    'target': 'calorie_target_avg',
+    'protein': 'protein_avg',
+    'carbs': 'carbs_avg',
+    'fat': 'fat_avg',
+    'water': 'water_avg',
+    'weight': 'weight_avg',
+}
+
+
+class DailySeries:
+    """A user's tracking data for [start, end], one array element per day"""
+
+    def __init__(self, start, end, columns):
+        self.start = start
+        self.end = end
+        self.days = np.arange(np.datetime64(start, 'D'), np.datetime64(end, 'D') + 1)
+        self.columns = columns
+
+    def __len__(self):
+        return len(self.days)
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def between(self, start, end):
+        """A view of the days in [start, end], which must lie within this series"""
+        first = (start - self.start).days
+        last = (end - self.start).days + 1
+        return DailySeries(start, end, {name: column[first:last] for name, column in self.columns.items()})
+
+
+def _offsets(start, dates):
+    # Ordinals are far cheaper to build than a datetime64 array from dates
+    first = start.toordinal()
+    return [day.toordinal() - first for day in dates]
+
+
+def _dense(size, offsets, values):
+    column = np.full(size, np.nan)
+    if offsets:
+        # dtype=float turns None into NaN
+        column[offsets] = np.array(values, dtype=float)
+    return column
+
+
+def _columns(rows, width):
+    return list(zip(*rows)) if rows else [()] * width
+
+
+def load_daily_series(user, start, end, sources=SOURCES):
+    """Load the user's data for [start, end] from the given sources"""
+    size = (end - start).days + 1
+    columns = {}
+
+    if NUTRITION in sources:
+        dates, calories, protein, carbs, fat, target = _columns(list(
+            DailyProgress.objects.filter(user=user, date__range=[start, end]).order_by().values_list(
+                'date', 'total_calories_consumed', 'total_protein', 'total_carbs', 'total_fat', 'calorie_target'
+            )
+        ), 6)
+        offsets = _offsets(start, dates)
+        columns.update(
+            calories=_dense(size, offsets, calories),
+            protein=_dense(size, offsets, protein),
+            carbs=_dense(size, offsets, carbs),
+            fat=_dense(size, offsets, fat),
+            target=_dense(size, offsets, target),
+        )
+        # Rows written before target snapshots existed fall back to the current target
+        unsnapshotted = np.isnan(columns['target']) & ~np.isnan(columns['calories'])
+        columns['target'][unsnapshotted] = user.get_daily_calorie_target()
+
+    if WATER in sources:
+        # order_by('date') replaces the model ordering so rows group per day
+        water_dates, water = _columns(list(
+            WaterIntake.objects.filter(user=user, date__range=[start, end]).values('date').annotate(
+                total_water=Sum('amount_ml')
+            ).order_by('date').values_list('date', 'total_water')
+        ), 2)
+        columns['water'] = _dense(size, _offsets(start, water_dates), water)
+
+    if WEIGHT in sources:
+        weight_dates, weights = _columns(list(
+            WeightLog.objects.filter(user=user, date__range=[start, end]).order_by().values_list('date', 'weight')
+        ), 2)
+        columns['weight'] = _dense(size, _offsets(start, weight_dates), weights)
+
+    return DailySeries(start, end, columns)
+
+
+def group_keys(days, group_by):
+    """The first day of the group each day falls in"""
+    if group_by == 'week':
+        # Day 0 of datetime64 (1970-01-01) was a Thursday; weeks start on Monday
+        return days - (days.astype(np.int64) + 3) % 7
+    if group_by == 'month':
+        return days.astype('datetime64[M]')
+    return days
+
+
+def grouped_mean(values, inverse, size):
+    """Mean of the logged (non-NaN) values in each group, NaN for empty groups"""
+    logged = ~np.isnan(values)
+    totals = np.bincount(inverse, weights=np.where(logged, values, 0.0), minlength=size)
+    counts = np.bincount(inverse, weights=logged, minlength=size)
+    return np.divide(totals, counts, out=np.full(size, np.nan), where=counts > 0)
+
+
+def rolling_mean(values, window):
+    """Trailing mean over the last window elements, skipping NaN"""
+    logged = ~np.isnan(values)
+    totals = np.concatenate(([0.0], np.cumsum(np.where(logged, values, 0.0))))
+    counts = np.concatenate(([0], np.cumsum(logged)))
+    end = np.arange(1, len(values) + 1)
+    start = np.maximum(end - window, 0)
+    window_counts = counts[end] - counts[start]
+    return np.divide(
+        totals[end] - totals[start], window_counts,
+        out=np.full(len(values), np.nan), where=window_counts > 0,
+    )
+
+
+def on_target(series, tolerance=ADHERENCE_TOLERANCE):
+    """1.0 for days within tolerance of the target, 0.0 for misses, NaN if not logged"""
+    calories, target = series['calories'], series['target']
+    scored = ~np.isnan(calories) & (target > 0)
+    hit = np.abs(calories - target) <= tolerance * target
+    return np.where(scored, hit.astype(float), np.nan)
+
+
+def _mean(values):
+    logged = values[~np.isnan(values)]
+    return float(logged.mean()) if len(logged) else None
+
+
+def adherence_percentage(series, tolerance=ADHERENCE_TOLERANCE):
+    """Share of logged days within tolerance of the day's target, or None"""
+    share = _mean(on_target(series, tolerance))
+    return None if share is None else round(share * 100, 1)
+
+
+def previous_period(start, end):
+    """The range of the same length immediately before [start, end]"""
+    length = end - start + timedelta(days=1)
+    return start - length, start - timedelta(days=1)
+
+
+def compare_periods(current, previous):
+    """Mean of every series in current against previous, with the change"""
+    comparison = {}
+    for name in current.columns:
+        now, before = _mean(current[name]), _mean(previous[name])
+        change = now - before if now is not None and before is not None else None
+        comparison[name] = {
+            'current': now,
+            'previous': before,
+            'change': change,
+            'percent': round(change / before * 100, 1) if change is not None and before else None,
+        }
+    return comparison
+
+
+def _series(values, digits):
+    points = np.round(values, digits).astype(object)
+    points[np.isnan(values)] = None
+    return points.tolist()
+
+
+def _labels(keys, group_by, with_year=False):
+    # Formatting from integer parts is much cheaper than strftime per point
+    months = keys.astype('datetime64[M]')
+    month_numbers = months.astype(np.int64)
+    names = [calendar.month_abbr[number % 12 + 1] for number in month_numbers.tolist()]
+    if group_by == 'month':
+        years = (month_numbers // 12 + 1970).tolist()
+        return [f'{name} {year}' for name, year in zip(names, years)]
+    days = ((keys - months.astype('datetime64[D]')).astype(np.int64) + 1).tolist()
+    prefix = 'Week of ' if group_by == 'week' else ''
+    labels = [f'{prefix}{name} {day:02d}' for name, day in zip(names, days)]
+    if with_year:
+        years = (month_numbers // 12 + 1970).tolist()
+        labels = [f'{label} {year}' for label, year in zip(labels, years)]
+    return labels
+
+
+def grouped_columns(series, group_by, names):
+    """Group keys and the mean of each named column per group"""
+    keys, inverse = np.unique(group_keys(series.days, group_by), return_inverse=True)
+    return keys, {name: grouped_mean(series[name], inverse, len(keys)) for name in names}
+
+
+def month_end(day):
+    return day.replace(day=calendar.monthrange(day.year, day.month)[1])
+
+
+def monthly_columns(user, source, start, end, names):
+    """
+    Month keys for [start, end] and the mean of the named columns per month.
+    Months the range covers whole are read from the monthly rollups; a month
+    it only partly covers, at either edge, is computed from the daily rows
+    inside the range, so days outside [start, end] never count.
+    """
+    first_whole = start if start.day == 1 else month_end(start) + timedelta(days=1)
+    last_whole = end if end == month_end(end) else end.replace(day=1) - timedelta(days=1)
+    rollups = NutritionRollup.objects.filter(
+        user=user,
+        period='MONTH',
+        period_start__range=[first_whole, last_whole],
+    ) if first_whole <= last_whole else []
+    keys, columns = rollup_columns(rollups, start, end, names)
+
+    edges = []
+    if start < first_whole:
+        edges.append((start, min(end, first_whole - timedelta(days=1))))
+    if last_whole < end:
+        edges.append((max(start, last_whole + timedelta(days=1)), end))
+    # A range within one month is a single edge
+    for edge_start, edge_end in dict.fromkeys(edges):
+        series = load_daily_series(user, edge_start, edge_end, [source])
+        index = (np.datetime64(edge_start, 'M') - keys[0]).astype(np.int64)
+        for name in names:
+            mean = _mean(series[name])
+            columns[name][index] = np.nan if mean is None else mean
+    return keys, columns
+
+
+def rollup_columns(rollups, start, end, names):
+    """Month keys for [start, end] and the named columns read from monthly rollups"""
+    keys = np.arange(np.datetime64(start, 'M'), np.datetime64(end, 'M') + 1)
+    columns = {name: np.full(len(keys), np.nan) for name in names}
+    for rollup in rollups:
+        index = (np.datetime64(rollup.period_start, 'M') - keys[0]).astype(np.int64)
+        if 0 <= index < len(keys):
+            for name in names:
+                value = getattr(rollup, ROLLUP_COLUMNS[name])
+                if value is not None:
+                    columns[name][index] = value
+    return keys, columns
+
+
+def lttb(x, y, threshold):
+    """
+    Indices of the points Largest-Triangle-Three-Buckets keeps from x, y.
+
+    The first and last points are always kept; every bucket in between
+    contributes the point forming the largest triangle with the point kept
+    from the previous bucket and the mean of the next bucket.
+    """
+    size = len(x)
+    if threshold >= size or threshold < 3:
+        return np.arange(size)
+    edges = np.linspace(1, size - 1, threshold - 1).astype(np.int64)
+    kept = np.empty(threshold, dtype=np.int64)
+    kept[0], kept[-1] = 0, size - 1
+    previous = 0
+    for bucket in range(threshold - 2):
+        first, last = edges[bucket], edges[bucket + 1]
+        if bucket + 2 < len(edges):
+            next_x = x[last:edges[bucket + 2]].mean()
+            next_y = y[last:edges[bucket + 2]].mean()
+        else:
+            next_x, next_y = x[-1], y[-1]
+        areas = np.abs(
+            (x[previous] - next_x) * (y[first:last] - y[previous])
+            - (x[previous] - x[first:last]) * (next_y - y[previous])
+        )
+        previous = first + int(np.argmax(areas))
+        kept[bucket + 1] = previous
+    return kept
+
+
+def downsample(columns, points):
+    """
+    Indices of at most points groups to keep, or None to keep them all.
+
+    LTTB runs over the logged groups of the columns' sum, so every column is
+    sampled at the same groups and the shape of the total is preserved.
+    When the logged groups already fit, every group is kept, gaps included.
+    """
+    primary = sum(columns.values())
+    logged = np.flatnonzero(~np.isnan(primary))
+    if len(logged) <= points:
+        return None
+    return logged[lttb(logged.astype(float), primary[logged], points)]
+
+
+def chart_series(name, keys, columns, group_by, points=DEFAULT_POINTS):
+    """JSON-ready chart data for one of CHART_SERIES, downsampled to points"""
+    if name == 'calories':
+        columns['trend'] = rolling_mean(columns['calories'], ROLLING_WINDOWS[group_by])
+    kept = downsample({column: columns[column] for column in CHART_SERIES[name][1]}, points)
+    total = len(keys)
+    if kept is not None:
+        keys = keys[kept]
+        columns = {column: values[kept] for column, values in columns.items()}
+    digits = 0 if name == 'water' else 1
+    return {
+        'series': name,
+        'group': group_by,
+        'points': len(keys),
+        'downsampled_from': total if kept is not None else None,
+        'dates': [str(key) for key in keys],
+        'labels': _labels(keys, group_by, with_year=len(keys) > 1 and str(keys[0])[:4] != str(keys[-1])[:4]),
+        'datasets': {column: _series(values, digits) for column, values in columns.items()},
+    }
+
+
+def load_chart_series(user, name, start, end, group_by='day', points=DEFAULT_POINTS):
+    """Chart data for [start, end]; whole months come from the rollups"""
+    source, names = CHART_SERIES[name]
+    if group_by == 'month':
+        keys, columns = monthly_columns(user, source, start, end, names)
+    else:
+        keys, columns = grouped_columns(load_daily_series(user, start, end, [source]), group_by, names)
+    data = chart_series(name, keys, columns, group_by, points)
+    data.update(start=start.isoformat(), end=end.isoformat())
+    return data
@@ -5,6 +5,12 @@ class CaloeConfig(AppConfig):  # Changed from TrackerConfig to CaloeConfig
     name = 'caloe'  # Updated to 'caloe'
 
     def ready(self):
+        from django.db.backends.signals import connection_created
+        from .db import apply_sqlite_pragmas
+        from .middleware import install_query_timer
+        connection_created.connect(apply_sqlite_pragmas, dispatch_uid='caloe_sqlite_pragmas')
+        connection_created.connect(install_query_timer, dispatch_uid='caloe_query_timer')
+
         # Import signals only after app is fully loaded
         try:
             import caloe.signals  # Updated to 'caloe'
@@ -0,0 +1,173 @@
+"""
+Per-user cache of computed read models.
+
+Entries live in the CALOE_CACHE alias of CACHES, which can be any Django
+backend: locmem (the default, and what the tests run against), file based,
+memcached or redis. Keys are namespaced by user and stamped with the user's
+data_version:
+
+    caloe:<user id>.<joined>:<data_version>:<name>:<digest of the arguments>
+
+Every write that changes what a user sees already bumps data_version in
+the same transaction, so a write makes all of the user's entries
+unreachable with that one UPDATE. Entries that list system foods also
+pass the catalog version (caloe.models.catalog_version) among their
+arguments, so catalog changes reach them without touching any user.
+Nothing is deleted; the backend expires old versions. The version comes
+from request.user, loaded fresh for each request, so lookups cost no
+extra round trip. The join time keeps a reused user id, say after a
+database restore behind a shared memcached, from reading another
+account's entries.
+
+Each key is computed by one request at a time. The first request to miss
+takes a lock on the key with cache.add() and computes; concurrent requests
+for the key wait for its result instead of running the same aggregates.
+Entries also refresh before they expire. Each read may decide to recompute
+early, with a probability that grows as expiry nears and with how long the
+value took to compute (XFetch). The request that wins the lock recomputes;
+meanwhile the others keep serving the old value. Entries stay stored for
+STALE_FACTOR times their timeout so that such a value is still there. A
+write changes the key, so values from before it are never served.
+
+Outcomes are counted per entry name in this process, see cache_stats().
+"""
+import hashlib
+import math
+import random
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import caches
+
+KEY_PREFIX = 'caloe'
+DEFAULT_ALIAS = 'default'
+DEFAULT_TIMEOUT = 60 * 60
+
+# Entries are kept this many timeouts, the rest of the time as stale values
+# to serve while one request recomputes
+STALE_FACTOR = 2
+# Larger values refresh earlier (XFetch's beta)
+EARLY_REFRESH_BETA = 1.0
+# Seconds a computation holds its key's lock, and seconds other requests
+# wait for its result before computing themselves
+LOCK_TIMEOUT = 30
+LOCK_WAIT = 10
+POLL_INTERVAL = 0.05
+
+OUTCOMES = {'hit': 'hits', 'stale': 'stale', 'wait': 'waits', 'miss': 'misses', 'refresh': 'refreshes'}
+
+_counts = Counter()
+_counts_lock = threading.Lock()
+
+
+def cache_backend():
+    return caches[getattr(settings, 'CALOE_CACHE', DEFAULT_ALIAS)]
+
+
+def user_namespace(user):
+    return f'{KEY_PREFIX}:{user.pk}.{user.date_joined.timestamp():.6f}'
+
+
+def user_key(user, name, args=()):
+    """The key of an entry of user's, valid until their data_version moves"""
+    digest = hashlib.sha1(repr(tuple(args)).encode()).hexdigest()[:20]
+    return f'{user_namespace(user)}:{user.data_version}:{name}:{digest}'
+
+
+def _count(name, outcome):
+    with _counts_lock:
+        _counts[name, outcome] += 1
+
+
+def cached(user, name, args, compute, timeout=None):
+    """
+    The entry for (name, args) at the user's current data_version, computed
+    and stored on a miss. args must have a stable repr: dates, numbers,
+    strings and tuples of them.
+    """
+    timeout = timeout or getattr(settings, 'CALOE_CACHE_TIMEOUT', DEFAULT_TIMEOUT)
+    return single_flight(user_key(user, name, args), name, compute, timeout)
+
+
+def refresh_due(computed_in, expires):
+    """XFetch: recompute early with a probability rising towards expiry"""
+    return time.time() - computed_in * EARLY_REFRESH_BETA * math.log(1 - random.random()) >= expires
+
+
+def single_flight(key, name, compute, timeout):
+    """
+    The value stored under key, computed by at most one caller at a time.
+    Entries are stored as (value, seconds to compute, expiry).
+    """
+    backend = cache_backend()
+    lock_key = f'{key}:lock'
+    entry = backend.get(key)
+    if entry is not None:
+        value, computed_in, expires = entry
+        if not refresh_due(computed_in, expires):
+            _count(name, 'hit')
+            return value
+        if not backend.add(lock_key, 1, LOCK_TIMEOUT):
+            # Another request is already refreshing it
+            _count(name, 'stale')
+            return value
+        _count(name, 'refresh')
+        return _compute_and_store(backend, key, lock_key, compute, timeout)
+    
+    deadline = time.monotonic() + LOCK_WAIT
+    while not backend.add(lock_key, 1, LOCK_TIMEOUT):
+        # Another request is computing it. If it fails, its lock goes away
+        # with no result and the next caller to take the lock retries.
+        if time.monotonic() >= deadline:
+            # Stuck or slower than LOCK_WAIT: compute without the lock
+            _count(name, 'miss')
+            return _compute_and_store(backend, key, None, compute, timeout)
+        time.sleep(POLL_INTERVAL)
+        entry = backend.get(key)
+        if entry is not None:
+            _count(name, 'wait')
+            return entry[0]
+    
+    # The holder may have stored its result and let go since the first read
+    entry = backend.get(key)
+    if entry is not None:
+        backend.delete(lock_key)
+        _count(name, 'wait')
+        return entry[0]
+    _count(name, 'miss')
+    return _compute_and_store(backend, key, lock_key, compute, timeout)
+
+
+def _compute_and_store(backend, key, lock_key, compute, timeout):
+    try:
+        started = time.monotonic()
+        value = compute()
+        computed_in = time.monotonic() - started
+        backend.set(key, (value, computed_in, time.time() + timeout), timeout * STALE_FACTOR)
+        return value
+    finally:
+        if lock_key:
+            backend.delete(lock_key)
+
+
+def cache_stats():
+    """
+    {name: {outcome: count, ..., 'hit_ratio'}} for this process. Misses and
+    refreshes ran the computation; hits, stale reads and waits did not.
+    """
+    with _counts_lock:
+        counts = dict(_counts)
+    stats = {}
+    for name in sorted({name for name, _ in counts}):
+        entry = {label: counts.get((name, outcome), 0) for outcome, label in OUTCOMES.items()}
+        served = entry['hits'] + entry['stale'] + entry['waits']
+        entry['hit_ratio'] = served / (served + entry['misses'] + entry['refreshes'])
+        stats[name] = entry
+    return stats
+
+
+def reset_cache_stats():
+    with _counts_lock:
+        _counts.clear()
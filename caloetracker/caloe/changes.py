@@ -0,0 +1,115 @@
+"""
+Delta sync feed: what changed in a user's records since a cursor.
+
+Every ChangeTracked record carries the change sequence number its owner's
+counter handed out on its last write, and every delete leaves a Tombstone
+numbered the same way. A client stores the opaque cursor of its last page
+and asks for everything numbered above it: one indexed range scan on
+(user, change_seq) per feed, so a sync reads what changed and nothing else,
+however long the history is.
+
+Meal line items are not a feed of their own. They are written with their
+meal and deleted with it, adding one moves the meal's number, and each
+changed meal is sent with all of its lines.
+"""
+from operator import itemgetter
+
+from django.core import signing
+from django.core.files.storage import default_storage
+
+from .models import FoodItem, Meal, MealFoodItem, ProgressPhoto, Tombstone, WaterIntake, WeightLog, claim_change_seqs
+
+PAGE_SIZE = 500
+MAX_PAGE_SIZE = 2000
+
+# Feed name: (model, fields sent for each record)
+FEEDS = {
+    'meals': (Meal, (
+        'id', 'meal_type', 'date', 'created_at', 'total_calories', 'total_protein', 'total_carbs', 'total_fat',
+    )),
+    'water': (WaterIntake, ('id', 'date', 'time', 'amount_ml')),
+    'weights': (WeightLog, ('id', 'date', 'weight', 'notes')),
+    'photos': (ProgressPhoto, ('id', 'date', 'caption', 'image')),
+    'foods': (FoodItem, ('id', 'name', 'calories', 'protein', 'carbs', 'fat', 'serving_size')),
+}
+FEED_NAMES = {model: name for name, (model, _) in FEEDS.items()}
+
+LINE_FIELDS = (
+    'id', 'meal_id', 'food_item_id', 'food_name', 'quantity',
+    'total_calories', 'total_protein', 'total_carbs', 'total_fat',
+)
+
+
+def stamp_changes(user, records):
+    """Number records written with bulk_create(), which skips save()"""
+    records = list(records)
+    if records:
+        for record, seq in zip(records, claim_change_seqs(user.pk, len(records))):
+            record.change_seq = seq
+    return records
+
+
+def _cursor_salt(user):
+    # A cursor only means something for the user it was issued to
+    return f'caloe.changes.{user.pk}'
+
+
+def encode_cursor(user, seq):
+    return signing.dumps(seq, salt=_cursor_salt(user))
+
+
+def decode_cursor(user, cursor):
+    """The sequence number behind a cursor; no cursor starts from scratch"""
+    if not cursor:
+        return 0
+    try:
+        seq = signing.loads(cursor, salt=_cursor_salt(user))
+    except signing.BadSignature:
+        raise ValueError('Invalid cursor')
+    if not isinstance(seq, int) or seq < 0:
+        raise ValueError('Invalid cursor')
+    return seq
+
+
+def changes_since(user, seq=0, limit=PAGE_SIZE):
+    """
+    Up to limit changes numbered above seq, oldest first, as
+    {'changes': {feed: [record]}, 'deleted': {feed: [id]}, 'seq', 'has_more'}.
+    Each feed and the tombstones are read limit + 1 rows at a time, which is
+    enough to merge the first limit changes across all of them in order.
+    """
+    rows = []
+    for name, (model, fields) in FEEDS.items():
+        records = model.objects.filter(
+            **{model.change_owner_field: user, 'change_seq__gt': seq}
+        ).order_by('change_seq').values('change_seq', *fields)[:limit + 1]
+        rows.extend((record.pop('change_seq'), name, record) for record in records)
+    tombstones = Tombstone.objects.filter(user=user, change_seq__gt=seq).order_by('change_seq').values_list(
+        'change_seq', 'kind', 'object_pk'
+    )[:limit + 1]
+    rows.extend((change_seq, None, (kind, object_pk)) for change_seq, kind, object_pk in tombstones)
+    rows.sort(key=itemgetter(0))
+    page = rows[:limit]
+
+    changes = {name: [] for name in FEEDS}
+    deleted = {name: [] for name in FEEDS}
+    for _, name, record in page:
+        if name is None:
+            kind, object_pk = record
+            deleted[kind].append(object_pk)
+        else:
+            changes[name].append(record)
+
+    lines = {meal['id']: meal.setdefault('food_items', []) for meal in changes['meals']}
+    if lines:
+        for line in MealFoodItem.objects.filter(meal_id__in=list(lines)).order_by('pk').values(*LINE_FIELDS):
+            lines[line['meal_id']].append(line)
+    for photo in changes['photos']:
+        photo['image'] = default_storage.url(photo['image']) if photo['image'] else ''
+
+    return {
+        'changes': changes,
+        'deleted': deleted,
+        'seq': page[-1][0] if page else seq,
+        'has_more': len(rows) > limit,
+    }
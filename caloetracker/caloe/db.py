@@ -0,0 +1,74 @@
+"""
+SQLite tuning for concurrent use.
+
+apply_sqlite_pragmas() runs on every new SQLite connection (it is connected
+to connection_created in CaloeConfig.ready) and applies DEFAULT_PRAGMAS,
+with any entries of the CALOE_SQLITE_PRAGMAS setting replacing the defaults
+of the same name. The defaults put the database in WAL mode, so readers
+never wait for the writer and the writer never waits for readers, with
+synchronous=NORMAL (durable at checkpoints, never corrupt), a memory-mapped
+read path, a larger page cache and in-memory temp tables.
+
+With WAL there is still a single writer. The settings start every atomic
+block with BEGIN IMMEDIATE, which takes the write lock up front: a write
+transaction then either starts or waits at BEGIN for busy_timeout, and it
+can never fail halfway when a read lock cannot be upgraded. retry_on_busy()
+retries the rare write that still times out, with exponential backoff.
+"""
+import random
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.db import OperationalError, connection
+
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'wal',
+    'synchronous': 'normal',
+    'busy_timeout': 5000,
+    'cache_size': -32000,  # KiB
+    'mmap_size': 256 * 1024 * 1024,
+    'temp_store': 'memory',
+}
+
+# Attempts after the first, and the delay before the first of them; each
+# retry waits about twice as long as the one before
+BUSY_RETRIES = 3
+BUSY_BACKOFF = 0.05
+
+
+def sqlite_pragmas():
+    return {**DEFAULT_PRAGMAS, **getattr(settings, 'CALOE_SQLITE_PRAGMAS', {})}
+
+
+def apply_sqlite_pragmas(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for name, value in sqlite_pragmas().items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+
+
+def is_busy_error(error):
+    """SQLITE_BUSY as the sqlite3 module reports it"""
+    return isinstance(error, OperationalError) and 'database is locked' in str(error)
+
+
+def retry_on_busy(func):
+    """
+    Retry a write that failed because another writer held the database past
+    busy_timeout. Only the outermost transaction is retried: inside another
+    atomic block the error is left to the caller, whose transaction it broke.
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        retries = getattr(settings, 'CALOE_SQLITE_BUSY_RETRIES', BUSY_RETRIES)
+        for attempt in range(retries + 1):
+            try:
+                return func(*args, **kwargs)
+            except OperationalError as error:
+                if attempt == retries or not is_busy_error(error) or connection.in_atomic_block:
+                    raise
+            # Jitter keeps writers that collided from retrying in lockstep
+            time.sleep(BUSY_BACKOFF * 2 ** attempt * random.uniform(0.5, 1.5))
+    return wrapper
@@ -0,0 +1,116 @@
+"""
+Live per-user events for the Server-Sent Events progress stream.
+
+Write paths publish a user's daily totals once their transaction commits,
+and every open stream holds a subscription that forwards what arrives.
+LocalBroker fans out in-process to the subscribers' asyncio queues, which
+covers a single ASGI worker. CALOE_EVENT_BROKER can name any class with the
+same subscribe/unsubscribe/has_subscribers/publish interface, for example
+one backed by Redis pub/sub, to fan out across processes.
+"""
+import asyncio
+import json
+import threading
+from collections import defaultdict
+from functools import lru_cache
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+DEFAULT_BROKER = 'caloe.events.LocalBroker'
+
+# Messages a slow subscriber may fall behind by before the oldest is dropped;
+# each message holds complete totals, so only the latest one matters
+SUBSCRIBER_BUFFER = 8
+
+# Comment lines keep idle connections open through proxies
+KEEPALIVE_SECONDS = 25
+
+
+class Subscription:
+    """One stream's queue of messages on a channel, bound to its event loop"""
+
+    def __init__(self, broker, channel):
+        self.broker = broker
+        self.channel = channel
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=SUBSCRIBER_BUFFER)
+
+    def deliver(self, message):
+        # Runs on the subscriber's loop
+        if self.queue.full():
+            self.queue.get_nowait()
+        self.queue.put_nowait(message)
+
+    async def get(self):
+        return await self.queue.get()
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class LocalBroker:
+    """In-process pub/sub; publish() is safe to call from any thread"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = defaultdict(set)
+
+    def subscribe(self, channel):
+        """Subscribe the running event loop to channel"""
+        subscription = Subscription(self, channel)
+        with self._lock:
+            self._subscriptions[channel].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.channel)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.channel]
+
+    def has_subscribers(self, channel):
+        with self._lock:
+            return channel in self._subscriptions
+
+    def publish(self, channel, message):
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(channel, ()))
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.deliver, message)
+            except RuntimeError:
+                # The subscriber's loop has closed; its stream is gone
+                self.unsubscribe(subscription)
+
+
+@lru_cache(maxsize=None)
+def get_broker():
+    """The process-wide broker named by CALOE_EVENT_BROKER"""
+    return import_string(getattr(settings, 'CALOE_EVENT_BROKER', DEFAULT_BROKER))()
+
+
+def user_channel(user_id):
+    return f'user:{user_id}'
+
+
+def format_event(event, data):
+    return f'event: {event}\ndata: {json.dumps(data)}\n\n'
+
+
+async def event_stream(subscription, initial, event='progress', keepalive=KEEPALIVE_SECONDS):
+    """SSE body: the initial payload, then every published message"""
+    try:
+        yield format_event(event, initial)
+        while True:
+            try:
+                message = await asyncio.wait_for(subscription.get(), keepalive)
+            except asyncio.TimeoutError:
+                yield ': keepalive\n\n'
+                continue
+            yield format_event(event, message)
+    finally:
+        # Runs when the client disconnects and the server cancels the stream
+        subscription.close()
@@ -0,0 +1,124 @@
+"""
+Reconciliation of DailyProgress with the meals and the nutrition ledger.
+
+DailyProgress is the compacted form of the append-only NutritionLedgerEntry
+rows: the write paths in caloe.tracking add each meal's delta to both in one
+transaction. The meals themselves stay the source of truth. find_drift()
+compares all three for every (user, date) using grouped aggregates, with one
+query each, and rebuild_daily_progress() rewrites the rows that disagree
+with the meals in bulk. It also appends REBUILD entries so the ledger sums
+to the rebuilt totals again.
+"""
+import math
+from collections import namedtuple
+
+from django.db import transaction
+from django.db.models import F, Sum
+
+from .models import CustomUser, DailyProgress, MealFoodItem, NutritionLedgerEntry
+from .rollups import rebuild_user_rollups
+
+TOTALS = ('calories', 'protein', 'carbs', 'fat')
+PROGRESS_FIELDS = ('total_calories_consumed', 'total_protein', 'total_carbs', 'total_fat')
+ZERO = (0.0, 0.0, 0.0, 0.0)
+
+# Totals closer than this (kcal or grams) are the same; float sums of the
+# same deltas in a different order differ in the last bits
+TOLERANCE = 0.01
+
+Drift = namedtuple('Drift', 'user_id date stored meals ledger')
+
+
+def _by_day(rows):
+    return {(user_id, date): tuple(value or 0.0 for value in totals) for user_id, date, *totals in rows}
+
+
+def meal_totals_by_day(user_ids=None):
+    """
+    Totals per (user_id, date) from the nutrient snapshots of the logged
+    line items, in one grouped query
+    """
+    lines = MealFoodItem.objects.all()
+    if user_ids is not None:
+        lines = lines.filter(meal__user_id__in=user_ids)
+    return _by_day(lines.values_list('meal__user_id', 'meal__date').annotate(
+        *(Sum(f'total_{name}') for name in TOTALS)
+    ).order_by())
+
+
+def ledger_totals_by_day(user_ids=None):
+    """Totals per (user_id, date) summed from the ledger, in one grouped query"""
+    entries = NutritionLedgerEntry.objects.all()
+    if user_ids is not None:
+        entries = entries.filter(user_id__in=user_ids)
+    return _by_day(entries.values_list('user_id', 'date').annotate(
+        *(Sum(name) for name in TOTALS)
+    ).order_by())
+
+
+def stored_totals_by_day(user_ids=None):
+    """DailyProgress totals per (user_id, date)"""
+    rows = DailyProgress.objects.all()
+    if user_ids is not None:
+        rows = rows.filter(user_id__in=user_ids)
+    return _by_day(rows.values_list('user_id', 'date', *PROGRESS_FIELDS).order_by())
+
+
+def _same(first, second):
+    return all(math.isclose(a, b, abs_tol=TOLERANCE) for a, b in zip(first, second))
+
+
+def find_drift(user_ids=None):
+    """
+    Every (user, date) where DailyProgress disagrees with the meals or with
+    the ledger, as Drift tuples of the three sets of totals.
+    """
+    meals = meal_totals_by_day(user_ids)
+    ledger = ledger_totals_by_day(user_ids)
+    stored = stored_totals_by_day(user_ids)
+    drift = []
+    for key in sorted(meals.keys() | ledger.keys() | stored.keys()):
+        row = Drift(*key, stored.get(key, ZERO), meals.get(key, ZERO), ledger.get(key, ZERO))
+        if not (_same(row.stored, row.meals) and _same(row.stored, row.ledger)):
+            drift.append(row)
+    return drift
+
+
+def rebuild_daily_progress(user_ids=None):
+    """
+    Recompute DailyProgress from the meals wherever it drifted, creating
+    missing rows, and append the ledger corrections. Returns the Drift
+    tuples that were fixed.
+    """
+    with transaction.atomic():
+        drift = find_drift(user_ids)
+        existing = {
+            (row.user_id, row.date): row
+            for row in DailyProgress.objects.filter(user_id__in={row.user_id for row in drift})
+        }
+        users = CustomUser.objects.in_bulk({row.user_id for row in drift})
+        created, updated, corrections = [], [], []
+        for row in drift:
+            progress = existing.get((row.user_id, row.date))
+            if progress is None:
+                progress = DailyProgress(user=users[row.user_id], date=row.date)
+                progress.capture_targets()
+                created.append(progress)
+            elif not _same(row.stored, row.meals):
+                updated.append(progress)
+            for field, value in zip(PROGRESS_FIELDS, row.meals):
+                setattr(progress, field, value)
+            if not _same(row.ledger, row.meals):
+                corrections.append(NutritionLedgerEntry(
+                    user_id=row.user_id, date=row.date, kind='REBUILD',
+                    **{name: meal - ledger for name, meal, ledger in zip(TOTALS, row.meals, row.ledger)}
+                ))
+        DailyProgress.objects.bulk_create(created, batch_size=1000)
+        DailyProgress.objects.bulk_update(updated, PROGRESS_FIELDS, batch_size=1000)
+        NutritionLedgerEntry.objects.bulk_create(corrections, batch_size=1000)
+
+        changed = {progress.user_id for progress in created + updated}
+        for user_id in changed:
+            rebuild_user_rollups(users[user_id])
+        CustomUser.objects.filter(pk__in=changed).update(data_version=F('data_version') + 1)
+    return drift
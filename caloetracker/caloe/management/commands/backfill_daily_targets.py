@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from django.db.models import OuterRef, Subquery
+from caloe.models import CustomUser, DailyProgress
+
+class Command(BaseCommand):
+    help = "Fill missing DailyProgress target snapshots from each user's current targets"
+
+    def handle(self, *args, **options):
+        # One UPDATE for all rows; each column reads its value from the owning
+        # user with a correlated subquery
+        user = CustomUser.objects.filter(pk=OuterRef('user_id'))
+        updated = DailyProgress.objects.filter(calorie_target__isnull=True).update(
+            calorie_target=Subquery(user.values('daily_calorie_target')[:1]),
+            protein_target=Subquery(user.values('protein_goal')[:1]),
+            carbs_target=Subquery(user.values('carbs_goal')[:1]),
+            fat_target=Subquery(user.values('fat_goal')[:1]),
+        )
+        self.stdout.write(
+            self.style.SUCCESS(f'Backfilled targets on {updated} daily progress rows')
+        )
@@ -0,0 +1,147 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Sum
+from caloe.analytics import (
+    CHART_SERIES, GROUPINGS, ROLLING_WINDOWS, adherence_percentage, chart_series, grouped_columns, load_daily_series,
+)
+from caloe.models import CustomUser, DailyProgress, WaterIntake, WeightLog
+from collections import defaultdict
+from datetime import date, timedelta
+import random
+import statistics
+import time
+
+RANGES = [('month', 30), ('year', 365), ('all', None)]
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the NumPy analytics module against row-by-row Python helpers (rolled back)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--years', type=int, default=5, help='Length of the synthetic history')
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        random.seed(42)
+        with transaction.atomic():
+            user = CustomUser.objects.create(
+                username='bench-analytics', age=30, gender='F', height=165, weight=60,
+                goal='MAINTAIN', activity_level=1.375,
+            )
+            end = date.today()
+            first = end - timedelta(days=365 * options['years'] - 1)
+            self.build_history(user, first, end)
+            self.stdout.write(self.style.SUCCESS(f'{options["years"]} years of history from {first}'))
+            self.stdout.write(f'{"range":<7} {"group":<6} {"python":>9} {"numpy":>9} {"load":>9} {"compute":>9}')
+            for name, days in RANGES:
+                start = first if days is None else end - timedelta(days=days - 1)
+                for group_by in GROUPINGS:
+                    self.bench_range(user, name, start, end, group_by, options['repeat'])
+            transaction.set_rollback(True)
+
+    def build_history(self, user, first, end):
+        progress, water, weights = [], [], []
+        day = first
+        while day <= end:
+            # Skip about one day in seven so the series has real gaps
+            if random.random() < 0.85:
+                calories = random.gauss(2000, 300)
+                progress.append(DailyProgress(
+                    user=user, date=day, total_calories_consumed=calories, total_protein=calories * 0.05,
+                    total_carbs=calories * 0.12, total_fat=calories * 0.035, calorie_target=2000,
+                ))
+                water.extend(
+                    WaterIntake(user=user, date=day, amount_ml=random.choice([250, 330, 500]))
+                    for _ in range(random.randint(1, 6))
+                )
+            if random.random() < 0.3:
+                weights.append(WeightLog(user=user, date=day, weight=round(random.gauss(60, 1.5), 1)))
+            day += timedelta(days=1)
+        DailyProgress.objects.bulk_create(progress, batch_size=1000)
+        WaterIntake.objects.bulk_create(water, batch_size=1000)
+        WeightLog.objects.bulk_create(weights, batch_size=1000)
+
+    def bench_range(self, user, name, start, end, group_by, repeat):
+        series = load_daily_series(user, start, end)
+        timings = [
+            self.median_ms(lambda: self.python_charts(user, start, end, group_by), repeat),
+            self.median_ms(lambda: self.numpy_charts(user, start, end, group_by), repeat),
+            self.median_ms(lambda: load_daily_series(user, start, end), repeat),
+            self.median_ms(lambda: self.numpy_compute(series, group_by), repeat),
+        ]
+        self.stdout.write(f'{name:<7} {group_by:<6} ' + ' '.join(f'{timing:>7.1f}ms' for timing in timings))
+
+    def numpy_charts(self, user, start, end, group_by):
+        return self.numpy_compute(load_daily_series(user, start, end), group_by)
+
+    def numpy_compute(self, series, group_by):
+        # Keep every point: the Python version does not downsample either
+        charts = [
+            chart_series(name, *grouped_columns(series, group_by, columns), group_by, points=len(series))
+            for name, (_, columns) in CHART_SERIES.items()
+        ]
+        return charts, adherence_percentage(series)
+
+    def python_charts(self, user, start, end, group_by):
+        """The same output computed the way the view helpers did it, one row at a time"""
+        target = user.get_daily_calorie_target()
+        calories = {
+            row.date: row for row in DailyProgress.objects.filter(user=user, date__range=[start, end])
+        }
+        water = {
+            row['date']: row['total_water']
+            for row in WaterIntake.objects.filter(user=user, date__range=[start, end]).values('date').annotate(
+                total_water=Sum('amount_ml')
+            ).order_by('date')
+        }
+        weights = {row.date: row.weight for row in WeightLog.objects.filter(user=user, date__range=[start, end])}
+
+        groups = defaultdict(lambda: defaultdict(list))
+        on_target = []
+        day = start
+        while day <= end:
+            if group_by == 'week':
+                key = day - timedelta(days=day.weekday())
+            elif group_by == 'month':
+                key = day.replace(day=1)
+            else:
+                key = day
+            group = groups[key]
+            progress = calories.get(day)
+            if progress is not None:
+                day_target = progress.calorie_target if progress.calorie_target is not None else target
+                group['consumed'].append(progress.total_calories_consumed)
+                group['target'].append(day_target)
+                if day_target > 0:
+                    on_target.append(abs(progress.total_calories_consumed - day_target) <= 0.1 * day_target)
+            if day in water:
+                group['water'].append(water[day])
+            if day in weights:
+                group['weight'].append(weights[day])
+            day += timedelta(days=1)
+
+        def mean(values):
+            return sum(values) / len(values) if values else None
+
+        keys = sorted(groups)
+        consumed = [mean(groups[key]['consumed']) for key in keys]
+        window = ROLLING_WINDOWS[group_by]
+        trend = []
+        for index in range(len(consumed)):
+            logged = [value for value in consumed[max(0, index - window + 1):index + 1] if value is not None]
+            trend.append(mean(logged))
+        return {
+            'consumed': consumed,
+            'target': [mean(groups[key]['target']) for key in keys],
+            'trend': trend,
+            'water': [mean(groups[key]['water']) for key in keys],
+            'weight': [mean(groups[key]['weight']) for key in keys],
+        }, mean(on_target)
+
+    def median_ms(self, run, repeat):
+        samples = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            run()
+            samples.append((time.perf_counter() - start) * 1000)
+        return statistics.median(samples)
@@ -0,0 +1,79 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from caloe.models import CustomUser, FoodItem, FoodSearchToken
+from caloe.search import build_tokens, search_food_items, visible_food_items
+import random
+import statistics
+import time
+
+BRANDS = ['Acme', 'Golden', 'Farm Fresh', 'Nature', 'Daily', 'Organic', 'Premium', 'Classic']
+STYLES = ['Grilled', 'Roasted', 'Steamed', 'Fried', 'Baked', 'Raw', 'Smoked', 'Boiled']
+FOODS = [
+    'Chicken Breast', 'Brown Rice', 'White Rice', 'Salmon', 'Broccoli', 'Potato', 'Oatmeal',
+    'Almonds', 'Greek Yogurt', 'Cheddar Cheese', 'Beef Steak', 'Tuna', 'Avocado', 'Banana',
+    'Apple', 'Whole Milk', 'Pasta', 'Egg', 'Sweet Potato', 'Quinoa', 'Lentils', 'Tofu',
+]
+
+QUERIES = ['c', 'chi', 'chicken', 'brown rice', 'sweet pot', 'zucchini']
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the indexed food search against the old name__icontains scan (rolled back)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 500000])
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--limit', type=int, default=20,
+                            help='Result limit used for the top-N timings')
+
+    def handle(self, *args, **options):
+        random.seed(42)
+        with transaction.atomic():
+            user = CustomUser.objects.create(username='bench-food-search')
+            rows = 0
+            for size in sorted(options['sizes']):
+                rows = self.grow_catalog(rows, size)
+                self.stdout.write(self.style.SUCCESS(f'\n{size} food items'))
+                self.stdout.write(f'{"query":<12} {"icontains all":>14} {"index all":>10} '
+                                  f'{"icontains top":>14} {"index top":>10} {"matches":>8}')
+                for query in QUERIES:
+                    self.bench_query(user, query, options['repeat'], options['limit'])
+            transaction.set_rollback(True)
+
+    def grow_catalog(self, rows, size):
+        batch_size = 5000
+        while rows < size:
+            count = min(batch_size, size - rows)
+            foods = FoodItem.objects.bulk_create([
+                FoodItem(
+                    name=f'{random.choice(BRANDS)} {random.choice(STYLES)} {random.choice(FOODS)} {rows + i}',
+                    calories=random.uniform(20, 600),
+                    serving_size='100g',
+                )
+                for i in range(count)
+            ])
+            FoodSearchToken.objects.bulk_create(build_tokens(foods), batch_size=batch_size)
+            rows += count
+        return rows
+
+    def bench_query(self, user, query, repeat, limit):
+        old = visible_food_items(user).filter(name__icontains=query).values_list('id', flat=True)
+        new = search_food_items(user, query).values_list('id', flat=True)
+        matches = new.count()
+        # .all() clones the queryset so every run goes to the database
+        timings = [
+            self.median_ms(lambda: list(old.all()), repeat),
+            self.median_ms(lambda: list(new.all()), repeat),
+            self.median_ms(lambda: list(old.all()[:limit]), repeat),
+            self.median_ms(lambda: list(new.all()[:limit]), repeat),
+        ]
+        self.stdout.write(f'{query:<12} {timings[0]:>12.1f}ms {timings[1]:>8.1f}ms '
+                          f'{timings[2]:>12.1f}ms {timings[3]:>8.1f}ms {matches:>8}')
+
+    def median_ms(self, run, repeat):
+        samples = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            run()
+            samples.append((time.perf_counter() - start) * 1000)
+        return statistics.median(samples)
@@ -0,0 +1,138 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from caloe.models import CustomUser, FoodItem, FoodRecommendation, Meal, MealFoodItem
+from caloe.recommendations import (
+    CHUNK_SIZE, HOUR_KERNEL, MEAL_TYPES, TOP_K, build_recommendations, compute_recommendations,
+)
+from caloe.usage import HALF_LIFE_DAYS
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta, timezone as dt_timezone
+import random
+import time
+
+# Usual hour and spread of each meal type in the synthetic history
+MEAL_HOURS = {'BREAKFAST': (8, 1), 'LUNCH': (13, 1), 'DINNER': (19, 1.5), 'SNACK': (16, 3)}
+CATALOG_SIZE = 2000
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the batch recommendation job over a synthetic population (DB part rolled back)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10000)
+        parser.add_argument('--days', type=int, default=365)
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+        parser.add_argument('--db-users', type=int, default=50, help='Users written to the database for the end-to-end run')
+
+    def handle(self, *args, **options):
+        random.seed(42)
+        now = datetime.now(dt_timezone.utc)
+        days, chunk_size = options['days'], options['chunk_size']
+
+        # Scoring only: the history is generated outside the timer
+        line_count = row_count = 0
+        compute_seconds = 0.0
+        for first in range(0, options['users'], chunk_size):
+            meals, lines = self.synthetic_history(range(first, min(first + chunk_size, options['users'])), days, now)
+            started = time.perf_counter()
+            row_count += len(compute_recommendations(meals, lines, now.timestamp()))
+            compute_seconds += time.perf_counter() - started
+            line_count += len(lines)
+        self.stdout.write(self.style.SUCCESS(
+            f'compute: {options["users"]} users x {days} days, {line_count} meal lines -> {row_count} rows '
+            f'in {compute_seconds:.1f}s ({line_count / compute_seconds / 1e6:.2f}M lines/s)'
+        ))
+
+        meals, lines = self.synthetic_history(range(chunk_size), days, now)
+        started = time.perf_counter()
+        compute_recommendations(meals, lines, now.timestamp())
+        numpy_seconds = time.perf_counter() - started
+        started = time.perf_counter()
+        self.python_recommendations(meals, lines, now.timestamp())
+        python_seconds = time.perf_counter() - started
+        self.stdout.write(
+            f'one chunk of {chunk_size} users, {len(lines)} lines: numpy {numpy_seconds:.2f}s, '
+            f'row-by-row python {python_seconds:.2f}s'
+        )
+
+        with transaction.atomic():
+            self.bench_database(options['db_users'], days, now)
+            transaction.set_rollback(True)
+
+    def synthetic_history(self, users, days, now):
+        """Meals and lines of the users, shaped as load_history() returns them"""
+        meals, lines = [], []
+        for user in users:
+            # Each user rotates through a few favourites per meal type
+            favourites = {
+                meal_type: random.sample(range(1, CATALOG_SIZE + 1), 12) for meal_type in MEAL_TYPES
+            }
+            for day in range(days):
+                for meal_type in MEAL_TYPES:
+                    if meal_type == 'SNACK' and random.random() < 0.5:
+                        continue
+                    mean, spread = MEAL_HOURS[meal_type]
+                    hour = min(23, max(0, round(random.gauss(mean, spread))))
+                    meal_id = len(meals) + 1
+                    meals.append((meal_id, user, meal_type, hour, (now - timedelta(days=day)).replace(hour=hour)))
+                    lines.extend((meal_id, food) for food in random.sample(favourites[meal_type], random.randint(1, 4)))
+        return meals, lines
+
+    def python_recommendations(self, meals, lines, now):
+        """The slot and companion scores computed one line at a time"""
+        by_id = {meal[0]: meal for meal in meals}
+        slots = defaultdict(Counter)
+        foods_in = defaultdict(set)
+        for meal_id, food in lines:
+            _, user, meal_type, hour, created = by_id[meal_id]
+            weight = 2 ** (-(now - created.timestamp()) / (HALF_LIFE_DAYS * 86400))
+            for distance, factor in HOUR_KERNEL.items():
+                for offset in {distance, -distance}:
+                    slot_hour = (hour + offset) % 24
+                    slots[user, meal_type, slot_hour][food] += weight * factor
+                    slots[user, '', slot_hour][food] += weight * factor
+            foods_in[meal_id].add(food)
+        pairs = defaultdict(Counter)
+        for meal_id, foods in foods_in.items():
+            _, user, _, _, created = by_id[meal_id]
+            weight = 2 ** (-(now - created.timestamp()) / (HALF_LIFE_DAYS * 86400))
+            for food in foods:
+                for other in foods:
+                    pairs[user, food][other] += weight
+        top = {slot: counter.most_common(TOP_K) for slot, counter in slots.items()}
+        top.update((key, counter.most_common(TOP_K + 1)) for key, counter in pairs.items())
+        return top
+
+    def bench_database(self, user_count, days, now):
+        foods = FoodItem.objects.bulk_create(
+            [FoodItem(name=f'Bench food {index}', calories=100) for index in range(CATALOG_SIZE)]
+        )
+        users = CustomUser.objects.bulk_create([
+            CustomUser(username=f'bench-recommendations-{index}', goal='MAINTAIN') for index in range(user_count)
+        ])
+        history, lines = self.synthetic_history(range(user_count), days, now)
+        meals = {
+            meal_id: Meal(user=users[user], meal_type=meal_type)
+            for meal_id, user, meal_type, _, created in history
+        }
+        Meal.objects.bulk_create(meals.values(), batch_size=1000)
+        # created_at is auto_now_add, so backdate it after the insert
+        for meal_id, _, _, _, created in history:
+            meals[meal_id].created_at = created
+        Meal.objects.bulk_update(meals.values(), ['created_at'], batch_size=1000)
+        MealFoodItem.objects.bulk_create(
+            [MealFoodItem(meal=meals[meal_id], food_item=foods[food - 1]) for meal_id, food in lines],
+            batch_size=1000,
+        )
+
+        started = time.perf_counter()
+        rows = build_recommendations([user.pk for user in users])
+        seconds = time.perf_counter() - started
+        self.stdout.write(
+            f'database: load + score + store for {user_count} users ({len(lines)} lines, {rows} rows) '
+            f'in {seconds:.2f}s'
+        )
+        user = users[0]
+        started = time.perf_counter()
+        count = len(list(FoodRecommendation.objects.filter(user=user, slot='LUNCH@13').select_related('food_item')))
+        self.stdout.write(f'slot lookup: {count} foods in {(time.perf_counter() - started) * 1000:.2f}ms')
@@ -0,0 +1,153 @@
+from django.core.management.base import BaseCommand
+from caloe.db import BUSY_BACKOFF, BUSY_RETRIES, sqlite_pragmas
+from datetime import date, timedelta
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+
+# Shaped like the dashboard's reads and record_meal()'s writes
+SCHEMA = [
+    'CREATE TABLE meal (id INTEGER PRIMARY KEY, user_id INTEGER, date TEXT, created_at TEXT, total_calories REAL)',
+    'CREATE INDEX meal_user_date ON meal (user_id, date, created_at)',
+    'CREATE TABLE meal_line (id INTEGER PRIMARY KEY, meal_id INTEGER, food_name TEXT, total_calories REAL)',
+    'CREATE INDEX meal_line_meal ON meal_line (meal_id)',
+    'CREATE TABLE progress (id INTEGER PRIMARY KEY, user_id INTEGER, date TEXT, total REAL, UNIQUE (user_id, date))',
+]
+
+
+class Command(BaseCommand):
+    help = "Benchmark mixed reads and writes on SQLite with the default settings and with caloe.db's tuning"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--readers', type=int, default=8)
+        parser.add_argument('--writers', type=int, default=2)
+        parser.add_argument('--seconds', type=float, default=5)
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--days', type=int, default=60)
+
+    def handle(self, *args, **options):
+        profiles = {
+            # Django's defaults: rollback journal, deferred transactions, no retries
+            'default': ({}, 'BEGIN', 0),
+            'tuned': (sqlite_pragmas(), 'BEGIN IMMEDIATE', BUSY_RETRIES),
+        }
+        for name, profile in profiles.items():
+            with tempfile.TemporaryDirectory() as directory:
+                path = os.path.join(directory, 'bench.sqlite3')
+                self.seed(path, options['users'], options['days'])
+                self.report(name, self.run(path, *profile, options))
+
+    def seed(self, path, users, days):
+        db = sqlite3.connect(path, isolation_level=None)
+        for statement in SCHEMA:
+            db.execute(statement)
+        today = date.today()
+        db.execute('BEGIN')
+        for user in range(users):
+            for day in range(days):
+                day = (today - timedelta(days=day)).isoformat()
+                for meal in range(3):
+                    meal_id = db.execute(
+                        'INSERT INTO meal (user_id, date, created_at, total_calories) VALUES (?, ?, ?, 600)',
+                        (user, day, f'{day} {8 + 5 * meal:02d}:00'),
+                    ).lastrowid
+                    db.executemany(
+                        'INSERT INTO meal_line (meal_id, food_name, total_calories) VALUES (?, ?, 200)',
+                        [(meal_id, f'food {line}') for line in range(3)],
+                    )
+                db.execute('INSERT INTO progress (user_id, date, total) VALUES (?, ?, 1800)', (user, day))
+        db.execute('COMMIT')
+        db.close()
+
+    def connect(self, path, pragmas):
+        db = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+        for pragma, value in pragmas.items():
+            db.execute(f'PRAGMA {pragma} = {value}')
+        return db
+
+    def run(self, path, pragmas, begin, retries, options):
+        results = {'read': [], 'write': [], 'errors': 0, 'retries': 0}
+        lock = threading.Lock()
+        today = date.today().isoformat()
+        deadline = time.perf_counter() + options['seconds']
+
+        def read(db):
+            user = random.randrange(options['users'])
+            meals = db.execute(
+                'SELECT id, total_calories FROM meal WHERE user_id = ? AND date = ? ORDER BY created_at DESC',
+                (user, today),
+            ).fetchall()
+            db.execute(
+                'SELECT * FROM meal_line WHERE meal_id IN (%s)' % ','.join('?' * len(meals)), [meal[0] for meal in meals]
+            ).fetchall()
+            db.execute('SELECT total FROM progress WHERE user_id = ? AND date = ?', (user, today)).fetchone()
+
+        def write(db):
+            user = random.randrange(options['users'])
+            db.execute(begin)
+            try:
+                meal_id = db.execute(
+                    "INSERT INTO meal (user_id, date, created_at, total_calories) VALUES (?, ?, datetime('now'), 300)",
+                    (user, today),
+                ).lastrowid
+                db.executemany(
+                    'INSERT INTO meal_line (meal_id, food_name, total_calories) VALUES (?, ?, 100)',
+                    [(meal_id, f'food {line}') for line in range(3)],
+                )
+                db.execute('UPDATE progress SET total = total + 300 WHERE user_id = ? AND date = ?', (user, today))
+                db.execute('COMMIT')
+            except BaseException:
+                if db.in_transaction:
+                    db.execute('ROLLBACK')
+                raise
+
+        def worker(kind, operation):
+            db = self.connect(path, pragmas)
+            try:
+                while time.perf_counter() < deadline:
+                    started = time.perf_counter()
+                    for attempt in range(retries + 1):
+                        try:
+                            operation(db)
+                        except sqlite3.OperationalError as error:
+                            if attempt == retries or 'locked' not in str(error):
+                                with lock:
+                                    results['errors'] += 1
+                                break
+                            with lock:
+                                results['retries'] += 1
+                            time.sleep(BUSY_BACKOFF * 2 ** attempt * random.uniform(0.5, 1.5))
+                        else:
+                            with lock:
+                                results[kind].append(time.perf_counter() - started)
+                            break
+            finally:
+                db.close()
+
+        threads = [threading.Thread(target=worker, args=('read', read)) for _ in range(options['readers'])]
+        threads += [threading.Thread(target=worker, args=('write', write)) for _ in range(options['writers'])]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        results['seconds'] = options['seconds']
+        return results
+
+    def report(self, name, results):
+        def summary(latencies):
+            if not latencies:
+                return '0/s'
+            latencies = sorted(latencies)
+            p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+            return (
+                f'{len(latencies) / results["seconds"]:.0f}/s, p50 {statistics.median(latencies) * 1000:.1f}ms, '
+                f'p99 {p99 * 1000:.1f}ms, max {latencies[-1] * 1000:.0f}ms'
+            )
+        self.stdout.write(
+            f'{name}: reads {summary(results["read"])}; writes {summary(results["write"])}; '
+            f'{results["retries"]} retries, {results["errors"]} errors'
+        )
@@ -0,0 +1,74 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from caloe.models import CustomUser, FoodItem
+from caloe.sync import import_entries
+from caloe.tracking import log_meal, log_water, log_weight
+from datetime import date, timedelta
+import random
+import time
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the offline sync import against logging entries one at a time (rolled back)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--entries', type=int, default=1000)
+        parser.add_argument('--days', type=int, default=60)
+
+    def handle(self, *args, **options):
+        random.seed(42)
+        with transaction.atomic():
+            foods = FoodItem.objects.bulk_create(
+                [FoodItem(name=f'Bench food {index}', calories=100 + index, protein=5, carbs=10, fat=3) for index in range(200)]
+            )
+            payload = self.payload([food.id for food in foods], options['entries'], options['days'])
+
+            user = CustomUser.objects.create(username='bench-sync-batch', goal='MAINTAIN')
+            started = time.perf_counter()
+            with CaptureQueriesContext(connection) as queries:
+                import_entries(user, payload)
+            self.report('batch import', started, len(queries), options['entries'])
+
+            user = CustomUser.objects.create(username='bench-sync-single', goal='MAINTAIN')
+            started = time.perf_counter()
+            with CaptureQueriesContext(connection) as queries:
+                # log_meal() always logs for today; the day only matters for water and weight
+                for meal in payload['meals']:
+                    log_meal(user, meal['meal_type'], [(item['food_id'], item['quantity']) for item in meal['food_items']])
+                for water in payload['water']:
+                    log_water(user, date.fromisoformat(water['date']), water['amount_ml'])
+                for weight in payload['weights']:
+                    log_weight(user, date.fromisoformat(weight['date']), weight['weight'])
+            self.report('one at a time', started, len(queries), options['entries'])
+            transaction.set_rollback(True)
+
+    def payload(self, food_ids, entries, days):
+        """About 70% meals, 25% water and 5% weigh-ins spread over the past days"""
+        today = timezone.localdate()
+        payload = {'meals': [], 'water': [], 'weights': []}
+        for index in range(entries):
+            day = (today - timedelta(days=random.randrange(days))).isoformat()
+            kind = random.random()
+            if kind < 0.7:
+                payload['meals'].append({
+                    'date': day,
+                    'time': f'{random.randint(6, 21):02d}:{random.randint(0, 59):02d}',
+                    'meal_type': random.choice(['BREAKFAST', 'LUNCH', 'DINNER', 'SNACK']),
+                    'food_items': [
+                        {'food_id': food_id, 'quantity': random.choice([0.5, 1, 1.5, 2])}
+                        for food_id in random.sample(food_ids, random.randint(1, 4))
+                    ],
+                })
+            elif kind < 0.95:
+                payload['water'].append({'date': day, 'amount_ml': random.choice([250, 330, 500])})
+            else:
+                payload['weights'].append({'date': day, 'weight': round(random.uniform(60, 90), 1)})
+        return payload
+
+    def report(self, label, started, queries, entries):
+        seconds = time.perf_counter() - started
+        self.stdout.write(
+            f'{label}: {entries} entries in {seconds:.2f}s ({entries / seconds:.0f} entries/s, {queries} queries)'
+        )
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from caloe.models import CustomUser
+from caloe.recommendations import CHUNK_SIZE, batched_user_ids, build_recommendations
+import time
+
+class Command(BaseCommand):
+    help = 'Recompute the time-of-day quick-add recommendations of every user in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--username', type=str, help='Only rebuild this user (default: all users)')
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='Users loaded and scored together')
+
+    def handle(self, *args, **options):
+        users = CustomUser.objects.all()
+        if options['username']:
+            users = users.filter(username=options['username'])
+            if not users.exists():
+                self.stdout.write(self.style.ERROR(f'User {options["username"]} does not exist'))
+                return
+
+        started = time.perf_counter()
+        user_count = 0
+        row_count = 0
+        for user_ids in batched_user_ids(users, options['chunk_size']):
+            row_count += build_recommendations(user_ids)
+            user_count += len(user_ids)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Stored {row_count} recommendations for {user_count} users in {time.perf_counter() - started:.1f}s'
+        ))
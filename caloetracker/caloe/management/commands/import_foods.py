@@ -0,0 +1,162 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from caloe.models import FoodItem, FoodSearchToken, bump_catalog_version, food_catalog_key
+from caloe.search import build_tokens
+import csv
+import json
+import sys
+import time
+
+FIELDS = ('name', 'calories', 'protein', 'carbs', 'fat', 'serving_size')
+NUTRIENT_FIELDS = ('calories', 'protein', 'carbs', 'fat')
+
+
+class Command(BaseCommand):
+    help = 'Stream a CSV/JSONL nutrition dataset into the system food catalog with batched upserts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', type=str, help='CSV or JSONL file, or - for stdin')
+        parser.add_argument('--format', choices=['csv', 'jsonl'],
+                            help='Input format (default: from the file extension)')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--map', action='append', default=[], metavar='FIELD=COLUMN',
+                            help='Read FIELD from COLUMN, e.g. --map calories=energy_kcal')
+        parser.add_argument('--default-serving-size', default='100g')
+
+    def handle(self, *args, **options):
+        input_format = options['format'] or ('csv' if options['path'].endswith('.csv') else 'jsonl')
+        column_map = self.parse_column_map(options['map'])
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError('--batch-size must be positive')
+
+        self.counts = {'created': 0, 'updated': 0, 'unchanged': 0, 'duplicate': 0, 'skipped': 0}
+        started = time.perf_counter()
+        rows_read = 0
+
+        stream = sys.stdin if options['path'] == '-' else open(options['path'], newline='', encoding='utf-8')
+        try:
+            records = csv.DictReader(stream) if input_format == 'csv' else self.read_jsonl(stream)
+            batch = {}
+            for record in records:
+                rows_read += 1
+                food = self.clean(record, column_map, options['default_serving_size'])
+                if food is None:
+                    self.counts['skipped'] += 1
+                    continue
+                # Later rows win when the same food appears twice in a batch;
+                # across batches the existing-row lookup in upsert() dedupes
+                if food['catalog_key'] in batch:
+                    self.counts['duplicate'] += 1
+                batch[food['catalog_key']] = food
+                if len(batch) >= batch_size:
+                    self.upsert(batch)
+                    batch = {}
+                    if options['verbosity'] > 1:
+                        self.report_progress(rows_read, started)
+            self.upsert(batch)
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+        if self.counts['created'] or self.counts['updated']:
+            # Bulk writes skip the signals, so invalidate catalog-backed ETags
+            # here, once for the whole import
+            bump_catalog_version()
+
+        elapsed = time.perf_counter() - started
+        rate = rows_read / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {rows_read} rows in {elapsed:.1f}s ({rate:.0f} rows/s): '
+            f'{self.counts["created"]} created, {self.counts["updated"]} updated, '
+            f'{self.counts["unchanged"]} unchanged, {self.counts["duplicate"]} duplicate, '
+            f'{self.counts["skipped"]} skipped'
+        ))
+
+    def parse_column_map(self, mappings):
+        column_map = {field: field for field in FIELDS}
+        for mapping in mappings:
+            field, _, column = mapping.partition('=')
+            if field not in FIELDS or not column:
+                raise CommandError(f'Invalid --map {mapping!r}; expected one of {", ".join(FIELDS)}=COLUMN')
+            column_map[field] = column
+        return column_map
+
+    def read_jsonl(self, stream):
+        for line_number, line in enumerate(stream, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                self.stderr.write(f'Line {line_number}: invalid JSON, skipping')
+                yield {}
+                continue
+            if not isinstance(record, dict):
+                self.stderr.write(f'Line {line_number}: not a JSON object, skipping')
+                yield {}
+                continue
+            yield record
+
+    def clean(self, record, column_map, default_serving_size):
+        """Normalized food values for one input record, or None if unusable"""
+        name = ' '.join(str(record.get(column_map['name']) or '').split())[:200]
+        serving_size = ' '.join(str(record.get(column_map['serving_size']) or '').split())[:100]
+        if not name:
+            return None
+        food = {'name': name, 'serving_size': serving_size or default_serving_size}
+        for field in NUTRIENT_FIELDS:
+            value = record.get(column_map[field])
+            try:
+                food[field] = round(float(value), 2) if value not in (None, '') else 0.0
+            except (TypeError, ValueError):
+                return None
+            if food[field] < 0:
+                return None
+        food['catalog_key'] = food_catalog_key(food['name'], food['serving_size'])
+        return food
+
+    def upsert(self, batch):
+        """Insert new foods and update changed ones for one batch, in one transaction"""
+        if not batch:
+            return
+        with transaction.atomic():
+            existing = {
+                food.catalog_key: food
+                for food in FoodItem.objects.filter(
+                    created_by__isnull=True,
+                    catalog_key__in=list(batch),
+                ).only('id', 'catalog_key', *FIELDS)
+            }
+
+            to_create = []
+            to_update = []
+            for key, values in batch.items():
+                food = existing.get(key)
+                if food is None:
+                    to_create.append(FoodItem(**values))
+                # The catalog key already matches, so a row that differs only in
+                # the spelling of its name or serving is the same food. Leaving
+                # it alone keeps a re-run of a file with such duplicates a no-op.
+                elif any(getattr(food, field) != values[field] for field in NUTRIENT_FIELDS):
+                    for field in FIELDS:
+                        setattr(food, field, values[field])
+                    to_update.append(food)
+                else:
+                    self.counts['unchanged'] += 1
+
+            if to_create:
+                created = FoodItem.objects.bulk_create(to_create)
+                # bulk_create skips post_save, so index the new rows here. Updated
+                # rows keep their catalog key and therefore their tokens.
+                FoodSearchToken.objects.bulk_create(build_tokens(created))
+            if to_update:
+                FoodItem.objects.bulk_update(to_update, FIELDS)
+
+        self.counts['created'] += len(to_create)
+        self.counts['updated'] += len(to_update)
+
+    def report_progress(self, rows_read, started):
+        elapsed = time.perf_counter() - started
+        if elapsed:
+            self.stdout.write(f'{rows_read} rows ({rows_read / elapsed:.0f} rows/s)')
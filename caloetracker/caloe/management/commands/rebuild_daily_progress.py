@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from caloe.ledger import find_drift, rebuild_daily_progress
+from caloe.models import CustomUser
+
+class Command(BaseCommand):
+    help = 'Recompute DailyProgress totals from the logged meals and reconcile the nutrition ledger'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--username', type=str, help='Only rebuild this user (default: all users)')
+        parser.add_argument('--check', action='store_true', help='Only report days that drifted, change nothing')
+
+    def handle(self, *args, **options):
+        user_ids = None
+        if options['username']:
+            user_ids = list(CustomUser.objects.filter(username=options['username']).values_list('pk', flat=True))
+            if not user_ids:
+                self.stdout.write(self.style.ERROR(f'User {options["username"]} does not exist'))
+                return
+
+        drift = find_drift(user_ids) if options['check'] else rebuild_daily_progress(user_ids)
+        for row in drift:
+            self.stdout.write(
+                f'user {row.user_id} {row.date}: stored {row.stored[0]:.1f} kcal, '
+                f'meals {row.meals[0]:.1f} kcal, ledger {row.ledger[0]:.1f} kcal'
+            )
+
+        if options['check']:
+            style = self.style.WARNING if drift else self.style.SUCCESS
+            self.stdout.write(style(f'{len(drift)} days drifted from their meals or ledger'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Rebuilt {len(drift)} days'))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+from caloe.search import rebuild_index
+
+class Command(BaseCommand):
+    help = 'Rebuild the food search token index from all food items'
+
+    def handle(self, *args, **options):
+        count = rebuild_index()
+        self.stdout.write(
+            self.style.SUCCESS(f'Indexed {count} food items')
+        )
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from caloe.models import CustomUser
+from caloe.usage import rebuild_food_usage
+
+class Command(BaseCommand):
+    help = 'Rebuild the per-user food usage scores behind quick-add from the meal history'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--username', type=str, help='Only rebuild this user (default: all users)')
+
+    def handle(self, *args, **options):
+        users = CustomUser.objects.all()
+        if options['username']:
+            users = users.filter(username=options['username'])
+            if not users.exists():
+                self.stdout.write(self.style.ERROR(f'User {options["username"]} does not exist'))
+                return
+
+        user_count = 0
+        food_count = 0
+        for user in users.iterator():
+            with transaction.atomic():
+                food_count += rebuild_food_usage(user)
+            user_count += 1
+
+        self.stdout.write(
+            self.style.SUCCESS(f'Rebuilt usage of {food_count} foods for {user_count} users')
+        )
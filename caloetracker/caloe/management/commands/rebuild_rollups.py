@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from caloe.models import CustomUser
+from caloe.rollups import rebuild_user_rollups
+
+class Command(BaseCommand):
+    help = 'Rebuild the weekly and monthly analytics rollups from the daily data'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--username', type=str, help='Only rebuild this user (default: all users)')
+
+    def handle(self, *args, **options):
+        users = CustomUser.objects.all()
+        if options['username']:
+            users = users.filter(username=options['username'])
+            if not users.exists():
+                self.stdout.write(self.style.ERROR(f'User {options["username"]} does not exist'))
+                return
+
+        count = 0
+        for user in users.iterator():
+            with transaction.atomic():
+                rebuild_user_rollups(user)
+            count += 1
+
+        self.stdout.write(
+            self.style.SUCCESS(f'Rebuilt rollups for {count} users')
+        )
@@ -0,0 +1,79 @@
+"""
+In-process request metrics in the Prometheus text format.
+
+PerformanceMiddleware observes every sampled request into the histograms
+below, labelled by view and method, and the metrics view renders them with
+caloe.cache's counters. Each process keeps its own numbers, so every worker
+has to be scraped.
+"""
+import threading
+
+from .cache import OUTCOMES, cache_stats
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+class Histogram:
+    """Cumulative buckets, sum and count per set of label values"""
+
+    def __init__(self, name, help, buckets, labels=('view', 'method')):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self.labels = labels
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, label_values, value):
+        with self.lock:
+            series = self.series.get(label_values)
+            if series is None:
+                # One count per bucket, then +Inf, then the sum
+                series = self.series[label_values] = [0] * (len(self.buckets) + 1) + [0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += 1
+            series[-1] += value
+
+    def clear(self):
+        with self.lock:
+            self.series.clear()
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self.lock:
+            series = sorted((label_values, list(values)) for label_values, values in self.series.items())
+        for label_values, values in series:
+            labels = ','.join(f'{label}="{escape(value)}"' for label, value in zip(self.labels, label_values))
+            for bound, count in zip(self.buckets + ('+Inf',), values):
+                lines.append(f'{self.name}_bucket{{{labels},le="{bound}"}} {count}')
+            lines.append(f'{self.name}_sum{{{labels}}} {values[-1]}')
+            lines.append(f'{self.name}_count{{{labels}}} {values[-2]}')
+        return lines
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+REQUEST_SECONDS = Histogram('caloe_request_duration_seconds', 'Wall time of requests', DURATION_BUCKETS)
+QUERY_COUNT = Histogram('caloe_request_queries', 'ORM queries per request', QUERY_BUCKETS)
+QUERY_SECONDS = Histogram('caloe_request_query_seconds', 'Time per request spent in ORM queries', DURATION_BUCKETS)
+TEMPLATE_SECONDS = Histogram('caloe_request_template_seconds', 'Time per request spent rendering templates', DURATION_BUCKETS)
+RESPONSE_BYTES = Histogram('caloe_response_size_bytes', 'Size of non-streaming response bodies', SIZE_BUCKETS)
+HISTOGRAMS = (REQUEST_SECONDS, QUERY_COUNT, QUERY_SECONDS, TEMPLATE_SECONDS, RESPONSE_BYTES)
+
+
+def render_metrics():
+    """All metrics of this process as Prometheus text exposition"""
+    lines = []
+    for histogram in HISTOGRAMS:
+        lines += histogram.render()
+    lines += ['# HELP caloe_cache_requests_total Lookups of caloe.cache entries by outcome', '# TYPE caloe_cache_requests_total counter']
+    for name, entry in cache_stats().items():
+        for outcome, label in OUTCOMES.items():
+            lines.append(f'caloe_cache_requests_total{{name="{escape(name)}",outcome="{outcome}"}} {entry[label]}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,173 @@
+"""
+Per-request performance instrumentation.
+
+PerformanceMiddleware times a sampled share of requests (CALOE_PERF_SAMPLE_RATE)
+and records, per view, the wall time, ORM query count and time, template
+render time and response size:
+
+- in a Server-Timing header, which browser dev tools show per request;
+- in the histograms of caloe.metrics, served to Prometheus by the metrics view;
+- as one JSON line on the caloe.performance logger for requests slower than
+  CALOE_SLOW_REQUEST_MS, with the slowest SQL statements.
+
+The figures are gathered through a context variable, so they follow the
+request into the threads that run sync code for async views. Queries are
+timed by an execute wrapper that apps.ready installs on every connection,
+and templates by the TimedDjangoTemplates backend. Requests that are not
+sampled pay one context variable lookup per query and per render.
+"""
+import contextvars
+import heapq
+import json
+import logging
+import random
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from django.template.backends.django import DjangoTemplates, Template
+
+from .metrics import QUERY_COUNT, QUERY_SECONDS, REQUEST_SECONDS, RESPONSE_BYTES, TEMPLATE_SECONDS
+
+logger = logging.getLogger('caloe.performance')
+
+DEFAULT_SAMPLE_RATE = 1.0
+DEFAULT_SLOW_REQUEST_MS = 500
+SLOW_QUERIES_LOGGED = 5
+SQL_LOG_LENGTH = 1000
+
+_timings = contextvars.ContextVar('caloe_request_timings', default=None)
+
+
+class RequestTimings:
+    __slots__ = ('queries', 'template_seconds')
+
+    def __init__(self):
+        # (seconds, sql) per statement
+        self.queries = []
+        self.template_seconds = 0.0
+
+    @property
+    def query_seconds(self):
+        return sum(seconds for seconds, _ in self.queries)
+
+
+def time_query(execute, sql, params, many, context):
+    timings = _timings.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.queries.append((time.perf_counter() - started, sql))
+
+
+def install_query_timer(sender, connection, **kwargs):
+    if time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(time_query)
+
+
+class TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        timings = _timings.get()
+        if timings is None:
+            return super().render(context, request)
+        started = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            timings.template_seconds += time.perf_counter() - started
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """The Django template backend, with render time counted per request"""
+
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name).template, self)
+
+
+class PerformanceMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if not self.sampled():
+            return self.get_response(request)
+        timings = RequestTimings()
+        token = _timings.set(timings)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _timings.reset(token)
+        self.record(request, response, timings, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        if not self.sampled():
+            return await self.get_response(request)
+        timings = RequestTimings()
+        token = _timings.set(timings)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _timings.reset(token)
+        self.record(request, response, timings, time.perf_counter() - started)
+        return response
+
+    def sampled(self):
+        rate = getattr(settings, 'CALOE_PERF_SAMPLE_RATE', DEFAULT_SAMPLE_RATE)
+        return rate >= 1 or random.random() < rate
+
+    def record(self, request, response, timings, seconds):
+        match = request.resolver_match
+        labels = (match.view_name if match else '<unresolved>', request.method)
+        query_seconds = timings.query_seconds
+        # Streaming bodies are still to be produced; their time is not
+        # included either
+        size = None if isinstance(response, StreamingHttpResponse) else len(response.content)
+
+        REQUEST_SECONDS.observe(labels, seconds)
+        QUERY_COUNT.observe(labels, len(timings.queries))
+        QUERY_SECONDS.observe(labels, query_seconds)
+        TEMPLATE_SECONDS.observe(labels, timings.template_seconds)
+        if size is not None:
+            RESPONSE_BYTES.observe(labels, size)
+
+        response['Server-Timing'] = ', '.join([
+            f'app;dur={seconds * 1000:.1f}',
+            f'db;dur={query_seconds * 1000:.1f};desc="{len(timings.queries)} queries"',
+            f'tpl;dur={timings.template_seconds * 1000:.1f}',
+        ])
+
+        if seconds * 1000 >= getattr(settings, 'CALOE_SLOW_REQUEST_MS', DEFAULT_SLOW_REQUEST_MS):
+            slowest = heapq.nlargest(SLOW_QUERIES_LOGGED, timings.queries, key=lambda query: query[0])
+            logger.warning(json.dumps({
+                'event': 'slow_request',
+                'view': labels[0],
+                'method': request.method,
+                'path': request.path,
+                'status': response.status_code,
+                'duration_ms': round(seconds * 1000, 1),
+                'queries': len(timings.queries),
+                'query_ms': round(query_seconds * 1000, 1),
+                'template_ms': round(timings.template_seconds * 1000, 1),
+                'response_bytes': size,
+                'slowest_queries': [
+                    {'ms': round(duration * 1000, 2), 'sql': sql[:SQL_LOG_LENGTH]} for duration, sql in slowest
+                ],
+            }))
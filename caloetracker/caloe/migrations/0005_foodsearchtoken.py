@@ -0,0 +1,56 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:46
+
+import re
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def tokenize(text):
+    # Frozen copy of caloe.search.tokenize, so later tokenizer changes do not
+    # change what this migration does
+    tokens = []
+    for token in re.findall(r'\w+', (text or '').casefold()):
+        if token not in tokens:
+            tokens.append(token)
+    return tokens
+
+
+def index_existing_food_items(apps, schema_editor):
+    FoodItem = apps.get_model('caloe', 'FoodItem')
+    FoodSearchToken = apps.get_model('caloe', 'FoodSearchToken')
+    tokens = []
+    for food_item in FoodItem.objects.only('id', 'name', 'created_by_id').iterator(chunk_size=2000):
+        tokens.extend(
+            FoodSearchToken(food_item_id=food_item.pk, created_by_id=food_item.created_by_id, token=token[:200])
+            for token in tokenize(food_item.name)
+        )
+        if len(tokens) >= 2000:
+            FoodSearchToken.objects.bulk_create(tokens)
+            tokens = []
+    FoodSearchToken.objects.bulk_create(tokens)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('caloe', '0004_alter_dailyprogress_date'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FoodSearchToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(max_length=200)),
+                ('created_by', models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+                ('food_item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_tokens', to='caloe.fooditem')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['token', 'created_by', 'food_item'], name='caloe_foodsearch_token_idx')],
+                'unique_together': {('food_item', 'token')},
+            },
+        ),
+        migrations.RunPython(index_existing_food_items, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:53
+
+import re
+
+from django.db import migrations, models
+
+
+def food_catalog_key(name, serving_size):
+    # Frozen copy of caloe.models.food_catalog_key, so later changes to the
+    # key do not change what this migration does
+    words = ' '.join(re.findall(r'\w+', (name or '').casefold()))
+    serving = ' '.join((serving_size or '').casefold().split())
+    return f"{words}|{serving}"[:300]
+
+
+def backfill_catalog_keys(apps, schema_editor):
+    FoodItem = apps.get_model('caloe', 'FoodItem')
+    batch = []
+    for food_item in FoodItem.objects.only('id', 'name', 'serving_size').iterator(chunk_size=2000):
+        food_item.catalog_key = food_catalog_key(food_item.name, food_item.serving_size)
+        batch.append(food_item)
+        if len(batch) >= 2000:
+            FoodItem.objects.bulk_update(batch, ['catalog_key'])
+            batch = []
+    FoodItem.objects.bulk_update(batch, ['catalog_key'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('caloe', '0005_foodsearchtoken'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fooditem',
+            name='catalog_key',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=300),
+        ),
+        migrations.RunPython(backfill_catalog_keys, migrations.RunPython.noop),
+    ]
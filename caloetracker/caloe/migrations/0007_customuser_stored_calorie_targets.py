@@ -0,0 +1,46 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:57
+
+from django.db import migrations, models
+
+
+def backfill_calorie_targets(apps, schema_editor):
+    # Frozen copy of CustomUser.calculate_bmr / calculate_daily_calorie_target
+    CustomUser = apps.get_model('caloe', 'CustomUser')
+    batch = []
+    for user in CustomUser.objects.only('id', 'age', 'gender', 'height', 'weight', 'goal', 'activity_level').iterator(chunk_size=1000):
+        if None in (user.age, user.height, user.weight):
+            maintenance = target = 0
+        else:
+            male_bmr = 88.362 + (13.397 * user.weight) + (4.799 * user.height) - (5.677 * user.age)
+            female_bmr = 447.593 + (9.247 * user.weight) + (3.098 * user.height) - (4.330 * user.age)
+            bmr = {'M': male_bmr, 'F': female_bmr}.get(user.gender, (male_bmr + female_bmr) / 2)
+            maintenance = round(bmr * user.activity_level)
+            target = maintenance + {'LOSE': -500, 'GAIN': 500}.get(user.goal, 0)
+        user.maintenance_calories = maintenance
+        user.daily_calorie_target = target
+        batch.append(user)
+        if len(batch) >= 1000:
+            CustomUser.objects.bulk_update(batch, ['maintenance_calories', 'daily_calorie_target'])
+            batch = []
+    CustomUser.objects.bulk_update(batch, ['maintenance_calories', 'daily_calorie_target'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('caloe', '0006_fooditem_catalog_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='daily_calorie_target',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='customuser',
+            name='maintenance_calories',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_calorie_targets, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('caloe', '0007_customuser_stored_calorie_targets'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dailyprogress',
+            name='calorie_target',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='dailyprogress',
+            name='carbs_target',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='dailyprogress',
+            name='fat_target',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='dailyprogress',
+            name='protein_target',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:59
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('caloe', '0008_dailyprogress_target_snapshot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NutritionRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('WEEK', 'ISO Week'), ('MONTH', 'Month')], max_length=5)),
+                ('period_start', models.DateField(help_text='Monday of the ISO week or first day of the month')),
+                ('days_logged', models.PositiveIntegerField(default=0)),
+                ('calories_sum', models.FloatField(default=0)),
+                ('calories_avg', models.FloatField(blank=True, null=True)),
+                ('calories_min', models.FloatField(blank=True, null=True)),
+                ('calories_max', models.FloatField(blank=True, null=True)),
+                ('calorie_target_avg', models.FloatField(blank=True, null=True)),
+                ('protein_sum', models.FloatField(default=0)),
+                ('protein_avg', models.FloatField(blank=True, null=True)),
+                ('carbs_sum', models.FloatField(default=0)),
+                ('carbs_avg', models.FloatField(blank=True, null=True)),
+                ('fat_sum', models.FloatField(default=0)),
+                ('fat_avg', models.FloatField(blank=True, null=True)),
+                ('water_days', models.PositiveIntegerField(default=0)),
+                ('water_sum', models.IntegerField(default=0)),
+                ('water_avg', models.FloatField(blank=True, null=True)),
+                ('water_min', models.IntegerField(blank=True, null=True)),
+                ('water_max', models.IntegerField(blank=True, null=True)),
+                ('weight_count', models.PositiveIntegerField(default=0)),
+                ('weight_avg', models.FloatField(blank=True, null=True)),
+                ('weight_min', models.FloatField(blank=True, null=True)),
+                ('weight_max', models.FloatField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['period_start'],
+                'unique_together': {('user', 'period', 'period_start')},
+            },
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:15
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('caloe', '0010_customuser_data_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FoodUsage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.FloatField(default=0)),
+                ('use_count', models.PositiveIntegerField(default=0, help_text='Meals the food was logged in')),
+                ('last_used', models.DateTimeField(blank=True, null=True)),
+                ('food_item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='usages', to='caloe.fooditem')),
+                ('user', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', '-score'], name='caloe_foodusage_score_idx')],
+                'unique_together': {('user', 'food_item')},
+            },
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:19
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('caloe', '0011_foodusage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FoodRecommendation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('slot', models.CharField(max_length=24)),
+                ('rank', models.PositiveSmallIntegerField()),
+                ('score', models.FloatField()),
+                ('food_item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recommendations', to='caloe.fooditem')),
+                ('user', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['slot', 'rank'],
+                'unique_together': {('user', 'slot', 'rank')},
+            },
+        ),
+    ]
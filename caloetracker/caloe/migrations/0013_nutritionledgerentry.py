@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:28
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('caloe', '0012_foodrecommendation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NutritionLedgerEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('kind', models.CharField(choices=[('ADD', 'Meal added'), ('DELETE', 'Meal deleted'), ('REBUILD', 'Rebuild correction')], max_length=7)),
+                ('meal_pk', models.PositiveBigIntegerField(blank=True, null=True)),
+                ('calories', models.FloatField(default=0)),
+                ('protein', models.FloatField(default=0)),
+                ('carbs', models.FloatField(default=0)),
+                ('fat', models.FloatField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'date'], name='caloe_ledger_user_date_idx')],
+            },
+        ),
+    ]
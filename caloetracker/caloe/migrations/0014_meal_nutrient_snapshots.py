@@ -0,0 +1,107 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:31
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Sum
+
+BATCH_SIZE = 2000
+NUTRIENTS = ('calories', 'protein', 'carbs', 'fat')
+TOTAL_FIELDS = ['total_calories', 'total_protein', 'total_carbs', 'total_fat']
+
+
+def backfill_nutrient_snapshots(apps, schema_editor):
+    # Walk the tables in primary key batches so memory stays flat on large histories
+    Meal = apps.get_model('caloe', 'Meal')
+    MealFoodItem = apps.get_model('caloe', 'MealFoodItem')
+    last_pk = 0
+    while True:
+        lines = list(
+            MealFoodItem.objects.filter(pk__gt=last_pk).select_related('food_item').order_by('pk')[:BATCH_SIZE]
+        )
+        if not lines:
+            break
+        for line in lines:
+            if line.food_item is not None:
+                line.food_name = line.food_item.name
+                for nutrient in NUTRIENTS:
+                    setattr(line, f'total_{nutrient}', getattr(line.food_item, nutrient) * line.quantity)
+        MealFoodItem.objects.bulk_update(lines, ['food_name', *TOTAL_FIELDS])
+        last_pk = lines[-1].pk
+
+    last_pk = 0
+    while True:
+        meals = list(Meal.objects.filter(pk__gt=last_pk).order_by('pk').only('pk')[:BATCH_SIZE])
+        if not meals:
+            break
+        totals = {
+            row['meal_id']: row
+            for row in MealFoodItem.objects.filter(meal_id__in=[meal.pk for meal in meals]).values('meal_id').annotate(
+                **{field: Sum(field) for field in TOTAL_FIELDS}
+            ).order_by()
+        }
+        for meal in meals:
+            for field in TOTAL_FIELDS:
+                setattr(meal, field, totals.get(meal.pk, {}).get(field) or 0)
+        Meal.objects.bulk_update(meals, TOTAL_FIELDS)
+        last_pk = meals[-1].pk
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('caloe', '0013_nutritionledgerentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='meal',
+            name='total_calories',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='meal',
+            name='total_carbs',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='meal',
+            name='total_fat',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='meal',
+            name='total_protein',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='mealfooditem',
+            name='food_name',
+            field=models.CharField(blank=True, max_length=200),
+        ),
+        migrations.AddField(
+            model_name='mealfooditem',
+            name='total_calories',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='mealfooditem',
+            name='total_carbs',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='mealfooditem',
+            name='total_fat',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='mealfooditem',
+            name='total_protein',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='mealfooditem',
+            name='food_item',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='caloe.fooditem'),
+        ),
+        migrations.RunPython(backfill_nutrient_snapshots, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:34
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('caloe', '0014_meal_nutrient_snapshots'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='meal',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AlterField(
+            model_name='meal',
+            name='date',
+            field=models.DateField(default=django.utils.timezone.localdate),
+        ),
+    ]
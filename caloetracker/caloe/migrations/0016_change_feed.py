@@ -0,0 +1,114 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:39
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+BATCH_SIZE = 2000
+# Model and owner field of every record in the sync feed
+TRACKED = [('FoodItem', 'created_by_id'), ('Meal', 'user_id'), ('WaterIntake', 'user_id'),
+           ('WeightLog', 'user_id'), ('ProgressPhoto', 'user_id')]
+
+
+def number_existing_records(apps, schema_editor):
+    # Give existing records their owners' first sequence numbers, in primary
+    # key batches, so a first sync pages through them like any other change
+    CustomUser = apps.get_model('caloe', 'CustomUser')
+    counters = {}
+    for model_name, owner_field in TRACKED:
+        model = apps.get_model('caloe', model_name)
+        last_pk = 0
+        while True:
+            records = list(
+                model.objects.filter(pk__gt=last_pk, **{f'{owner_field}__isnull': False})
+                .order_by('pk').only('pk', owner_field)[:BATCH_SIZE]
+            )
+            if not records:
+                break
+            for record in records:
+                owner_id = getattr(record, owner_field)
+                counters[owner_id] = record.change_seq = counters.get(owner_id, 0) + 1
+            model.objects.bulk_update(records, ['change_seq'])
+            last_pk = records[-1].pk
+    users = [CustomUser(pk=user_id, change_seq=seq) for user_id, seq in counters.items()]
+    CustomUser.objects.bulk_update(users, ['change_seq'], batch_size=BATCH_SIZE)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('caloe', '0015_meal_date_default'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=20)),
+                ('object_pk', models.PositiveBigIntegerField()),
+                ('change_seq', models.PositiveBigIntegerField()),
+                ('deleted_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='customuser',
+            name='change_seq',
+            field=models.PositiveBigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='fooditem',
+            name='change_seq',
+            field=models.PositiveBigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='meal',
+            name='change_seq',
+            field=models.PositiveBigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='progressphoto',
+            name='change_seq',
+            field=models.PositiveBigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='waterintake',
+            name='change_seq',
+            field=models.PositiveBigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='weightlog',
+            name='change_seq',
+            field=models.PositiveBigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='fooditem',
+            index=models.Index(fields=['created_by', 'change_seq'], name='caloe_fooditem_changes_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='meal',
+            index=models.Index(fields=['user', 'change_seq'], name='caloe_meal_changes_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='progressphoto',
+            index=models.Index(fields=['user', 'change_seq'], name='caloe_photo_changes_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='waterintake',
+            index=models.Index(fields=['user', 'change_seq'], name='caloe_water_changes_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='weightlog',
+            index=models.Index(fields=['user', 'change_seq'], name='caloe_weightlog_changes_idx'),
+        ),
+        migrations.AddField(
+            model_name='tombstone',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='tombstone',
+            index=models.Index(fields=['user', 'change_seq'], name='caloe_tombstone_changes_idx'),
+        ),
+        migrations.RunPython(number_existing_records, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,68 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:43
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+# Names Django gave the FK indexes on user_id in 0001
+FK_INDEXES = [
+    ('caloe_meal', 'caloe_meal_user_id_6d03c2b5'),
+    ('caloe_progressphoto', 'caloe_progressphoto_user_id_8b13b61f'),
+    ('caloe_waterintake', 'caloe_waterintake_user_id_9df35008'),
+    ('caloe_weightlog', 'caloe_weightlog_user_id_a10db134'),
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('caloe', '0016_change_feed'),
+    ]
+
+    operations = [
+        # The composite indexes below start with user_id, so the single column
+        # FK indexes are dropped in place rather than by rebuilding the tables
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AlterField(
+                    model_name='meal',
+                    name='user',
+                    field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+                ),
+                migrations.AlterField(
+                    model_name='progressphoto',
+                    name='user',
+                    field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+                ),
+                migrations.AlterField(
+                    model_name='waterintake',
+                    name='user',
+                    field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+                ),
+                migrations.AlterField(
+                    model_name='weightlog',
+                    name='user',
+                    field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+                ),
+            ],
+            database_operations=[
+                migrations.RunSQL(
+                    f'DROP INDEX "{name}"',
+                    f'CREATE INDEX "{name}" ON "{table}" ("user_id")',
+                )
+                for table, name in FK_INDEXES
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='meal',
+            index=models.Index(fields=['user', 'date', 'created_at'], name='caloe_meal_user_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='progressphoto',
+            index=models.Index(fields=['user', 'date'], name='caloe_photo_user_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='waterintake',
+            index=models.Index(fields=['user', 'date', 'time', 'amount_ml'], name='caloe_water_user_date_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('caloe', '0019_catalog_version'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='nutritionledgerentry',
+            name='kind',
+            field=models.CharField(choices=[('ADD', 'Meal added'), ('DELETE', 'Meal deleted'), ('EDIT', 'Meal line edited'), ('REBUILD', 'Rebuild correction')], max_length=7),
+        ),
+    ]
@@ -1,4 +1,7 @@
-from django.db import models
+import re
+
+from django.db import models, transaction
+from django.db.models import F
 from django.contrib.auth.models import AbstractUser
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.utils import timezone  # ADD THIS IMPORT
@@ -41,6 +44,24 @@ class CustomUser(AbstractUser):
     carbs_goal = models.FloatField(default=0, help_text="Carbs goal in grams")
     fat_goal = models.FloatField(default=0, help_text="Fat goal in grams")
     
+    # Stored results of the BMR formulas, refreshed by save() so pages read
+    # them instead of recomputing on every access
+    maintenance_calories = models.IntegerField(default=0, editable=False)
+    daily_calorie_target = models.IntegerField(default=0, editable=False)
+    
+    # Bumped by every write that changes what the user's JSON endpoints
+    # return; their ETags are derived from it
+    data_version = models.PositiveBigIntegerField(default=0, editable=False)
+    # Last change sequence number handed out to the user's synced records
+    change_seq = models.PositiveBigIntegerField(default=0, editable=False)
+    
+    # Counters that only ever move through atomic UPDATEs
+    COUNTER_FIELDS = ('data_version', 'change_seq')
+    
+    # Fields the stored calorie values are derived from
+    PROFILE_FIELDS = ('age', 'gender', 'height', 'weight', 'goal', 'activity_level')
+    TARGET_FIELDS = ('maintenance_calories', 'daily_calorie_target')
+    
     def calculate_bmr(self):
         """Calculate Basal Metabolic Rate"""
         if self.gender == 'M':
@@ -58,8 +79,8 @@ class CustomUser(AbstractUser):
         bmr = self.calculate_bmr()
         return round(bmr * self.activity_level)
     
-    def get_daily_calorie_target(self):
-        """Get daily calorie target based on goal"""
+    def calculate_daily_calorie_target(self):
+        """Calculate daily calorie target based on goal"""
         maintenance = self.calculate_maintenance_calories()
         
         if self.goal == 'LOSE':
@@ -68,6 +89,45 @@ class CustomUser(AbstractUser):
             return maintenance + 500  # 500 calorie surplus for weight gain
         else:
             return maintenance
+    
+    def refresh_calorie_targets(self):
+        """Recompute the stored maintenance and target calories from the profile"""
+        if None in (self.age, self.height, self.weight):
+            # Incomplete profile (e.g. created with createsuperuser)
+            self.maintenance_calories = 0
+            self.daily_calorie_target = 0
+        else:
+            self.maintenance_calories = self.calculate_maintenance_calories()
+            self.daily_calorie_target = self.calculate_daily_calorie_target()
+    
+    def get_daily_calorie_target(self):
+        """Get the stored daily calorie target"""
+        return self.daily_calorie_target
+    
+    def bump_data_version(self):
+        """Mark the user's data as changed, invalidating their ETags"""
+        CustomUser.objects.filter(pk=self.pk).update(data_version=F('data_version') + 1)
+    
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        targets_changed = update_fields is None or bool(set(self.PROFILE_FIELDS) & set(update_fields))
+        if update_fields is None:
+            self.refresh_calorie_targets()
+            if not self._state.adding:
+                # Writing back a stale in-memory data_version could reuse an
+                # ETag (and a stale change_seq a sequence number), so the
+                # counters only ever move through atomic UPDATEs
+                kwargs['update_fields'] = [
+                    field.attname for field in self._meta.concrete_fields
+                    if not field.primary_key and field.name not in self.COUNTER_FIELDS
+                ]
+        elif targets_changed:
+            self.refresh_calorie_targets()
+            kwargs['update_fields'] = {*update_fields, *self.TARGET_FIELDS}
+        adding = self._state.adding
+        super().save(*args, **kwargs)
+        if targets_changed and not adding:
+            self.bump_data_version()
 
     def calculate_macro_goals(self):
         """Calculate default macro goals based on calorie target"""
@@ -83,7 +143,62 @@ class CustomUser(AbstractUser):
     def __str__(self):
         return self.username
 
-class FoodItem(models.Model):
+# Largest id a BigAutoField (a signed 64-bit SQLite INTEGER) can hold. Ids
+# from requests above it cannot name a row, and the database driver raises
+# OverflowError for them, so they are dropped before any query.
+MAX_ID = 2 ** 63 - 1
+
+def claim_change_seqs(user_id, count=1):
+    """
+    Reserve count consecutive change sequence numbers of a user, as a range.
+    Call it inside the transaction that writes them: the UPDATE locks the
+    user's row until commit, so a reader never sees a higher number commit
+    before a lower one.
+    """
+    with transaction.atomic(savepoint=False):
+        CustomUser.objects.filter(pk=user_id).update(change_seq=F('change_seq') + count)
+        last = CustomUser.objects.filter(pk=user_id).values_list('change_seq', flat=True).get()
+    return range(last - count + 1, last + 1)
+
+class ChangeTracked(models.Model):
+    """
+    A record of the delta sync feed (caloe.changes). Every save takes the
+    owner's next change sequence number; deletes leave a Tombstone through
+    caloe.signals. bulk_create() skips save(), so bulk writers number their
+    records with caloe.changes.stamp_changes().
+    """
+    # The user whose feed the record belongs to; records without one (system
+    # foods) are not tracked
+    change_owner_field = 'user'
+    
+    change_seq = models.PositiveBigIntegerField(default=0, editable=False)
+    
+    class Meta:
+        abstract = True
+    
+    @property
+    def change_owner_id(self):
+        return getattr(self, f'{self.change_owner_field}_id')
+    
+    def save(self, *args, **kwargs):
+        if self.change_owner_id is None:
+            return super().save(*args, **kwargs)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = {*update_fields, 'change_seq'}
+        with transaction.atomic(savepoint=False):
+            self.change_seq = claim_change_seqs(self.change_owner_id)[0]
+            super().save(*args, **kwargs)
+
+def food_catalog_key(name, serving_size):
+    """Normalized name plus serving size, used to dedupe imported foods"""
+    words = ' '.join(re.findall(r'\w+', (name or '').casefold()))
+    serving = ' '.join((serving_size or '').casefold().split())
+    return f"{words}|{serving}"[:300]
+
+class FoodItem(ChangeTracked):
+    change_owner_field = 'created_by'
+    
     name = models.CharField(max_length=200)
     calories = models.FloatField()
     protein = models.FloatField(default=0)
@@ -92,11 +207,63 @@ class FoodItem(models.Model):
     serving_size = models.CharField(max_length=100, default="100g")
     created_by = models.ForeignKey(CustomUser, on_delete=models.CASCADE, null=True, blank=True)
     is_custom = models.BooleanField(default=False)  # To distinguish system vs custom items
+    catalog_key = models.CharField(max_length=300, blank=True, db_index=True, editable=False)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_by', 'change_seq'], name='caloe_fooditem_changes_idx'),
+        ]
+    
+    def save(self, *args, **kwargs):
+        self.catalog_key = food_catalog_key(self.name, self.serving_size)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and ({'name', 'serving_size'} & set(update_fields)):
+            kwargs['update_fields'] = {*update_fields, 'catalog_key'}
+        super().save(*args, **kwargs)
     
     def __str__(self):
         return f"{self.name} ({self.calories} kcal)"
 
-class Meal(models.Model):
+class FoodSearchToken(models.Model):
+    """One normalized word of a FoodItem name, kept in sync by caloe.signals"""
+    food_item = models.ForeignKey(FoodItem, on_delete=models.CASCADE, related_name='search_tokens')
+    token = models.CharField(max_length=200)
+    # Copy of FoodItem.created_by so visibility is checked inside the index
+    created_by = models.ForeignKey(CustomUser, on_delete=models.CASCADE, null=True, blank=True, db_index=False)
+    
+    class Meta:
+        unique_together = ['food_item', 'token']
+        indexes = [
+            # Prefix lookups range-scan this index and never touch the token table itself
+            models.Index(fields=['token', 'created_by', 'food_item'], name='caloe_foodsearch_token_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.token} -> {self.food_item_id}"
+
+class CatalogVersion(models.Model):
+    """
+    Single row counting changes to the system food catalog. Catalog-backed
+    responses fold it into their ETags and cache keys, so a system food
+    change costs one row update instead of bumping every user.
+    """
+    version = models.PositiveBigIntegerField(default=0)
+    
+    def __str__(self):
+        return f"catalog v{self.version}"
+
+def catalog_version():
+    """The current system catalog version, 0 before its first change"""
+    return CatalogVersion.objects.filter(pk=1).values_list('version', flat=True).first() or 0
+
+def bump_catalog_version():
+    """Mark the system catalog as changed, invalidating catalog-backed ETags"""
+    if not CatalogVersion.objects.filter(pk=1).update(version=F('version') + 1):
+        # First change: insert the row (ignoring a concurrent insert) and count again
+        CatalogVersion.objects.bulk_create([CatalogVersion(pk=1)], ignore_conflicts=True)
+        CatalogVersion.objects.filter(pk=1).update(version=F('version') + 1)
+
+class Meal(ChangeTracked):
     MEAL_TYPES = [
         ('BREAKFAST', 'Breakfast'),
         ('LUNCH', 'Lunch'),
@@ -104,29 +271,74 @@ class Meal(models.Model):
         ('SNACK', 'Snack'),
     ]
     
-    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
+    # Indexed as the prefix of the (user, date, created_at) index
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, db_index=False)
     meal_type = models.CharField(max_length=10, choices=MEAL_TYPES)
-    date = models.DateField(auto_now_add=True)
-    created_at = models.DateTimeField(auto_now_add=True)
+    # Defaults rather than auto_now_add so synced offline meals keep their day
+    date = models.DateField(default=timezone.localdate)
+    created_at = models.DateTimeField(default=timezone.now)
+    # Sums of the line item snapshots, kept up to date as lines change
+    total_calories = models.FloatField(default=0)
+    total_protein = models.FloatField(default=0)
+    total_carbs = models.FloatField(default=0)
+    total_fat = models.FloatField(default=0)
     
-    @property
-    def total_calories(self):
-        return sum(item.total_calories for item in self.food_items.all())
+    class Meta:
+        indexes = [
+            # A day's meals in order, as the dashboard lists them
+            models.Index(fields=['user', 'date', 'created_at'], name='caloe_meal_user_date_idx'),
+            models.Index(fields=['user', 'change_seq'], name='caloe_meal_changes_idx'),
+        ]
     
     def __str__(self):
         return f"{self.user.username} - {self.meal_type} - {self.date}"
 
 class MealFoodItem(models.Model):
     meal = models.ForeignKey(Meal, on_delete=models.CASCADE, related_name='food_items')
-    food_item = models.ForeignKey(FoodItem, on_delete=models.CASCADE)
+    # Nullable so deleting a custom food leaves the history it was logged in
+    food_item = models.ForeignKey(FoodItem, on_delete=models.SET_NULL, null=True, blank=True)
     quantity = models.FloatField(default=1)  # Number of servings
+    # The food's name and nutrients times quantity when the line was logged,
+    # so later edits to the food do not rewrite history
+    food_name = models.CharField(max_length=200, blank=True)
+    total_calories = models.FloatField(default=0)
+    total_protein = models.FloatField(default=0)
+    total_carbs = models.FloatField(default=0)
+    total_fat = models.FloatField(default=0)
     
-    @property
-    def total_calories(self):
-        return self.food_item.calories * self.quantity
+    def capture_nutrients(self, food_item=None):
+        """Snapshot the food's name and nutrients for this line's quantity"""
+        food_item = food_item or self.food_item
+        self.food_name = food_item.name
+        self.total_calories = food_item.calories * self.quantity
+        self.total_protein = food_item.protein * self.quantity
+        self.total_carbs = food_item.carbs * self.quantity
+        self.total_fat = food_item.fat * self.quantity
+    
+    def save(self, *args, **kwargs):
+        # bulk_create() skips this; record_meal() captures and totals itself.
+        # Only the meal's totals follow a line added here: edits and deletes
+        # of logged lines go through caloe.tracking.save_meal_line() and
+        # remove_meal_line(), which also update the day and the ledger.
+        adding = self._state.adding
+        if adding and not self.food_name and self.food_item is not None:
+            self.capture_nutrients()
+        if not adding:
+            return super().save(*args, **kwargs)
+        with transaction.atomic(savepoint=False):
+            super().save(*args, **kwargs)
+            # Lines travel in the sync feed with their meal, so the meal
+            # takes a new change sequence number
+            Meal.objects.filter(pk=self.meal_id).update(
+                change_seq=claim_change_seqs(self.meal.user_id)[0],
+                total_calories=F('total_calories') + self.total_calories,
+                total_protein=F('total_protein') + self.total_protein,
+                total_carbs=F('total_carbs') + self.total_carbs,
+                total_fat=F('total_fat') + self.total_fat,
+            )
     
     def __str__(self):
-        return f"{self.food_item.name} in {self.meal}"
+        return f"{self.food_name} in {self.meal}"
 
 class DailyProgress(models.Model):
     user = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
@@ -137,16 +349,43 @@ class DailyProgress(models.Model):
     total_protein = models.FloatField(default=0)
     total_carbs = models.FloatField(default=0)
     total_fat = models.FloatField(default=0)
+    # The user's targets when the row was first written, so history keeps
+    # the goals that applied on that day
+    calorie_target = models.IntegerField(null=True, blank=True)
+    protein_target = models.FloatField(null=True, blank=True)
+    carbs_target = models.FloatField(null=True, blank=True)
+    fat_target = models.FloatField(null=True, blank=True)
     
     class Meta:
         unique_together = ['user', 'date']
     
-    def calories_remaining(self):
-        target = self.user.get_daily_calorie_target()
+    def capture_targets(self, user=None):
+        """Snapshot the user's current calorie and macro targets"""
+        user = user or self.user
+        self.calorie_target = user.daily_calorie_target
+        self.protein_target = user.protein_goal
+        self.carbs_target = user.carbs_goal
+        self.fat_target = user.fat_goal
+    
+    def save(self, *args, **kwargs):
+        if self._state.adding and self.calorie_target is None:
+            self.capture_targets()
+        super().save(*args, **kwargs)
+    
+    def get_calorie_target(self):
+        """The day's snapshot target, or the user's current one for old rows"""
+        if self.calorie_target is not None:
+            return self.calorie_target
+        return self.user.get_daily_calorie_target()
+    
+    def calories_remaining(self, target=None):
+        if target is None:
+            target = self.get_calorie_target()
         return max(0, target - self.total_calories_consumed)
     
-    def progress_percentage(self):
-        target = self.user.get_daily_calorie_target()
+    def progress_percentage(self, target=None):
+        if target is None:
+            target = self.get_calorie_target()
         if target == 0:
             return 0
         return min(100, (self.total_calories_consumed / target) * 100)
@@ -180,8 +419,9 @@ class DailyProgress(models.Model):
         return f"{self.user.username} - {self.date} - {self.total_calories_consumed} kcal"
 
 # Phase 1: Weight Tracking
-class WeightLog(models.Model):
-    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
+class WeightLog(ChangeTracked):
+    # Indexed as the prefix of the unique (user, date) index
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, db_index=False)
     date = models.DateField(default=timezone.now)  # Now timezone is imported
     weight = models.FloatField(help_text="Weight in kg")
     notes = models.TextField(blank=True)
@@ -190,13 +430,17 @@ class WeightLog(models.Model):
     class Meta:
         unique_together = ['user', 'date']
         ordering = ['-date']
+        indexes = [
+            models.Index(fields=['user', 'change_seq'], name='caloe_weightlog_changes_idx'),
+        ]
     
     def __str__(self):
         return f"{self.user.username} - {self.weight}kg - {self.date}"
 
 # Phase 1: Progress Photos
-class ProgressPhoto(models.Model):
-    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
+class ProgressPhoto(ChangeTracked):
+    # Indexed as the prefix of the (user, date) index
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, db_index=False)
     date = models.DateField(default=timezone.now)
     image = models.ImageField(upload_to='progress_photos/')
     caption = models.CharField(max_length=200, blank=True)
@@ -204,13 +448,18 @@ class ProgressPhoto(models.Model):
     
     class Meta:
         ordering = ['-date']
+        indexes = [
+            models.Index(fields=['user', 'date'], name='caloe_photo_user_date_idx'),
+            models.Index(fields=['user', 'change_seq'], name='caloe_photo_changes_idx'),
+        ]
     
     def __str__(self):
         return f"{self.user.username} - {self.date}"
 
 # Phase 1: Water Intake Tracking
-class WaterIntake(models.Model):
-    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
+class WaterIntake(ChangeTracked):
+    # Indexed as the prefix of the (user, date, time, amount_ml) index
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, db_index=False)
     date = models.DateField(default=timezone.now)
     amount_ml = models.IntegerField(help_text="Amount in milliliters")
     time = models.TimeField(auto_now_add=True)
@@ -218,6 +467,12 @@ class WaterIntake(models.Model):
     
     class Meta:
         ordering = ['-date', '-time']
+        indexes = [
+            # A day's intakes in order; amount_ml makes it covering for the
+            # per-day totals of the tracker, analytics and rollups
+            models.Index(fields=['user', 'date', 'time', 'amount_ml'], name='caloe_water_user_date_idx'),
+            models.Index(fields=['user', 'change_seq'], name='caloe_water_changes_idx'),
+        ]
     
     def __str__(self):
         return f"{self.user.username} - {self.amount_ml}ml - {self.date}"
@@ -227,4 +482,166 @@ class WaterGoal(models.Model):
     daily_goal_ml = models.IntegerField(default=2000, help_text="Daily water goal in ml")
     
     def __str__(self):
-        return f"{self.user.username} - {self.daily_goal_ml}ml"
\ No newline at end of file
+        return f"{self.user.username} - {self.daily_goal_ml}ml"
+
+class NutritionRollup(models.Model):
+    """Per-user ISO week / calendar month summary read by long-range analytics"""
+    PERIOD_CHOICES = [
+        ('WEEK', 'ISO Week'),
+        ('MONTH', 'Month'),
+    ]
+    
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
+    period = models.CharField(max_length=5, choices=PERIOD_CHOICES)
+    period_start = models.DateField(help_text="Monday of the ISO week or first day of the month")
+    
+    # From DailyProgress, one row per logged day
+    days_logged = models.PositiveIntegerField(default=0)
+    calories_sum = models.FloatField(default=0)
+    calories_avg = models.FloatField(null=True, blank=True)
+    calories_min = models.FloatField(null=True, blank=True)
+    calories_max = models.FloatField(null=True, blank=True)
+    calorie_target_avg = models.FloatField(null=True, blank=True)
+    protein_sum = models.FloatField(default=0)
+    protein_avg = models.FloatField(null=True, blank=True)
+    carbs_sum = models.FloatField(default=0)
+    carbs_avg = models.FloatField(null=True, blank=True)
+    fat_sum = models.FloatField(default=0)
+    fat_avg = models.FloatField(null=True, blank=True)
+    
+    # From WaterIntake, summed per day first
+    water_days = models.PositiveIntegerField(default=0)
+    water_sum = models.IntegerField(default=0)
+    water_avg = models.FloatField(null=True, blank=True)
+    water_min = models.IntegerField(null=True, blank=True)
+    water_max = models.IntegerField(null=True, blank=True)
+    
+    # From WeightLog
+    weight_count = models.PositiveIntegerField(default=0)
+    weight_avg = models.FloatField(null=True, blank=True)
+    weight_min = models.FloatField(null=True, blank=True)
+    weight_max = models.FloatField(null=True, blank=True)
+    
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        unique_together = ['user', 'period', 'period_start']
+        ordering = ['period_start']
+    
+    def __str__(self):
+        return f"{self.user.username} - {self.period} {self.period_start}"
+
+class FoodUsage(models.Model):
+    """
+    How often and how recently a user logs a food, maintained by the meal
+    write paths so quick-add is a top-N read of the (user, score) index.
+    score is forward-decayed (see caloe.usage): sorting by it ranks foods by
+    recency-weighted use without rewriting old rows as time passes.
+    """
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, db_index=False)
+    food_item = models.ForeignKey(FoodItem, on_delete=models.CASCADE, related_name='usages')
+    score = models.FloatField(default=0)
+    use_count = models.PositiveIntegerField(default=0, help_text="Meals the food was logged in")
+    last_used = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        unique_together = ['user', 'food_item']
+        indexes = [
+            models.Index(fields=['user', '-score'], name='caloe_foodusage_score_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.user.username} - {self.food_item.name} ({self.use_count})"
+
+class FoodRecommendation(models.Model):
+    """
+    One of the top foods for a quick-add context, precomputed in batch by
+    caloe.recommendations. slot names the context: 'LUNCH@12' for a meal
+    type and hour, '@12' for any meal at that hour, 'with:42' for foods
+    logged together with food 42.
+    """
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, db_index=False)
+    slot = models.CharField(max_length=24)
+    rank = models.PositiveSmallIntegerField()
+    food_item = models.ForeignKey(FoodItem, on_delete=models.CASCADE, related_name='recommendations')
+    score = models.FloatField()
+    
+    class Meta:
+        unique_together = ['user', 'slot', 'rank']
+        ordering = ['slot', 'rank']
+    
+    def __str__(self):
+        return f"{self.user.username} - {self.slot} #{self.rank} {self.food_item.name}"
+
+class NutritionLedgerEntry(models.Model):
+    """
+    Append-only record of one change to a day's nutrition totals. Every
+    meal add or delete, and every line item edit, writes an entry and
+    folds it into DailyProgress in the same transaction, so a day's row
+    always equals the sum of its entries; rebuild_daily_progress appends
+    REBUILD entries for the corrections it makes.
+    """
+    KINDS = [
+        ('ADD', 'Meal added'),
+        ('DELETE', 'Meal deleted'),
+        ('EDIT', 'Meal line edited'),
+        ('REBUILD', 'Rebuild correction'),
+    ]
+    
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, db_index=False)
+    date = models.DateField()
+    kind = models.CharField(max_length=7, choices=KINDS)
+    # Kept as a plain id so the entry outlives the meal it describes
+    meal_pk = models.PositiveBigIntegerField(null=True, blank=True)
+    calories = models.FloatField(default=0)
+    protein = models.FloatField(default=0)
+    carbs = models.FloatField(default=0)
+    fat = models.FloatField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'date'], name='caloe_ledger_user_date_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.user.username} - {self.date} - {self.kind} {self.calories:+.0f} kcal"
+
+class Tombstone(models.Model):
+    """
+    A deleted ChangeTracked record, kept so the sync feed can tell clients
+    to drop it. It takes a change sequence number like any other change.
+    """
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, db_index=False)
+    # Feed name of the record's model, see caloe.changes.FEEDS
+    kind = models.CharField(max_length=20)
+    object_pk = models.PositiveBigIntegerField()
+    change_seq = models.PositiveBigIntegerField()
+    deleted_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'change_seq'], name='caloe_tombstone_changes_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.user_id} - {self.kind} {self.object_pk} deleted"
+
+class SyncBatch(models.Model):
+    """
+    An offline sync batch already imported under its client-chosen id, so a
+    client retrying after a lost response gets the first result back
+    instead of writing every entry again
+    """
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, db_index=False)
+    batch_id = models.CharField(max_length=64)
+    result = models.JSONField()
+    imported_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'batch_id'], name='caloe_syncbatch_unique'),
+        ]
+    
+    def __str__(self):
+        return f"{self.user_id} - batch {self.batch_id}"
@@ -0,0 +1,258 @@
+"""
+Time-of-day aware quick-add recommendations, computed in batch.
+
+build_recommendations() loads the meals of a chunk of users with two
+queries and counts them with NumPy: foods per (meal type, hour of day) slot,
+with uses spread over the neighbouring hours, and foods logged together in
+the same meal. Uses are recency weighted with the same half-life as
+caloe.usage. The top foods of every slot, and the usual companions of every
+food, are stored as FoodRecommendation rows so a request reads one slot with
+one indexed query instead of scoring anything.
+
+Slots are named 'LUNCH@12' (meal type and hour), '@12' (any meal type) and
+'with:42' (foods logged together with food 42).
+"""
+import time
+from itertools import chain
+
+import numpy as np
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import ExtractHour
+
+from .models import CustomUser, FoodRecommendation, Meal, MealFoodItem
+from .usage import HALF_LIFE_DAYS
+
+MEAL_TYPES = [code for code, _ in Meal.MEAL_TYPES]
+MEAL_TYPE_INDEX = {code: index for index, code in enumerate(MEAL_TYPES)}
+# Meal type index of the slots that ignore the meal type
+ANY_MEAL = len(MEAL_TYPES)
+
+TOP_K = 6
+
+# Weight of a use in the slots this many hours away, in both directions
+HOUR_KERNEL = {0: 1.0, 1: 0.5, 2: 0.25}
+
+# Foods must share at least this many meals to count as companions
+MIN_SHARED_MEALS = 2
+
+CHUNK_SIZE = 500
+
+
+def slot_name(meal_type, hour):
+    return f'{meal_type}@{hour}'
+
+
+def companion_slot(food_id):
+    return f'with:{food_id}'
+
+
+def _top_k(groups, scores, k):
+    """Mask of the k best scores within each group"""
+    order = np.lexsort((-scores, groups))
+    ranked = groups[order]
+    starts = np.flatnonzero(np.r_[True, ranked[1:] != ranked[:-1]])
+    sizes = np.diff(np.r_[starts, len(ranked)])
+    ranks = np.empty(len(order), dtype=np.int64)
+    ranks[order] = np.arange(len(order)) - np.repeat(starts, sizes)
+    return ranks < k, ranks
+
+
+def _sum_by(keys, weights):
+    """Unique keys and the summed weights of each"""
+    unique, inverse = np.unique(keys, return_inverse=True)
+    return unique, np.bincount(inverse, weights=weights, minlength=len(unique))
+
+
+def slot_scores(users, meal_types, hours, foods, weights, food_count):
+    """
+    Recency-weighted uses per (user, meal type, hour, food), for the meal
+    type slots and for ANY_MEAL, smeared over neighbouring hours.
+
+    Returns (user, meal type, hour, food, score) arrays for every non-zero cell.
+    """
+    width = ANY_MEAL + 1
+    # Aggregate first so the kernel expands distinct cells, not every line
+    base = ((users * width + meal_types) * 24 + hours) * food_count + foods
+    cells, totals = _sum_by(np.concatenate([base, base + (ANY_MEAL - meal_types) * 24 * food_count]),
+                            np.concatenate([weights, weights]))
+    cell_foods = cells % food_count
+    slots = cells // food_count
+    cell_hours = slots % 24
+    prefix = slots // 24
+
+    keys, scores = [], []
+    for distance, factor in HOUR_KERNEL.items():
+        for offset in {distance, -distance}:
+            keys.append((prefix * 24 + (cell_hours + offset) % 24) * food_count + cell_foods)
+            scores.append(totals * factor)
+    keys, scores = _sum_by(np.concatenate(keys), np.concatenate(scores))
+    foods = keys % food_count
+    slots = keys // food_count
+    return slots // 24 // width, slots // 24 % width, slots % 24, foods, scores
+
+
+def companion_scores(users, meals, foods, weights, food_count):
+    """
+    How strongly each pair of foods goes together for a user: the weighted
+    meals they share over the geometric mean of the meals each appears in.
+
+    Returns (user, food, companion, score) arrays.
+    """
+    # One line per food per meal, grouped by meal
+    lines, first = np.unique(meals * food_count + foods, return_index=True)
+    meals, foods, users, weights = lines // food_count, lines % food_count, users[first], weights[first]
+    starts = np.flatnonzero(np.r_[True, meals[1:] != meals[:-1]])
+    sizes = np.diff(np.r_[starts, len(meals)])
+    line_sizes = np.repeat(sizes, sizes)
+    line_starts = np.repeat(starts, sizes)
+
+    # Every line paired with every line of its meal, itself included
+    left = np.repeat(np.arange(len(meals)), line_sizes)
+    right = np.repeat(line_starts, line_sizes) + (
+        np.arange(len(left)) - np.repeat(np.cumsum(line_sizes) - line_sizes, line_sizes)
+    )
+    pairs = users[left] * food_count * food_count + foods[left] * food_count + foods[right]
+    keys, inverse = np.unique(pairs, return_inverse=True)
+    shared = np.bincount(inverse, weights=weights[left], minlength=len(keys))
+    counts = np.bincount(inverse, minlength=len(keys))
+
+    owners = keys // (food_count * food_count)
+    first_foods = keys // food_count % food_count
+    second_foods = keys % food_count
+    kept = np.flatnonzero((first_foods != second_foods) & (counts >= MIN_SHARED_MEALS))
+    owners, first_foods, second_foods = owners[kept], first_foods[kept], second_foods[kept]
+    # The diagonal (a food paired with itself) holds the meals each food is in
+    prefix = owners * food_count * food_count
+    first_usage = shared[np.searchsorted(keys, prefix + first_foods * (food_count + 1))]
+    second_usage = shared[np.searchsorted(keys, prefix + second_foods * (food_count + 1))]
+    return owners, first_foods, second_foods, shared[kept] / np.sqrt(first_usage * second_usage)
+
+
+def load_history(user_ids):
+    """
+    The users' meals as (meal_id, user_id, meal_type, hour, created_at) and
+    their lines as (meal_id, food_item_id), so per-meal fields are read and
+    converted once per meal rather than once per line.
+    """
+    meals = list(
+        Meal.objects.filter(user_id__in=user_ids).annotate(hour=ExtractHour('created_at')).order_by().values_list(
+            'id', 'user_id', 'meal_type', 'hour', 'created_at'
+        )
+    )
+    lines = list(
+        MealFoodItem.objects.filter(
+            meal__user_id__in=user_ids, food_item__isnull=False
+        ).order_by().values_list('meal_id', 'food_item_id')
+    )
+    return meals, lines
+
+
+def compute_recommendations(meals, lines, now=None, top_k=TOP_K):
+    """
+    FoodRecommendation fields for the users in meals, as a list of
+    (user_id, slot, rank, food_item_id, score) tuples.
+    """
+    if not meals or not lines:
+        return []
+    now = time.time() if now is None else now
+    meal_ids, meal_users, meal_types, hours, created = zip(*meals)
+    meal_ids = np.array(meal_ids)
+    order = np.argsort(meal_ids)
+    user_ids, meal_users = np.unique(meal_users, return_inverse=True)
+    meal_types = np.array([MEAL_TYPE_INDEX[meal_type] for meal_type in meal_types])
+    ages = now - np.array([moment.timestamp() for moment in created])
+    meal_weights = np.exp2(-ages / (HALF_LIFE_DAYS * 86400))
+
+    # fromiter over the flattened pairs is several times faster than np.array(lines)
+    lines = np.fromiter(chain.from_iterable(lines), dtype=np.int64, count=2 * len(lines)).reshape(-1, 2)
+    line_meals = order[np.searchsorted(meal_ids, lines[:, 0], sorter=order) % len(order)]
+    # Drop lines of meals logged between the two queries
+    loaded = meal_ids[line_meals] == lines[:, 0]
+    lines, line_meals = lines[loaded], line_meals[loaded]
+    food_ids, foods = np.unique(lines[:, 1], return_inverse=True)
+    food_count = len(food_ids)
+    users, weights = meal_users[line_meals], meal_weights[line_meals]
+    meal_types, hours = meal_types[line_meals], np.array(hours)[line_meals]
+
+    # Plain ints for the rows
+    user_ids, food_ids = user_ids.tolist(), food_ids.tolist()
+    rows = []
+    slot_users, slot_types, slot_hours, slot_foods, scores = slot_scores(
+        users, meal_types, hours, foods, weights, food_count
+    )
+    kept, ranks = _top_k((slot_users * (ANY_MEAL + 1) + slot_types) * 24 + slot_hours, scores, top_k)
+    names = [slot_name(meal_type, hour) for meal_type in MEAL_TYPES + [''] for hour in range(24)]
+    rows.extend(
+        (user_ids[user], names[meal_type * 24 + hour], rank, food_ids[food], score)
+        for user, meal_type, hour, food, rank, score in zip(
+            slot_users[kept].tolist(), slot_types[kept].tolist(), slot_hours[kept].tolist(),
+            slot_foods[kept].tolist(), ranks[kept].tolist(), scores[kept].tolist(),
+        )
+    )
+
+    owners, anchors, companions, scores = companion_scores(users, line_meals, foods, weights, food_count)
+    kept, ranks = _top_k(owners * food_count + anchors, scores, top_k)
+    rows.extend(
+        (user_ids[user], companion_slot(food_ids[anchor]), rank, food_ids[companion], score)
+        for user, anchor, companion, rank, score in zip(
+            owners[kept].tolist(), anchors[kept].tolist(), companions[kept].tolist(),
+            ranks[kept].tolist(), scores[kept].tolist(),
+        )
+    )
+    return rows
+
+
+def build_recommendations(user_ids, now=None):
+    """Recompute and store the recommendations of the given users"""
+    user_ids = list(user_ids)
+    rows = compute_recommendations(*load_history(user_ids), now)
+    with transaction.atomic():
+        FoodRecommendation.objects.filter(user_id__in=user_ids).delete()
+        FoodRecommendation.objects.bulk_create(
+            [
+                FoodRecommendation(user_id=user_id, slot=slot, rank=rank, food_item_id=food_id, score=score)
+                for user_id, slot, rank, food_id, score in rows
+            ],
+            batch_size=1000,
+        )
+        # Cached quick-add responses carry the old recommendations
+        CustomUser.objects.filter(pk__in=user_ids).update(data_version=F('data_version') + 1)
+    return len(rows)
+
+
+def recommend_foods(user, meal_type, hour, with_food_ids=(), limit=TOP_K):
+    """
+    Up to limit foods for the context with one indexed read: companions of
+    the foods already picked first, then the meal type slot, then the hour.
+    """
+    slots = [companion_slot(food_id) for food_id in with_food_ids]
+    if meal_type:
+        slots.append(slot_name(meal_type, hour))
+    slots.append(slot_name('', hour))
+    recommendations = FoodRecommendation.objects.filter(user=user, slot__in=slots).select_related('food_item')
+    by_slot = {}
+    for recommendation in recommendations:
+        by_slot.setdefault(recommendation.slot, []).append(recommendation)
+
+    companions = sorted(
+        (recommendation for slot in slots[:len(with_food_ids)] for recommendation in by_slot.get(slot, ())),
+        key=lambda recommendation: -recommendation.score,
+    )
+    ordered = companions + [
+        recommendation
+        for slot in slots[len(with_food_ids):]
+        for recommendation in sorted(by_slot.get(slot, ()), key=lambda recommendation: recommendation.rank)
+    ]
+    foods, seen = [], set(with_food_ids)
+    for recommendation in ordered:
+        if recommendation.food_item_id not in seen:
+            seen.add(recommendation.food_item_id)
+            foods.append(recommendation.food_item)
+    return foods[:limit]
+
+
+def batched_user_ids(users, chunk_size=CHUNK_SIZE):
+    ids = list(users.order_by('pk').values_list('pk', flat=True))
+    for start in range(0, len(ids), chunk_size):
+        yield ids[start:start + chunk_size]
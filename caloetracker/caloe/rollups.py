@@ -0,0 +1,153 @@
+"""
+Weekly and monthly rollups of the daily tracking data.
+
+Long-range analytics read NutritionRollup rows instead of every DailyProgress,
+WaterIntake and WeightLog row in the range. Write paths call refresh_rollups()
+for the day they touched; it recomputes just the ISO week and the month
+containing that day from at most six weeks of source rows, and upserts only
+the columns of the source that changed. Batch imports refresh all the days
+they touched at once with refresh_rollups_for_days(). rebuild_user_rollups()
+recomputes a user's whole history.
+"""
+import calendar
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db.models import Sum
+
+from .models import DailyProgress, NutritionRollup, WaterIntake, WeightLog
+
+PERIODS = ('WEEK', 'MONTH')
+
+NUTRITION = 'nutrition'
+WATER = 'water'
+WEIGHT = 'weight'
+SOURCES = (NUTRITION, WATER, WEIGHT)
+
+# Rollup columns owned by each source
+SOURCE_FIELDS = {
+    NUTRITION: [
+        'days_logged', 'calories_sum', 'calories_avg', 'calories_min', 'calories_max',
+        'calorie_target_avg', 'protein_sum', 'protein_avg', 'carbs_sum', 'carbs_avg',
+        'fat_sum', 'fat_avg',
+    ],
+    WATER: ['water_days', 'water_sum', 'water_avg', 'water_min', 'water_max'],
+    WEIGHT: ['weight_count', 'weight_avg', 'weight_min', 'weight_max'],
+}
+
+
+def period_bounds(period, day):
+    """First and last day of the ISO week or month containing day"""
+    if period == 'WEEK':
+        start = day - timedelta(days=day.weekday())
+        return start, start + timedelta(days=6)
+    last_day = calendar.monthrange(day.year, day.month)[1]
+    return day.replace(day=1), day.replace(day=last_day)
+
+
+def load_days(user, source, start=None, end=None):
+    """One dict per day of source data, optionally limited to [start, end]"""
+    if source == NUTRITION:
+        rows = DailyProgress.objects.filter(user=user).values(
+            'date', 'total_calories_consumed', 'total_protein', 'total_carbs', 'total_fat', 'calorie_target'
+        )
+    elif source == WATER:
+        # order_by('date') replaces the model ordering so rows group per day
+        rows = WaterIntake.objects.filter(user=user).values('date').annotate(
+            total_water=Sum('amount_ml')
+        ).order_by('date')
+    else:
+        rows = WeightLog.objects.filter(user=user).values('date', 'weight')
+    if start is not None:
+        rows = rows.filter(date__range=[start, end])
+    return list(rows)
+
+
+def _average(values):
+    return sum(values) / len(values) if values else None
+
+
+def summarize(source, days):
+    """Rollup column values for one bucket's worth of source days"""
+    if source == NUTRITION:
+        calories = [day['total_calories_consumed'] for day in days]
+        targets = [day['calorie_target'] for day in days if day['calorie_target'] is not None]
+        summary = {
+            'days_logged': len(days),
+            'calories_sum': sum(calories),
+            'calories_avg': _average(calories),
+            'calories_min': min(calories, default=None),
+            'calories_max': max(calories, default=None),
+            'calorie_target_avg': _average(targets),
+        }
+        for macro in ('protein', 'carbs', 'fat'):
+            values = [day[f'total_{macro}'] for day in days]
+            summary[f'{macro}_sum'] = sum(values)
+            summary[f'{macro}_avg'] = _average(values)
+        return summary
+    if source == WATER:
+        totals = [day['total_water'] for day in days]
+        return {
+            'water_days': len(totals),
+            'water_sum': sum(totals),
+            'water_avg': _average(totals),
+            'water_min': min(totals, default=None),
+            'water_max': max(totals, default=None),
+        }
+    weights = [day['weight'] for day in days]
+    return {
+        'weight_count': len(weights),
+        'weight_avg': _average(weights),
+        'weight_min': min(weights, default=None),
+        'weight_max': max(weights, default=None),
+    }
+
+
+def save_rollups(user, source, summaries):
+    """Upsert {(period, period_start): summary}, touching only source's columns"""
+    NutritionRollup.objects.bulk_create(
+        [
+            NutritionRollup(user=user, period=period, period_start=start, **summary)
+            for (period, start), summary in summaries.items()
+        ],
+        update_conflicts=True,
+        unique_fields=['user', 'period', 'period_start'],
+        update_fields=SOURCE_FIELDS[source] + ['updated_at'],
+        batch_size=500,
+    )
+
+
+def refresh_rollups(user, day, sources=SOURCES):
+    """Recompute the week and month buckets containing day for the given sources"""
+    refresh_rollups_for_days(user, [day], sources)
+
+
+def refresh_rollups_for_days(user, days, sources=SOURCES):
+    """
+    Recompute every week and month bucket containing one of days, with one
+    read and one upsert per source however many days there are
+    """
+    buckets = {(period, *period_bounds(period, day)) for day in days for period in PERIODS}
+    if not buckets:
+        return
+    start = min(bucket_start for _, bucket_start, _ in buckets)
+    end = max(bucket_end for _, _, bucket_end in buckets)
+    for source in sources:
+        rows = load_days(user, source, start, end)
+        save_rollups(user, source, {
+            (period, bucket_start): summarize(
+                source, [row for row in rows if bucket_start <= row['date'] <= bucket_end]
+            )
+            for period, bucket_start, bucket_end in buckets
+        })
+
+
+def rebuild_user_rollups(user):
+    """Recompute every rollup bucket of a user from scratch"""
+    NutritionRollup.objects.filter(user=user).delete()
+    for source in SOURCES:
+        grouped = defaultdict(list)
+        for row in load_days(user, source):
+            for period in PERIODS:
+                grouped[(period, period_bounds(period, row['date'])[0])].append(row)
+        save_rollups(user, source, {key: summarize(source, days) for key, days in grouped.items()})
@@ -0,0 +1,165 @@
+"""
+Token/prefix index for FoodItem search.
+
+Every FoodItem name is split into lowercase word tokens stored in
+FoodSearchToken. A query token matches any indexed token it is a prefix of,
+which is answered with a range scan on the (token, food_item) index instead of
+a LIKE '%...%' scan over the whole food table.
+"""
+import base64
+import json
+import re
+
+from django.db import models, transaction
+from django.db.models import Case, IntegerField, Value, When
+
+from .models import FoodItem, FoodSearchToken
+
+TOKEN_PATTERN = re.compile(r'\w+')
+
+# Sorts after every other code point, so [prefix, prefix + PREFIX_END) covers
+# all strings starting with prefix under SQLite's binary collation.
+PREFIX_END = '\U0010ffff'
+
+INDEX_BATCH_SIZE = 2000
+
+# FoodItem fields copied into FoodSearchToken; saving any of them reindexes
+INDEXED_FIELDS = frozenset({'name', 'created_by', 'created_by_id'})
+
+# Fields the JSON search endpoint can return
+RESULT_FIELDS = ('id', 'name', 'calories', 'protein', 'carbs', 'fat', 'serving_size', 'is_custom')
+
+
+def tokenize(text):
+    """Split text into unique lowercase word tokens, keeping their order"""
+    tokens = []
+    for token in TOKEN_PATTERN.findall((text or '').casefold()):
+        if token not in tokens:
+            tokens.append(token)
+    return tokens
+
+
+def visible_food_items(user):
+    """System foods plus the user's own custom foods"""
+    return FoodItem.objects.filter(
+        models.Q(created_by__isnull=True) |  # System foods
+        models.Q(created_by=user)            # User's custom foods
+    )
+
+
+def prefix_matches(user, token):
+    """Ids of food items visible to user having a token that starts with token"""
+    return FoodSearchToken.objects.filter(
+        models.Q(created_by__isnull=True) | models.Q(created_by=user),
+        token__gte=token,
+        token__lt=token + PREFIX_END,
+    ).values('food_item_id')
+
+
+def search_food_items(user, query):
+    """
+    Food items visible to user whose name contains a word starting with every
+    query token. Items whose name starts with the query rank first (rank 0),
+    then other word-prefix matches (rank 1); ties are ordered by name and id.
+    """
+    tokens = tokenize(query)
+    if not tokens:
+        return visible_food_items(user).annotate(
+            rank=Value(0, output_field=IntegerField())
+        ).order_by('name', 'id')
+
+    # Visibility is applied by the index lookups, so the food table is only
+    # reached by primary key for the matching rows.
+    food_items = FoodItem.objects.all()
+    for token in tokens:
+        food_items = food_items.filter(id__in=prefix_matches(user, token))
+
+    return food_items.annotate(
+        rank=Case(
+            When(name__istartswith=query.strip(), then=Value(0)),
+            default=Value(1),
+            output_field=IntegerField(),
+        )
+    ).order_by('rank', 'name', 'id')
+
+
+def encode_cursor(row):
+    """Opaque cursor pointing just after row in (rank, name, id) order"""
+    payload = json.dumps([row['rank'], row['name'], row['id']])
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Inverse of encode_cursor; raises ValueError for a malformed cursor"""
+    try:
+        rank, name, pk = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (TypeError, ValueError, UnicodeError) as exc:
+        raise ValueError('Invalid cursor') from exc
+    if not (isinstance(rank, int) and isinstance(name, str) and isinstance(pk, int)):
+        raise ValueError('Invalid cursor')
+    return rank, name, pk
+
+
+def search_page(user, query, limit, cursor=None, fields=RESULT_FIELDS):
+    """
+    One keyset page of search results as dicts holding only fields.
+
+    Rows are read with .values() so no model instances are built. Returns
+    (rows, next_cursor); next_cursor is None when there are no more results.
+    """
+    food_items = search_food_items(user, query)
+    if cursor:
+        rank, name, pk = decode_cursor(cursor)
+        food_items = food_items.filter(
+            models.Q(rank__gt=rank) |
+            models.Q(rank=rank, name__gt=name) |
+            models.Q(rank=rank, name=name, id__gt=pk)
+        )
+
+    columns = list(dict.fromkeys([*fields, 'rank', 'name', 'id']))
+    rows = list(food_items.values(*columns)[:limit + 1])
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = encode_cursor(rows[-1]) if has_more else None
+    return [{field: row[field] for field in fields} for row in rows], next_cursor
+
+
+def build_tokens(food_items):
+    """Unsaved FoodSearchToken rows for the given saved food items"""
+    return [
+        FoodSearchToken(food_item_id=food_item.pk, created_by_id=food_item.created_by_id, token=token[:200])
+        for food_item in food_items
+        for token in tokenize(food_item.name)
+    ]
+
+
+def index_food_item(food_item):
+    """Replace the indexed tokens of one food item"""
+    index_food_items([food_item])
+
+
+def index_food_items(food_items):
+    """Replace the indexed tokens of many saved food items in bulk"""
+    food_items = list(food_items)
+    with transaction.atomic():
+        for start in range(0, len(food_items), INDEX_BATCH_SIZE):
+            batch = food_items[start:start + INDEX_BATCH_SIZE]
+            FoodSearchToken.objects.filter(food_item_id__in=[f.pk for f in batch]).delete()
+            FoodSearchToken.objects.bulk_create(build_tokens(batch), batch_size=INDEX_BATCH_SIZE)
+
+
+def rebuild_index():
+    """Rebuild the whole token index from FoodItem; returns the item count"""
+    count = 0
+    with transaction.atomic():
+        FoodSearchToken.objects.all().delete()
+        batch = []
+        for food_item in FoodItem.objects.only('id', 'name', 'created_by_id').iterator(chunk_size=INDEX_BATCH_SIZE):
+            batch.append(food_item)
+            if len(batch) == INDEX_BATCH_SIZE:
+                FoodSearchToken.objects.bulk_create(build_tokens(batch), batch_size=INDEX_BATCH_SIZE)
+                count += len(batch)
+                batch = []
+        FoodSearchToken.objects.bulk_create(build_tokens(batch), batch_size=INDEX_BATCH_SIZE)
+        count += len(batch)
+    return count
@@ -0,0 +1,50 @@
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .changes import FEED_NAMES
+from .models import (
+    CustomUser, FoodItem, Meal, ProgressPhoto, Tombstone, WaterIntake, WeightLog, bump_catalog_version,
+    claim_change_seqs,
+)
+from .search import INDEXED_FIELDS, index_food_item
+
+
+@receiver(post_save, sender=FoodItem)
+def reindex_food_item(sender, instance, update_fields=None, raw=False, **kwargs):
+    """Keep the search index in sync; deletes cascade to FoodSearchToken"""
+    if raw:
+        return
+    if update_fields is not None and not INDEXED_FIELDS.intersection(update_fields):
+        return
+    index_food_item(instance)
+
+
+@receiver(post_save, sender=FoodItem)
+@receiver(post_delete, sender=FoodItem)
+def bump_food_data_versions(sender, instance, raw=False, **kwargs):
+    """A custom food changes its owner's results; a system food the catalog's"""
+    if raw:
+        return
+    if instance.created_by_id is not None:
+        CustomUser.objects.filter(pk=instance.created_by_id).update(data_version=F('data_version') + 1)
+    else:
+        bump_catalog_version()
+
+
+@receiver(post_delete, sender=Meal)
+@receiver(post_delete, sender=WaterIntake)
+@receiver(post_delete, sender=WeightLog)
+@receiver(post_delete, sender=ProgressPhoto)
+@receiver(post_delete, sender=FoodItem)
+def record_tombstone(sender, instance, origin=None, **kwargs):
+    """Leave a Tombstone in the owner's sync feed for a deleted record"""
+    owner_id = instance.change_owner_id
+    # Deleting the user takes their whole feed with it
+    if owner_id is None or isinstance(origin, CustomUser) or getattr(origin, 'model', None) is CustomUser:
+        return
+    Tombstone.objects.create(
+        user_id=owner_id, kind=FEED_NAMES[sender], object_pk=instance.pk,
+        change_seq=claim_change_seqs(owner_id)[0],
+    )
+
@@ -0,0 +1,251 @@
+"""
+Batch import of entries logged offline.
+
+Mobile clients upload days of meals, water and weigh-ins in one payload:
+
+    {
+        "meals": [{"date": "2026-10-01", "time": "08:15", "meal_type": "BREAKFAST",
+                   "food_items": [{"food_id": 12, "quantity": 1.5}]}],
+        "water": [{"date": "2026-10-01", "amount_ml": 250}],
+        "weights": [{"date": "2026-10-01", "weight": 71.4, "notes": ""}],
+        "batch_id": "5f0c2a9e-..."
+    }
+
+batch_id is optional. A client that sends one and retries the upload,
+say after losing the response, gets the first import's result back
+(with "duplicate": true) instead of having every entry written twice.
+
+validate_entries() checks the whole batch before anything is written, with
+one query for every food it names, and reports every problem at once.
+import_entries() then writes it in one transaction with bulk inserts, one
+grouped DailyProgress upsert and one food usage update, so the number of
+statements depends on the weeks touched, not on the number of entries.
+"""
+import math
+from collections import defaultdict
+from datetime import date, datetime, time, timedelta
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .changes import stamp_changes
+from .db import retry_on_busy
+from .models import MAX_ID, Meal, MealFoodItem, NutritionLedgerEntry, SyncBatch, WaterIntake, WeightLog
+from .rollups import NUTRITION, WATER, WEIGHT, refresh_rollups_for_days
+from .search import visible_food_items
+from .tracking import NUTRIENTS, add_to_daily_progress_by_date, meal_totals, prepare_meal, publish_daily_totals
+from .usage import record_meal_usages
+
+MAX_ENTRIES = 5000
+# How far back an offline client may backfill
+MAX_AGE_DAYS = 366
+BATCH_SIZE = 500
+MAX_BATCH_ID_LENGTH = 64
+
+MEAL_TYPES = dict(Meal.MEAL_TYPES)
+
+
+class SyncError(ValueError):
+    """A batch failed validation; errors lists every problem found"""
+
+    def __init__(self, errors):
+        super().__init__(f'{len(errors)} invalid entries')
+        self.errors = errors
+
+
+def _entries(payload, key, errors):
+    entries = payload.get(key, [])
+    if not isinstance(entries, list):
+        errors.append({'entry': key, 'error': 'Expected a list'})
+        return []
+    return entries
+
+
+def _date(entry, today):
+    day = date.fromisoformat(entry['date'])
+    if not today - timedelta(days=MAX_AGE_DAYS) <= day <= today:
+        raise ValueError('Date out of range')
+    return day
+
+
+def batch_id(payload):
+    """The payload's client-chosen batch id, None without one, or SyncError"""
+    value = payload.get('batch_id') if isinstance(payload, dict) else None
+    if value is None:
+        return None
+    if not isinstance(value, str) or not 0 < len(value) <= MAX_BATCH_ID_LENGTH:
+        raise SyncError([{'entry': 'batch_id', 'error': f'Expected a string of 1 to {MAX_BATCH_ID_LENGTH} characters'}])
+    return value
+
+
+def imported_batch(user, batch_id):
+    """The stored result of a batch already imported, or None"""
+    result = SyncBatch.objects.filter(user=user, batch_id=batch_id).values_list('result', flat=True).first()
+    return None if result is None else {**result, 'duplicate': True}
+
+
+def validate_entries(user, payload):
+    """
+    Cleaned (meals, water, weights) from a payload, or SyncError. Meals are
+    (date, meal_type, created_at, [(FoodItem, quantity)]) tuples.
+    """
+    if not isinstance(payload, dict):
+        raise SyncError([{'entry': '', 'error': 'Expected an object'}])
+    errors = []
+    today = timezone.localdate()
+    meals, water, weights = [], [], {}
+    raw_meals = _entries(payload, 'meals', errors)
+    raw_water = _entries(payload, 'water', errors)
+    raw_weights = _entries(payload, 'weights', errors)
+    if len(raw_meals) + len(raw_water) + len(raw_weights) > MAX_ENTRIES:
+        raise SyncError([{'entry': '', 'error': f'At most {MAX_ENTRIES} entries per batch'}])
+
+    for index, entry in enumerate(raw_meals):
+        try:
+            day = _date(entry, today)
+            meal_type = entry['meal_type']
+            if meal_type not in MEAL_TYPES:
+                raise ValueError('Unknown meal type')
+            created_at = timezone.now()
+            if entry.get('time'):
+                created_at = timezone.make_aware(datetime.combine(day, time.fromisoformat(entry['time'])))
+            items = [(int(item['food_id']), float(item.get('quantity', 1))) for item in entry['food_items']]
+            # json.loads accepts NaN and Infinity, which compare False
+            if not items or any(not math.isfinite(quantity) or quantity <= 0 for _, quantity in items):
+                raise ValueError('Invalid food items')
+        except (ValueError, TypeError, KeyError, AttributeError) as exc:
+            errors.append({'entry': f'meals[{index}]', 'error': str(exc) if isinstance(exc, ValueError) else 'Invalid meal'})
+            continue
+        meals.append((index, day, meal_type, created_at, items))
+
+    for index, entry in enumerate(raw_water):
+        try:
+            day = _date(entry, today)
+            amount_ml = int(entry['amount_ml'])
+            if not 0 < amount_ml <= 5000:
+                raise ValueError('Amount out of range')
+        except OverflowError:
+            errors.append({'entry': f'water[{index}]', 'error': 'Amount out of range'})
+            continue
+        except (ValueError, TypeError, KeyError, AttributeError) as exc:
+            errors.append({'entry': f'water[{index}]', 'error': str(exc) if isinstance(exc, ValueError) else 'Invalid water entry'})
+            continue
+        water.append((day, amount_ml))
+
+    for index, entry in enumerate(raw_weights):
+        try:
+            day = _date(entry, today)
+            weight = float(entry['weight'])
+            # NaN fails the range check too
+            if not 20 <= weight <= 500:
+                raise ValueError('Weight out of range')
+            notes = str(entry.get('notes', ''))
+        except (ValueError, TypeError, KeyError, AttributeError) as exc:
+            errors.append({'entry': f'weights[{index}]', 'error': str(exc) if isinstance(exc, ValueError) else 'Invalid weigh-in'})
+            continue
+        # One weigh-in per day: the last one in the batch wins
+        weights[day] = (weight, notes)
+
+    # Every food of every meal in one query
+    foods = visible_food_items(user).in_bulk({
+        food_id for *_, items in meals for food_id, _ in items if abs(food_id) <= MAX_ID
+    })
+    cleaned_meals = []
+    for index, day, meal_type, created_at, items in meals:
+        missing = sorted({food_id for food_id, _ in items if food_id not in foods})
+        if missing:
+            errors.append({'entry': f'meals[{index}]', 'error': f'Unknown food ids: {missing}'})
+            continue
+        cleaned_meals.append((day, meal_type, created_at, [(foods[food_id], quantity) for food_id, quantity in items]))
+
+    if errors:
+        raise SyncError(errors)
+    return cleaned_meals, water, weights
+
+
+@retry_on_busy
+def import_entries(user, payload):
+    """
+    Validate and write a batch in one transaction. Returns the counts
+    written and the dates touched; raises SyncError without writing
+    anything if any entry is invalid. A batch_id seen before returns the
+    first import's result and writes nothing.
+    """
+    batch = batch_id(payload)
+    if batch is not None:
+        previous = imported_batch(user, batch)
+        if previous is not None:
+            return previous
+    meals, water, weights = validate_entries(user, payload)
+    prepared = [
+        prepare_meal(user, meal_type, lines, date=day, created_at=created_at)
+        for day, meal_type, created_at, lines in meals
+    ]
+    totals_by_date = defaultdict(lambda: dict.fromkeys(NUTRIENTS, 0.0))
+    for meal, _ in prepared:
+        for name, value in meal_totals(meal).items():
+            totals_by_date[meal.date][name] += value
+
+    water_intakes = [WaterIntake(user=user, date=day, amount_ml=amount_ml) for day, amount_ml in water]
+    weight_logs = [
+        WeightLog(user=user, date=day, weight=weight, notes=notes) for day, (weight, notes) in weights.items()
+    ]
+
+    dates = sorted(set(totals_by_date) | {day for day, _ in water} | set(weights))
+    result = {
+        'meals': len(prepared),
+        'food_items': sum(len(meal_items) for _, meal_items in prepared),
+        'water': len(water),
+        'weights': len(weights),
+        'dates': [day.isoformat() for day in dates],
+    }
+    try:
+        with transaction.atomic():
+            if batch is not None:
+                # First, so a concurrent upload of the same batch fails
+                # before writing anything
+                SyncBatch.objects.create(user=user, batch_id=batch, result=result)
+            # One block of change sequence numbers for the whole batch
+            stamp_changes(user, [meal for meal, _ in prepared] + water_intakes + weight_logs)
+            saved_meals = Meal.objects.bulk_create([meal for meal, _ in prepared], batch_size=BATCH_SIZE)
+            items = []
+            for meal, meal_items in zip(saved_meals, (meal_items for _, meal_items in prepared)):
+                for item in meal_items:
+                    item.meal = meal
+                    items.append(item)
+            MealFoodItem.objects.bulk_create(items, batch_size=BATCH_SIZE)
+            NutritionLedgerEntry.objects.bulk_create([
+                NutritionLedgerEntry(user=user, date=meal.date, kind='ADD', meal_pk=meal.pk, **meal_totals(meal))
+                for meal in saved_meals
+            ], batch_size=BATCH_SIZE)
+            add_to_daily_progress_by_date(user, totals_by_date)
+            record_meal_usages(user, [
+                ([food_item.id for food_item, _ in lines], created_at) for _, _, created_at, lines in meals
+            ])
+
+            WaterIntake.objects.bulk_create(water_intakes, batch_size=BATCH_SIZE)
+            WeightLog.objects.bulk_create(
+                weight_logs,
+                update_conflicts=True,
+                unique_fields=['user', 'date'],
+                update_fields=['weight', 'notes', 'change_seq'],
+                batch_size=BATCH_SIZE,
+            )
+
+            for source, days in (
+                (NUTRITION, set(totals_by_date)),
+                (WATER, {day for day, _ in water}),
+                (WEIGHT, set(weights)),
+            ):
+                refresh_rollups_for_days(user, days, [source])
+            if dates:
+                user.bump_data_version()
+                # Open streams only show today
+                if timezone.localdate() in dates:
+                    publish_daily_totals(user, timezone.localdate())
+    except IntegrityError:
+        previous = imported_batch(user, batch) if batch is not None else None
+        if previous is None:
+            raise
+        return previous
+    return {**result, 'duplicate': False}
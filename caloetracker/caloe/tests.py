@@ -1,3 +1,1762 @@
-from django.test import TestCase
+import asyncio
+import base64
+import io
+import json
+import pickle
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import OperationalError, connection
+from django.db.models import Avg, Count, Max, Sum
+from django.test import Client, SimpleTestCase, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import analytics, tracking
+from .cache import cache_backend, cache_stats, cached, refresh_due, reset_cache_stats, user_key
+from .db import BUSY_RETRIES, DEFAULT_PRAGMAS, retry_on_busy, sqlite_pragmas
+from .events import SUBSCRIBER_BUFFER, LocalBroker, get_broker, user_channel
+from .ledger import find_drift, meal_totals_by_day, rebuild_daily_progress
+from .metrics import HISTOGRAMS, REQUEST_SECONDS
+from .models import (
+    CustomUser, DailyProgress, FoodItem, FoodSearchToken, FoodUsage, Meal, MealFoodItem, NutritionLedgerEntry,
+    NutritionRollup, Tombstone, WaterIntake, WeightLog, catalog_version,
+)
+from .rollups import PERIODS, SOURCE_FIELDS, period_bounds, rebuild_user_rollups
+from .search import search_food_items
+from .sync import import_entries
+from .tracking import (
+    delete_water, log_meal, log_water, log_weight, remove_meal, remove_meal_line, save_meal_line,
+)
+from .recommendations import build_recommendations, recommend_foods
+from .usage import EPOCH, HALF_LIFE_DAYS, rebuild_food_usage, record_usage, top_foods, usage_weight
+from .views import calculate_analytics_stats
+
+
+def make_user(username='alice'):
+    return CustomUser.objects.create_user(
+        username=username,
+        password='secret-pass-123',
+        age=30,
+        gender='F',
+        height=165,
+        weight=60,
+        goal='MAINTAIN',
+        activity_level=1.375,
+    )
+
+
+def post_meal(client, items, meal_type='LUNCH'):
+    return client.post(
+        reverse('add_meal'),
+        data=json.dumps({'meal_type': meal_type, 'food_items': items}),
+        content_type='application/json',
+    )
+
+
+class StoredCalorieTargetTests(TestCase):
+    def test_profile_update_refreshes_stored_targets(self):
+        user = make_user()
+        self.assertEqual(user.daily_calorie_target, user.calculate_daily_calorie_target())
+        maintenance = user.maintenance_calories
+
+        self.client.force_login(user)
+        self.client.post(reverse('profile'), {
+            'age': 30, 'gender': 'F', 'height': 165, 'weight': 60,
+            'goal': 'LOSE', 'activity_level': 1.375,
+        })
+        user.refresh_from_db()
+        self.assertEqual(user.maintenance_calories, maintenance)
+        self.assertEqual(user.daily_calorie_target, maintenance - 500)
+
+    def test_incomplete_profile_stores_zero(self):
+        user = CustomUser.objects.create_superuser('admin', 'admin@example.com', 'secret-pass-123')
+        self.assertEqual(user.daily_calorie_target, 0)
+
+
+class DailyTargetSnapshotTests(TestCase):
+    def setUp(self):
+        self.user = make_user()
+        self.user.protein_goal, self.user.carbs_goal, self.user.fat_goal = 120, 200, 60
+        self.user.save()
+        self.client.force_login(self.user)
+        self.food = FoodItem.objects.create(name='Oats', calories=150, protein=5, carbs=27, fat=3)
+        self.today = timezone.localdate()
+
+    def targets(self, date):
+        progress = DailyProgress.objects.get(user=self.user, date=date)
+        return (progress.calorie_target, progress.protein_target, progress.carbs_target, progress.fat_target)
+
+    def current_targets(self):
+        self.user.refresh_from_db()
+        return (self.user.daily_calorie_target, self.user.protein_goal, self.user.carbs_goal, self.user.fat_goal)
+
+    def change_targets(self):
+        self.client.post(reverse('profile'), {
+            'age': 30, 'gender': 'F', 'height': 165, 'weight': 60,
+            'goal': 'LOSE', 'activity_level': 1.375,
+        })
+        self.user.refresh_from_db()
+        self.user.protein_goal = 90
+        self.user.save(update_fields=['protein_goal'])
+
+    def test_first_write_of_a_day_captures_the_targets(self):
+        before = self.current_targets()
+        log_meal(self.user, 'BREAKFAST', [(self.food.id, 1)])
+        self.assertEqual(self.targets(self.today), before)
+
+        self.change_targets()
+        self.assertNotEqual(self.current_targets(), before)
+        log_meal(self.user, 'LUNCH', [(self.food.id, 1)])
+        progress = DailyProgress.objects.get(user=self.user, date=self.today)
+        self.assertEqual(progress.total_calories_consumed, 300)
+        self.assertEqual(self.targets(self.today), before)
+
+    def test_target_changes_leave_past_days_alone(self):
+        yesterday = self.today - timedelta(days=1)
+        before = self.current_targets()
+        import_entries(self.user, {'meals': [
+            {'date': yesterday.isoformat(), 'time': '08:30', 'meal_type': 'BREAKFAST',
+             'food_items': [{'food_id': self.food.id, 'quantity': 10}]},
+        ]})
+
+        self.change_targets()
+        after = self.current_targets()
+        log_meal(self.user, 'BREAKFAST', [(self.food.id, 1)])
+        rebuild_daily_progress()
+        call_command('backfill_daily_targets', stdout=io.StringIO())
+
+        self.assertEqual(self.targets(yesterday), before)
+        self.assertEqual(self.targets(self.today), after)
+        past = DailyProgress.objects.get(user=self.user, date=yesterday)
+        self.assertEqual(past.get_calorie_target(), before[0])
+        self.assertEqual(past.progress_percentage(), min(100, 1500 / before[0] * 100))
+
+    def test_backfill_fills_only_missing_snapshots(self):
+        yesterday = self.today - timedelta(days=1)
+        log_meal(self.user, 'BREAKFAST', [(self.food.id, 1)])
+        DailyProgress.objects.create(user=self.user, date=yesterday)
+        DailyProgress.objects.filter(date=yesterday).update(
+            calorie_target=None, protein_target=None, carbs_target=None, fat_target=None
+        )
+        before = self.current_targets()
+        self.change_targets()
+
+        call_command('backfill_daily_targets', stdout=io.StringIO())
+
+        self.assertEqual(self.targets(yesterday), self.current_targets())
+        self.assertEqual(self.targets(self.today), before)
+
+
+class FoodSearchIndexTests(TestCase):
+    NAMES = [
+        'Brown Rice', 'Rice Cakes', 'Wild rice pilaf', 'Licorice', 'Fried Rice with Egg',
+        'Egg Whites', 'Eggplant Parmesan', 'Greek Yogurt', 'Yogurt, Greek style', 'Oatmeal',
+    ]
+
+    def setUp(self):
+        self.user = make_user()
+        for name in self.NAMES:
+            FoodItem.objects.create(name=name, calories=100)
+
+    def names(self, query, user=None):
+        return {food.name for food in search_food_items(user or self.user, query)}
+
+    def word_prefix_matches(self, query):
+        """The old icontains results, kept where every token starts a word"""
+        food_items = FoodItem.objects.all()
+        for token in query.split():
+            food_items = food_items.filter(name__icontains=token)
+        return {
+            food.name for food in food_items
+            if all(re.search(rf'\b{re.escape(token)}', food.name, re.IGNORECASE) for token in query.split())
+        }
+
+    def test_prefix_search_matches_icontains_on_word_prefixes(self):
+        for query in ('rice', 'RI', 'egg', 'greek yog', 'yogurt greek', 'oat', 'plant', 'xyz'):
+            self.assertEqual(self.names(query), self.word_prefix_matches(query), query)
+        # A match inside a word is not a word prefix
+        self.assertNotIn('Licorice', self.names('rice'))
+        self.assertEqual([food.name for food in search_food_items(self.user, 'rice')][:1], ['Rice Cakes'])
+
+    def test_index_follows_create_rename_and_delete(self):
+        food = FoodItem.objects.create(name='Quinoa Salad', calories=200)
+        self.assertEqual(self.names('quin'), {'Quinoa Salad'})
+        food.name = 'Couscous Salad'
+        food.save()
+        self.assertEqual(self.names('quin'), set())
+        self.assertEqual(self.names('cous'), {'Couscous Salad'})
+        FoodItem.objects.filter(pk=food.pk).delete()
+        self.assertEqual(self.names('salad'), set())
+        self.assertFalse(FoodSearchToken.objects.filter(food_item_id=food.pk).exists())
+
+    def test_ownership_changes_reindex_visibility(self):
+        other = make_user('bob')
+        food = FoodItem.objects.create(name='Secret Stew', calories=300, created_by=other, is_custom=True)
+        self.assertEqual(self.names('stew'), set())
+        food.created_by = None
+        food.save(update_fields=['created_by'])
+        self.assertEqual(self.names('stew'), {'Secret Stew'})
+        food.created_by = self.user
+        food.save(update_fields=['created_by'])
+        self.assertEqual(self.names('stew', other), set())
+        self.assertEqual(self.names('stew'), {'Secret Stew'})
+
+
+class FoodSearchPageTests(TestCase):
+    def setUp(self):
+        self.user = make_user()
+        self.client.force_login(self.user)
+        # Rank 0 for names starting with the query, then rank 1, then by name
+        for i in range(7):
+            FoodItem.objects.create(name=f'Rice {i}', calories=100 + i)
+            FoodItem.objects.create(name=f'Brown Rice {i}', calories=100 + i)
+
+    def search(self, **params):
+        return self.client.get(
+            reverse('food_search'), {'search_query': 'rice', **params}, HTTP_X_REQUESTED_WITH='XMLHttpRequest'
+        )
+
+    def test_cursor_pages_cover_every_result_once_in_order(self):
+        names, cursor = [], None
+        while True:
+            page = self.search(limit=3, **({'cursor': cursor} if cursor else {})).json()
+            self.assertLessEqual(len(page['results']), 3)
+            names += [food['name'] for food in page['results']]
+            if not page['has_more']:
+                self.assertIsNone(page['next_cursor'])
+                break
+            cursor = page['next_cursor']
+        expected = [f'Rice {i}' for i in range(7)] + [f'Brown Rice {i}' for i in range(7)]
+        self.assertEqual(names, sorted(expected[:7]) + sorted(expected[7:]))
+
+    def test_malformed_cursors_are_rejected(self):
+        for cursor in ('not-base64!', 'WzEsMl0=', base64.urlsafe_b64encode(b'["a", "b", "c"]').decode()):
+            response = self.search(cursor=cursor)
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.json()['error'], 'Invalid cursor')
+
+    def test_limit_is_capped_and_validated(self):
+        self.assertEqual(len(self.search(limit=1000).json()['results']), 14)
+        self.assertEqual(len(self.search(limit=0).json()['results']), 1)
+        self.assertEqual(self.search(limit='ten').status_code, 400)
+        with mock.patch('caloe.views.FOOD_SEARCH_MAX_LIMIT', 5):
+            self.assertEqual(len(self.search(limit=1000).json()['results']), 5)
+
+    def test_fields_project_the_results(self):
+        results = self.search(fields='name, calories,name').json()['results']
+        self.assertEqual(list(results[0]), ['name', 'calories'])
+        self.assertEqual(self.search(fields='name,price').json()['error'], 'Unknown fields: price')
+        for fields in ('', ' , '):
+            response = self.search(fields=fields)
+            self.assertEqual(response.status_code, 400)
+            self.assertTrue(response.json()['error'].startswith('fields must name at least one of id, name'))
+
+
+class ImportFoodsCommandTests(TestCase):
+    CSV = (
+        'name,energy_kcal,protein,carbs,fat,serving_size\n'
+        'Brown Rice,112,2.3,23.5,0.8,100g\n'
+        'Lentil Soup,90,6,13,1.5,1 cup\n'
+        'brown  rice,112,2.3,23.5,0.8,100G\n'
+        ',50,1,1,1,100g\n'
+        'Mystery Bar,lots,1,1,1,1 bar\n'
+    )
+    JSONL = (
+        '{"name": "Greek Yogurt", "calories": 59, "protein": 10.2, "carbs": 3.6, "fat": 0.4}\n'
+        '\n'
+        'not json\n'
+        '123\n'
+        '["Oatmeal", 68]\n'
+        '{"name": "Oatmeal", "calories": 68, "protein": 2.4, "carbs": 12, "fat": 1.4, "serving_size": "1 bowl"}\n'
+    )
+
+    def setUp(self):
+        self.user = make_user()
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def write(self, filename, content):
+        path = Path(self.directory.name) / filename
+        path.write_text(content, encoding='utf-8')
+        return str(path)
+
+    def run_import(self, *args):
+        out = io.StringIO()
+        call_command('import_foods', *args, '--batch-size', '2', stdout=out, stderr=io.StringIO())
+        return out.getvalue()
+
+    def catalog(self):
+        return {
+            (food.name, food.serving_size): (food.calories, food.protein, food.carbs, food.fat)
+            for food in FoodItem.objects.filter(created_by__isnull=True)
+        }
+
+    def test_streams_csv_into_the_catalog(self):
+        path = self.write('foods.csv', self.CSV)
+        version = catalog_version()
+        output = self.run_import(path, '--map', 'calories=energy_kcal')
+
+        self.assertIn('Imported 5 rows', output)
+        # Once for the whole import, not per batch or per row
+        self.assertEqual(catalog_version(), version + 1)
+        # The second Brown Rice lands in the next batch and matches the first
+        self.assertIn('2 created, 0 updated, 1 unchanged, 0 duplicate, 2 skipped', output)
+        self.assertEqual(self.catalog(), {
+            ('Brown Rice', '100g'): (112, 2.3, 23.5, 0.8),
+            ('Lentil Soup', '1 cup'): (90, 6, 13, 1.5),
+        })
+        # bulk_create skips the signals, so the command indexes the rows itself
+        self.assertEqual({food.name for food in search_food_items(self.user, 'lent')}, {'Lentil Soup'})
+
+    def test_streams_jsonl_into_the_catalog(self):
+        path = self.write('foods.jsonl', self.JSONL)
+        output = self.run_import(path, '--default-serving-size', '100 g')
+
+        self.assertIn('2 created', output)
+        self.assertIn('3 skipped', output)
+        self.assertEqual(self.catalog(), {
+            ('Greek Yogurt', '100 g'): (59, 10.2, 3.6, 0.4),
+            ('Oatmeal', '1 bowl'): (68, 2.4, 12, 1.4),
+        })
+
+    def test_later_rows_win_within_a_batch(self):
+        path = self.write('foods.csv', 'name,calories\nTofu,80\ntofu,76\n')
+        output = self.run_import(path)
+        self.assertIn('1 created, 0 updated, 0 unchanged, 1 duplicate', output)
+        self.assertEqual(self.catalog(), {('tofu', '100g'): (76, 0, 0, 0)})
+        self.assertIn('0 created, 0 updated, 1 unchanged, 1 duplicate', self.run_import(path))
+
+    def test_rerun_is_a_no_op(self):
+        path = self.write('foods.csv', self.CSV)
+        self.run_import(path, '--map', 'calories=energy_kcal')
+        catalog = self.catalog()
+        ids = set(FoodItem.objects.values_list('id', flat=True))
+        tokens = FoodSearchToken.objects.count()
+        version = catalog_version()
+
+        output = self.run_import(path, '--map', 'calories=energy_kcal')
+
+        self.assertIn('0 created, 0 updated, 3 unchanged', output)
+        self.assertEqual(self.catalog(), catalog)
+        self.assertEqual(set(FoodItem.objects.values_list('id', flat=True)), ids)
+        self.assertEqual(FoodSearchToken.objects.count(), tokens)
+        self.assertEqual(catalog_version(), version)
+
+    def test_changed_rows_update_in_place(self):
+        self.run_import(self.write('foods.csv', self.CSV), '--map', 'calories=energy_kcal')
+        soup = FoodItem.objects.get(name='Lentil Soup')
+
+        output = self.run_import(self.write('update.csv', 'name,calories,serving_size\nLentil  soup,95,1 cup\n'))
+
+        self.assertIn('0 created, 1 updated', output)
+        soup.refresh_from_db()
+        self.assertEqual((soup.name, soup.calories, soup.protein), ('Lentil soup', 95, 0))
+        self.assertEqual(FoodItem.objects.count(), 2)
+
+    def test_rejects_bad_options(self):
+        path = self.write('foods.csv', self.CSV)
+        with self.assertRaisesMessage(CommandError, 'Invalid --map'):
+            self.run_import(path, '--map', 'sugar=sugar_g')
+        with self.assertRaisesMessage(CommandError, '--batch-size must be positive'):
+            call_command('import_foods', path, '--batch-size', '0', stdout=io.StringIO())
+
+
+class AddMealTests(TestCase):
+    def setUp(self):
+        self.user = make_user()
+        self.client.force_login(self.user)
+        self.foods = [
+            FoodItem.objects.create(name=f'Food {i}', calories=100 + i, protein=10, carbs=20, fat=5)
+            for i in range(10)
+        ]
+
+    def test_ten_item_meal_uses_a_fixed_number_of_queries(self):
+        items = [{'food_id': food.id, 'quantity': 2} for food in self.foods]
+        # session, user, foods (in_bulk), savepoint, change sequence claim
+        # (update + read), meal insert, line item bulk insert, ledger entry,
+        # DailyProgress update + insert + update (first meal of the day),
+        # rollup read + upsert, food usage insert + update, data_version
+        # bump, release
+        with self.assertNumQueries(18):
+            response = post_meal(self.client, items)
+        self.assertEqual(response.status_code, 200)
+
+        meal = Meal.objects.get(pk=response.json()['meal_id'])
+        self.assertEqual(meal.food_items.count(), 10)
+        progress = DailyProgress.objects.get(user=self.user, date=meal.date)
+        self.assertAlmostEqual(progress.total_calories_consumed, sum(2 * f.calories for f in self.foods))
+        self.assertAlmostEqual(progress.total_protein, 200)
+        self.assertAlmostEqual(progress.total_carbs, 400)
+        self.assertAlmostEqual(progress.total_fat, 100)
+
+    def test_second_meal_updates_totals_in_place(self):
+        post_meal(self.client, [{'food_id': self.foods[0].id}])
+        with self.assertNumQueries(16):
+            post_meal(self.client, [{'food_id': self.foods[1].id, 'quantity': 0.5}])
+        progress = DailyProgress.objects.get(user=self.user)
+        self.assertAlmostEqual(progress.total_calories_consumed, 100 + 50.5)
+
+    def test_rejects_quantities_that_are_not_finite(self):
+        for quantity in (float('nan'), float('inf'), 0):
+            response = post_meal(self.client, [{'food_id': self.foods[0].id, 'quantity': quantity}])
+            self.assertEqual(response.status_code, 400)
+        self.assertFalse(Meal.objects.exists())
+        self.assertFalse(DailyProgress.objects.exists())
+
+    def test_rejects_food_ids_beyond_the_id_range(self):
+        for food_id in (2 ** 70, -2 ** 70, 2 ** 63):
+            response = post_meal(self.client, [{'food_id': food_id}])
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.json()['error'], 'Unknown food item')
+        response = self.client.post(reverse('sync_entries'), json.dumps({'meals': [
+            {'date': timezone.localdate().isoformat(), 'meal_type': 'LUNCH', 'food_items': [{'food_id': 2 ** 70}]},
+        ]}), content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Meal.objects.exists())
+
+    def test_rejects_foods_the_user_cannot_see(self):
+        other = make_user('bob')
+        private = FoodItem.objects.create(name='Secret', calories=1, created_by=other, is_custom=True)
+        response = post_meal(self.client, [{'food_id': private.id}])
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Meal.objects.exists())
+
+    def test_quick_add_uses_the_same_write_path(self):
+        response = self.client.post(reverse('quick_add_food', args=[self.foods[0].id]))
+        self.assertRedirects(response, reverse('dashboard'), fetch_redirect_response=False)
+        self.assertEqual(MealFoodItem.objects.get().meal.meal_type, 'SNACK')
+        self.assertAlmostEqual(DailyProgress.objects.get(user=self.user).total_calories_consumed, 100)
+
+
+class FoodUsageTests(TestCase):
+    def setUp(self):
+        self.user = make_user()
+        self.client.force_login(self.user)
+        self.foods = [FoodItem.objects.create(name=f'Food {i}', calories=100) for i in range(3)]
+
+    def quick_add_ids(self):
+        return [food['id'] for food in self.client.get(reverse('get_quick_add_foods')).json()]
+
+    def test_recent_uses_outrank_old_ones(self):
+        old, recent, _ = self.foods
+        now = timezone.now()
+        for _ in range(3):
+            record_usage(self.user, [old.id], now - timedelta(days=90))
+        record_usage(self.user, [recent.id], now)
+        # Three uses three half-lives ago are worth 3/8 of a use today
+        self.assertEqual(self.quick_add_ids()[:2], [recent.id, old.id])
+
+    def test_weights_run_out_of_float_range_84_years_after_the_epoch(self):
+        self.assertEqual(usage_weight(EPOCH + timedelta(days=HALF_LIFE_DAYS * 1023)), 2.0 ** 1023)
+        self.assertEqual((EPOCH + timedelta(days=HALF_LIFE_DAYS * 1024)).year, 2108)
+        with self.assertRaises(OverflowError):
+            usage_weight(EPOCH + timedelta(days=HALF_LIFE_DAYS * 1024))
+
+    def test_quick_add_is_one_index_read(self):
+        for food in self.foods:
+            log_meal(self.user, 'LUNCH', [(food.id, 1)])
+        # session, user, catalog version, recommendations (none built yet),
+        # usage join food, system foods to fill the list
+        with self.assertNumQueries(6):
+            ids = self.quick_add_ids()
+        self.assertEqual(set(ids[:3]), {food.id for food in self.foods})
+
+    def test_deleting_a_meal_takes_back_its_uses(self):
+        meal = log_meal(self.user, 'LUNCH', [(self.foods[0].id, 1), (self.foods[0].id, 2)])
+        usage = FoodUsage.objects.get(user=self.user, food_item=self.foods[0])
+        self.assertEqual(usage.use_count, 1)
+
+        self.client.delete(reverse('delete_meal', args=[meal.id]))
+        usage.refresh_from_db()
+        self.assertEqual(usage.use_count, 0)
+        self.assertAlmostEqual(usage.score, 0)
+        self.assertEqual(top_foods(self.user, 6), [])
+
+    def test_rebuild_matches_incremental_scores(self):
+        log_meal(self.user, 'BREAKFAST', [(self.foods[0].id, 1), (self.foods[1].id, 1)])
+        log_meal(self.user, 'LUNCH', [(self.foods[0].id, 1)])
+        incremental = {
+            usage.food_item_id: (usage.score, usage.use_count, usage.last_used)
+            for usage in FoodUsage.objects.filter(user=self.user)
+        }
+        self.assertEqual(rebuild_food_usage(self.user), 2)
+        for usage in FoodUsage.objects.filter(user=self.user):
+            score, use_count, last_used = incremental[usage.food_item_id]
+            self.assertAlmostEqual(usage.score, score, delta=score * 1e-6)
+            self.assertEqual(usage.use_count, use_count)
+            self.assertEqual(usage.last_used, last_used)
+
+
+class RecommendationTests(TestCase):
+    def setUp(self):
+        self.user = make_user()
+        self.client.force_login(self.user)
+        self.oats, self.milk, self.pasta, self.salad = [
+            FoodItem.objects.create(name=name, calories=100) for name in ('Oats', 'Milk', 'Pasta', 'Salad')
+        ]
+        today = timezone.now().replace(minute=0, second=0, microsecond=0)
+        for days_ago in range(3):
+            day = today - timedelta(days=days_ago)
+            self.log_at(day.replace(hour=8), 'BREAKFAST', self.oats, self.milk)
+            self.log_at(day.replace(hour=19), 'DINNER', self.pasta)
+        self.log_at(today.replace(hour=19), 'DINNER', self.salad)
+        self.log_at(today.replace(hour=9), 'SNACK', self.salad)
+        build_recommendations([self.user.pk])
+
+    def log_at(self, moment, meal_type, *foods):
+        meal = log_meal(self.user, meal_type, [(food.id, 1) for food in foods])
+        Meal.objects.filter(pk=meal.pk).update(created_at=moment)
+
+    def quick_add_names(self, **params):
+        response = self.client.get(reverse('get_quick_add_foods'), params)
+        return [food['name'] for food in response.json()]
+
+    def test_suggestions_follow_the_time_of_day(self):
+        self.assertEqual(self.quick_add_names(hour=8)[:2], ['Oats', 'Milk'])
+        self.assertEqual(self.quick_add_names(hour=20)[:2], ['Pasta', 'Salad'])
+        # A meal type narrows the hour down to what was logged as that meal
+        self.assertEqual(self.quick_add_names(hour=8, meal_type='snack')[0], 'Salad')
+
+    def test_companions_of_picked_foods_come_first(self):
+        names = self.quick_add_names(hour=19, **{'with': self.oats.id})
+        self.assertEqual(names[0], 'Milk')
+        self.assertNotIn('Oats', names)
+
+    def test_malformed_and_oversized_picked_ids_are_ignored(self):
+        url = reverse('get_quick_add_foods')
+        expected = self.quick_add_names(hour=19)
+        for picked in ('\u00b2', '99999999999999999999999', str(2 ** 63), '0', '-1', 'x'):
+            response = self.client.get(url, {'hour': 19, 'with': picked})
+            self.assertEqual(response.status_code, 200, picked)
+            self.assertEqual([food['name'] for food in response.json()], expected, picked)
+        # Only the first QUICK_ADD_MAX_WITH ids count
+        with mock.patch('caloe.views.QUICK_ADD_MAX_WITH', 1):
+            names = self.quick_add_names(hour=19, **{'with': [self.oats.id, self.milk.id]})
+        self.assertNotIn('Oats', names)
+        self.assertIn('Milk', names)
+
+    def test_lookup_is_one_query(self):
+        with self.assertNumQueries(1):
+            foods = recommend_foods(self.user, 'DINNER', 19, [self.pasta.id])
+        self.assertEqual([food.name for food in foods], ['Salad'])
+
+    def test_rebuilding_changes_the_etag(self):
+        first = self.client.get(reverse('get_quick_add_foods'), {'hour': 8})
+        build_recommendations([self.user.pk])
+        second = self.client.get(reverse('get_quick_add_foods'), {'hour': 8})
+        self.assertNotEqual(first['ETag'], second['ETag'])
+
+
+class RollupTests(TestCase):
+    ROLLUP_FIELDS = [
+        field for fields in SOURCE_FIELDS.values() for field in fields
+    ]
+
+    def setUp(self):
+        self.user = make_user()
+        self.food = FoodItem.objects.create(name='Rice', calories=200, protein=10, carbs=40, fat=2)
+        self.today = timezone.localdate()
+        days = [self.today - timedelta(days=offset) for offset in (1, 3, 10, 40, 45)]
+        import_entries(self.user, {
+            'meals': [
+                {'date': day.isoformat(), 'meal_type': 'LUNCH', 'food_items': [{'food_id': self.food.id, 'quantity': 1.5}]}
+                for day in days
+            ],
+            'water': [{'date': day.isoformat(), 'amount_ml': 250 * (i + 1)} for i, day in enumerate(days)],
+            'weights': [{'date': day.isoformat(), 'weight': 70 + i} for i, day in enumerate(days[::2])],
+        })
+
+    def write_and_delete(self):
+        log_meal(self.user, 'DINNER', [(self.food.id, 2)])
+        remove_meal(Meal.objects.get(user=self.user, date=self.today - timedelta(days=10)))
+        log_water(self.user, self.today, 500)
+        delete_water(WaterIntake.objects.get(user=self.user, date=self.today - timedelta(days=40)))
+        log_weight(self.user, self.today, 68.5)
+        log_weight(self.user, self.today - timedelta(days=45), 73)
+
+    def expected(self, period, start):
+        start, end = period_bounds(period, start)
+        progress = DailyProgress.objects.filter(user=self.user, date__range=[start, end])
+        water = WaterIntake.objects.filter(user=self.user, date__range=[start, end])
+        weights = WeightLog.objects.filter(user=self.user, date__range=[start, end])
+        return {
+            **progress.aggregate(days_logged=Count('id'), calories_sum=Sum('total_calories_consumed'),
+                                 protein_sum=Sum('total_protein'), carbs_sum=Sum('total_carbs'), fat_sum=Sum('total_fat')),
+            **water.aggregate(water_days=Count('date', distinct=True), water_sum=Sum('amount_ml')),
+            **weights.aggregate(weight_count=Count('id'), weight_avg=Avg('weight'), weight_max=Max('weight')),
+        }
+
+    def assertRollupsMatchSources(self):
+        source_days = set(DailyProgress.objects.filter(user=self.user).values_list('date', flat=True))
+        source_days |= set(WaterIntake.objects.filter(user=self.user).values_list('date', flat=True))
+        source_days |= set(WeightLog.objects.filter(user=self.user).values_list('date', flat=True))
+        buckets = {(period, period_bounds(period, day)[0]) for day in source_days for period in PERIODS}
+        rollups = {(rollup.period, rollup.period_start): rollup for rollup in NutritionRollup.objects.filter(user=self.user)}
+        self.assertTrue(buckets <= set(rollups))
+        for key, rollup in rollups.items():
+            for field, value in self.expected(*key).items():
+                self.assertAlmostEqual(getattr(rollup, field) or 0, value or 0, msg=f'{key} {field}')
+
+    def snapshot(self):
+        return {
+            (rollup['period'], rollup['period_start']): rollup
+            for rollup in NutritionRollup.objects.filter(user=self.user).values('period', 'period_start', *self.ROLLUP_FIELDS)
+        }
+
+    def test_buckets_follow_writes_and_deletes(self):
+        self.assertRollupsMatchSources()
+        self.write_and_delete()
+        self.assertRollupsMatchSources()
+        month = NutritionRollup.objects.get(user=self.user, period='MONTH', period_start=self.today.replace(day=1))
+        self.assertAlmostEqual(month.calories_max, 400)
+
+    def test_rebuild_matches_incremental_rollups_and_is_idempotent(self):
+        self.write_and_delete()
+        incremental = self.snapshot()
+        for _ in range(2):
+            call_command('rebuild_rollups', stdout=io.StringIO())
+            self.assertEqual(self.snapshot(), incremental)
+        self.assertRollupsMatchSources()
+
+
+class NutritionLedgerTests(TestCase):
+    def setUp(self):
+        self.user = make_user()
+        self.client.force_login(self.user)
+        self.rice = FoodItem.objects.create(name='Rice', calories=130, protein=3, carbs=28, fat=0.5)
+
+    def totals(self, day):
+        return DailyProgress.objects.filter(user=self.user, date=day).values_list(
+            'total_calories_consumed', 'total_protein', 'total_carbs', 'total_fat'
+        ).get()
+
+    def test_deleting_a_meal_takes_its_macros_off_its_own_day(self):
+        yesterday = timezone.now().date() - timedelta(days=1)
+        old = log_meal(self.user, 'DINNER', [(self.rice.id, 2)])
+        # Move the first meal, its totals and its ledger entry to yesterday
+        Meal.objects.filter(pk=old.pk).update(date=yesterday)
+        DailyProgress.objects.filter(user=self.user).update(date=yesterday)
+        NutritionLedgerEntry.objects.filter(user=self.user).update(date=yesterday)
+        log_meal(self.user, 'LUNCH', [(self.rice.id, 1)])
+
+        self.client.delete(reverse('delete_meal', args=[old.id]))
+        self.assertEqual(self.totals(yesterday), (0, 0, 0, 0))
+        self.assertEqual(self.totals(timezone.now().date()), (130, 3, 28, 0.5))
+        self.assertEqual(
+            list(NutritionLedgerEntry.objects.filter(date=yesterday).values_list('kind', 'meal_pk', 'calories')),
+            [('ADD', old.id, 260), ('DELETE', old.id, -260)],
+        )
+        self.assertEqual(find_drift(), [])
+
+    def test_rebuild_fixes_drift_and_reconciles_the_ledger(self):
+        meal = log_meal(self.user, 'LUNCH', [(self.rice.id, 1)])
+        # A day with meals but no totals, as seed data used to leave behind
+        other = log_meal(self.user, 'DINNER', [(self.rice.id, 3)])
+        Meal.objects.filter(pk=other.pk).update(date=meal.date - timedelta(days=3))
+        DailyProgress.objects.filter(user=self.user).update(total_calories_consumed=999, total_fat=7)
+
+        drift = find_drift()
+        self.assertEqual([row.date for row in drift], [meal.date - timedelta(days=3), meal.date])
+        self.assertEqual(drift[1].stored[0], 999)
+        self.assertEqual(drift[1].meals[0], 130)
+
+        self.assertEqual(len(rebuild_daily_progress()), 2)
+        self.assertEqual(self.totals(meal.date), (130, 3, 28, 0.5))
+        self.assertEqual(self.totals(meal.date - timedelta(days=3)), (390, 9, 84, 1.5))
+        self.assertEqual(find_drift(), [])
+        self.assertEqual(NutritionLedgerEntry.objects.filter(kind='REBUILD').count(), 2)
+
+    def test_meal_totals_are_one_grouped_query(self):
+        for _ in range(3):
+            log_meal(self.user, 'SNACK', [(self.rice.id, 1)])
+        with self.assertNumQueries(1):
+            totals = meal_totals_by_day()
+        self.assertEqual(totals, {(self.user.pk, timezone.now().date()): (390, 9, 84, 1.5)})
+
+    def test_check_reports_without_writing(self):
+        log_meal(self.user, 'LUNCH', [(self.rice.id, 1)])
+        DailyProgress.objects.update(total_calories_consumed=0)
+        out = io.StringIO()
+        call_command('rebuild_daily_progress', '--check', stdout=out)
+        self.assertIn('1 days drifted', out.getvalue())
+        self.assertEqual(self.totals(timezone.now().date())[0], 0)
+
+
+class MealSnapshotTests(TestCase):
+    def setUp(self):
+        self.user = make_user()
+        self.client.force_login(self.user)
+        self.food = FoodItem.objects.create(
+            name='Granola', calories=200, protein=5, carbs=30, fat=8, created_by=self.user, is_custom=True,
+        )
+        self.meal = log_meal(self.user, 'BREAKFAST', [(self.food.id, 1.5)])
+
+    def test_lines_and_meals_store_their_nutrients(self):
+        line = self.meal.food_items.get()
+        self.assertEqual(
+            (line.food_name, line.total_calories, line.total_protein, line.total_carbs, line.total_fat),
+            ('Granola', 300, 7.5, 45, 12),
+        )
+        self.assertEqual((self.meal.total_calories, self.meal.total_fat), (300, 12))
+
+    def test_editing_or_deleting_a_food_keeps_history(self):
+        self.food.calories = 999
+        self.food.save()
+        response = self.client.get(reverse('dashboard'))
+        self.assertContains(response, '300.0 kcal')
+        self.assertNotContains(response, '999')
+
+        self.food.delete()
+        line = MealFoodItem.objects.get()
+        self.assertIsNone(line.food_item)
+        self.assertEqual((line.food_name, line.total_calories), ('Granola', 300))
+        self.assertContains(self.client.get(reverse('dashboard')), 'Granola')
+
+    def test_deleting_a_meal_reads_no_foods(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.delete(reverse('delete_meal', args=[self.meal.id]))
+        self.assertFalse([query for query in queries if 'caloe_fooditem' in query['sql']])
+        self.assertEqual(DailyProgress.objects.get(user=self.user).total_fat, 0)
+
+    def test_lines_created_one_at_a_time_update_the_meal(self):
+        MealFoodItem.objects.create(meal=self.meal, food_item=self.food, quantity=1)
+        self.meal.refresh_from_db()
+        self.assertEqual(self.meal.total_calories, 500)
+
+
+class MealLineEditTests(TestCase):
+    def setUp(self):
+        self.user = make_user()
+        self.rice = FoodItem.objects.create(name='Rice', calories=130, protein=3, carbs=28, fat=0.5)
+        self.beans = FoodItem.objects.create(name='Beans', calories=120, protein=8, carbs=20, fat=1)
+        self.oats = FoodItem.objects.create(name='Oats', calories=150, protein=5, carbs=27, fat=3)
+        self.meal = log_meal(self.user, 'LUNCH', [(self.rice.id, 2), (self.beans.id, 1)])
+        self.rice_line = self.meal.food_items.get(food_item=self.rice)
+
+    def assertConsistent(self, calories):
+        self.meal.refresh_from_db()
+        lines = self.meal.food_items.aggregate(calories=Sum('total_calories'), fat=Sum('total_fat'))
+        self.assertAlmostEqual(self.meal.total_calories, lines['calories'] or 0)
+        self.assertAlmostEqual(self.meal.total_fat, lines['fat'] or 0)
+        self.assertAlmostEqual(self.meal.total_calories, calories)
+        self.assertAlmostEqual(DailyProgress.objects.get(user=self.user).total_calories_consumed, calories)
+        self.assertEqual(find_drift(), [])
+        rollup = NutritionRollup.objects.get(user=self.user, period='WEEK')
+        self.assertAlmostEqual(rollup.calories_sum, calories)
+
+    def use_counts(self):
+        return dict(FoodUsage.objects.filter(user=self.user).values_list('food_item__name', 'use_count'))
+
+    def test_quantity_edits_scale_the_line_snapshot(self):
+        # A later change to the food does not leak into the logged line
+        FoodItem.objects.filter(pk=self.rice.pk).update(calories=999)
+        version = CustomUser.objects.get(pk=self.user.pk).data_version
+        self.rice_line.quantity = 3
+        save_meal_line(self.rice_line)
+        self.assertEqual(MealFoodItem.objects.get(pk=self.rice_line.pk).total_calories, 390)
+        self.assertConsistent(390 + 120)
+        self.assertGreater(CustomUser.objects.get(pk=self.user.pk).data_version, version)
+        self.assertEqual(NutritionLedgerEntry.objects.filter(kind='EDIT').get().calories, 130)
+
+    def test_adding_changing_and_deleting_lines(self):
+        save_meal_line(MealFoodItem(meal=self.meal, food_item=self.oats, quantity=1))
+        self.assertConsistent(260 + 120 + 150)
+        self.assertEqual(self.use_counts(), {'Rice': 1, 'Beans': 1, 'Oats': 1})
+
+        line = MealFoodItem.objects.get(pk=self.rice_line.pk)
+        line.food_item = self.oats
+        save_meal_line(line)
+        self.assertEqual(MealFoodItem.objects.get(pk=line.pk).food_name, 'Oats')
+        self.assertConsistent(300 + 120 + 150)
+        # Oats was already in the meal, so only rice loses its use
+        self.assertEqual(self.use_counts(), {'Rice': 0, 'Beans': 1, 'Oats': 1})
+
+        for line in list(self.meal.food_items.all()):
+            remove_meal_line(line)
+        self.assertConsistent(0)
+        self.assertEqual(self.use_counts(), {'Rice': 0, 'Beans': 0, 'Oats': 0})
+
+    def test_admin_edits_and_deletes_go_through_tracking(self):
+        admin_user = CustomUser.objects.create_superuser('admin', 'admin@example.com', 'secret-pass-123')
+        self.client.force_login(admin_user)
+        response = self.client.post(reverse('admin:caloe_mealfooditem_change', args=[self.rice_line.pk]), {
+            'meal': self.meal.pk, 'food_item': self.rice.pk, 'quantity': 1,
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertConsistent(130 + 120)
+
+        beans_line = self.meal.food_items.get(food_item=self.beans)
+        self.client.post(reverse('admin:caloe_mealfooditem_delete', args=[beans_line.pk]), {'post': 'yes'})
+        self.assertConsistent(130)
+
+        self.client.post(reverse('admin:caloe_meal_delete', args=[self.meal.pk]), {'post': 'yes'})
+        self.assertFalse(Meal.objects.exists())
+        self.assertEqual(DailyProgress.objects.get(user=self.user).total_calories_consumed, 0)
+        self.assertEqual(find_drift(), [])
+
+
+class SyncTests(TestCase):
+    def setUp(self):
+        self.user = make_user()
+        self.client.force_login(self.user)
+        self.food = FoodItem.objects.create(name='Oats', calories=150, protein=5, carbs=27, fat=3)
+        self.today = timezone.localdate()
+
+    def payload(self, days):
+        return {
+            'meals': [
+                {'date': (self.today - timedelta(days=day)).isoformat(), 'time': '08:30', 'meal_type': 'BREAKFAST',
+                 'food_items': [{'food_id': self.food.id, 'quantity': 2}]}
+                for day in range(days)
+            ],
+            'water': [{'date': (self.today - timedelta(days=day)).isoformat(), 'amount_ml': 500} for day in range(days)],
+            'weights': [{'date': (self.today - timedelta(days=day)).isoformat(), 'weight': 70} for day in range(days)],
+        }
+
+    def sync(self, payload):
+        return self.client.post(reverse('sync_entries'), json.dumps(payload), content_type='application/json')
+
+    def test_entries_land_on_their_own_days(self):
+        response = self.sync(self.payload(3))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['meals'], 3)
+        past = DailyProgress.objects.get(user=self.user, date=self.today - timedelta(days=2))
+        self.assertEqual(
+            (past.total_calories_consumed, past.total_protein, past.total_carbs, past.total_fat), (300, 10, 54, 6)
+        )
+        meal = Meal.objects.get(date=self.today - timedelta(days=2))
+        self.assertEqual(timezone.localtime(meal.created_at).hour, 8)
+        self.assertEqual(meal.total_calories, 300)
+        self.assertEqual(WaterIntake.objects.filter(user=self.user).count(), 3)
+        self.assertEqual(FoodUsage.objects.get(user=self.user).use_count, 3)
+        self.assertEqual(find_drift(), [])
+
+    def test_query_count_does_not_grow_with_the_batch(self):
+        counts = []
+        for days in (2, 6):
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.sync(self.payload(days)).status_code, 200)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_invalid_entries_write_nothing(self):
+        payload = self.payload(2)
+        payload['meals'][1]['food_items'][0]['food_id'] = 999999
+        payload['water'][0]['date'] = (self.today + timedelta(days=1)).isoformat()
+        response = self.sync(payload)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([error['entry'] for error in response.json()['errors']], ['water[0]', 'meals[1]'])
+        self.assertFalse(Meal.objects.exists())
+        self.assertFalse(WaterIntake.objects.exists())
+
+    def test_retried_batches_are_imported_once(self):
+        payload = {**self.payload(2), 'batch_id': 'phone-1:42'}
+        first = self.sync(payload).json()
+        self.assertFalse(first['duplicate'])
+        with self.assertNumQueries(3):
+            retry = self.sync(payload).json()
+        self.assertTrue(retry['duplicate'])
+        self.assertEqual({**retry, 'duplicate': False}, first)
+        self.assertEqual(Meal.objects.count(), 2)
+        self.assertEqual(WaterIntake.objects.count(), 2)
+        self.assertEqual(DailyProgress.objects.get(user=self.user, date=self.today).total_calories_consumed, 300)
+        # Another batch id is another batch
+        self.assertFalse(self.sync({**payload, 'batch_id': 'phone-1:43'}).json()['duplicate'])
+        self.assertEqual(Meal.objects.count(), 4)
+
+    def test_rejects_values_that_are_not_finite(self):
+        payload = self.payload(3)
+        payload['meals'][0]['food_items'][0]['quantity'] = float('nan')
+        payload['meals'][1]['food_items'][0]['quantity'] = float('inf')
+        payload['water'][0]['amount_ml'] = float('inf')
+        payload['weights'][0]['weight'] = float('nan')
+        payload['batch_id'] = ''
+        response = self.sync(payload)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([error['entry'] for error in response.json()['errors']], ['batch_id'])
+        del payload['batch_id']
+        response = self.sync(payload)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            [error['entry'] for error in response.json()['errors']], ['meals[0]', 'meals[1]', 'water[0]', 'weights[0]']
+        )
+        self.assertFalse(Meal.objects.exists())
+        self.assertFalse(DailyProgress.objects.exists())
+
+    def test_weigh_ins_replace_the_days_entry(self):
+        WeightLog.objects.create(user=self.user, date=self.today, weight=75)
+        self.sync({'weights': [{'date': self.today.isoformat(), 'weight': 74.5, 'notes': 'synced'}]})
+        log = WeightLog.objects.get(user=self.user)
+        self.assertEqual((log.weight, log.notes), (74.5, 'synced'))
+
+
+class ChangeFeedTests(TestCase):
+    def setUp(self):
+        self.user = make_user()
+        self.client.force_login(self.user)
+        self.food = FoodItem.objects.create(name='Toast', calories=80, created_by=self.user, is_custom=True)
+        self.meal = log_meal(self.user, 'BREAKFAST', [(self.food.id, 2)])
+        self.water = log_water(self.user, timezone.localdate(), 300)
+
+    def feed(self, cursor=None, **params):
+        if cursor:
+            params['cursor'] = cursor
+        return self.client.get(reverse('sync_changes'), params).json()
+
+    def test_second_sync_only_returns_what_changed(self):
+        first = self.feed()
+        self.assertEqual([meal['id'] for meal in first['changes']['meals']], [self.meal.id])
+        self.assertEqual(first['changes']['meals'][0]['food_items'][0]['total_calories'], 160)
+        self.assertEqual([food['id'] for food in first['changes']['foods']], [self.food.id])
+        self.assertFalse(first['has_more'])
+
+        self.food.name = 'Rye toast'
+        self.food.save(update_fields=['name'])
+        water_id = self.water.id
+        delete_water(self.water)
+        second = self.feed(first['cursor'])
+        self.assertEqual([food['name'] for food in second['changes']['foods']], ['Rye toast'])
+        self.assertEqual(second['changes']['meals'], [])
+        self.assertEqual(second['deleted']['water'], [water_id])
+        self.assertEqual(self.feed(second['cursor'])['deleted']['water'], [])
+
+    def test_pages_cover_every_change_once(self):
+        for day in range(1, 6):
+            log_weight(self.user, timezone.localdate() - timedelta(days=day), 70 + day)
+        seen, cursor, more = [], None, True
+        while more:
+            page = self.feed(cursor, limit=2)
+            seen += [(name, record['id']) for name, records in page['changes'].items() for record in records]
+            cursor, more = page['cursor'], page['has_more']
+        self.assertEqual(len(seen), 8)
+        self.assertEqual(len(set(seen)), 8)
+
+    def test_sync_cost_does_not_grow_with_history(self):
+        for day in range(1, 30):
+            log_water(self.user, timezone.localdate() - timedelta(days=day), 250)
+        cursor = self.feed()['cursor']
+        log_water(self.user, timezone.localdate(), 250)
+        # session, user, one range scan per feed and one for tombstones
+        with self.assertNumQueries(8):
+            page = self.feed(cursor)
+        self.assertEqual(len(page['changes']['water']), 1)
+
+    def test_cursors_are_checked(self):
+        other = make_user('bob')
+        other_cursor = Client()
+        other_cursor.force_login(other)
+        cursor = other_cursor.get(reverse('sync_changes')).json()['cursor']
+        self.assertEqual(self.client.get(reverse('sync_changes'), {'cursor': cursor}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('sync_changes'), {'cursor': 'garbage'}).status_code, 400)
+
+    def test_deleting_the_user_leaves_no_tombstones(self):
+        self.user.delete()
+        self.assertFalse(Tombstone.objects.exists())
+
+
+class QueryPlanTests(TestCase):
+    """
+    EXPLAIN QUERY PLAN of every query the views run. SQLite plans without
+    table statistics as if tables were large, so a scan here is a scan in
+    production too.
+    """
+    # Statements that can read a table; inserts and savepoints cannot
+    EXPLAINED = ('SELECT', 'UPDATE', 'DELETE')
+    # SCAN of anything but a subquery's results or a constant row
+    FULL_SCAN = re.compile(r'^SCAN (?!CONSTANT ROW|\(?subquery)')
+
+    def setUp(self):
+        self.user = make_user()
+        self.client.force_login(self.user)
+        self.food = FoodItem.objects.create(name='Rice', calories=130, protein=2.5, carbs=28, fat=0.5)
+        today = timezone.localdate()
+        self.meal = log_meal(self.user, 'LUNCH', [(self.food.id, 1)])
+        log_water(self.user, today, 300)
+        log_weight(self.user, today - timedelta(days=1), 70)
+        log_weight(self.user, today, 69.5)
+
+    def plans(self, method, url, **kwargs):
+        """(sql, plan lines) of every query a request runs"""
+        with CaptureQueriesContext(connection) as queries:
+            getattr(self.client, method)(url, **kwargs)
+        plans = []
+        with connection.cursor() as cursor:
+            for query in queries:
+                if query['sql'].startswith(self.EXPLAINED):
+                    cursor.execute(f"EXPLAIN QUERY PLAN {query['sql']}")
+                    plans.append((query['sql'], [row[3] for row in cursor.fetchall()]))
+        return plans
+
+    def plan_of(self, plans, table):
+        """The plan of the one query reading from table"""
+        matches = [plan for sql, plan in plans if f'FROM "{table}"' in sql]
+        self.assertEqual(len(matches), 1, matches)
+        return ' | '.join(matches[0])
+
+    def test_views_never_scan_a_table(self):
+        today = timezone.localdate().isoformat()
+        requests = [
+            ('get', reverse('dashboard'), {}),
+            ('get', reverse('water_tracker'), {}),
+            ('get', reverse('weight_log'), {}),
+            ('get', reverse('progress_photos'), {}),
+            ('get', reverse('my_food_items'), {}),
+            ('get', reverse('food_search'), {'data': {'query': 'ri'}}),
+            ('get', reverse('daily_progress'), {}),
+            ('get', reverse('get_quick_add_foods'), {}),
+            ('get', reverse('sync_changes'), {}),
+            ('get', reverse('analytics'), {'data': {'period': 'month'}}),
+            ('get', reverse('analytics'), {'data': {'period': 'year'}}),
+            ('get', reverse('analytics_series', args=['water']), {}),
+            ('get', reverse('analytics_series', args=['weight']), {'data': {'group': 'week'}}),
+            ('post', reverse('add_meal'), {
+                'data': json.dumps({'meal_type': 'DINNER', 'food_items': [{'food_id': self.food.id}]}),
+                'content_type': 'application/json',
+            }),
+            ('post', reverse('sync_entries'), {
+                'data': json.dumps({'water': [{'date': today, 'amount_ml': 250}]}),
+                'content_type': 'application/json',
+            }),
+            ('delete', reverse('delete_meal', args=[self.meal.id]), {}),
+        ]
+        for method, url, kwargs in requests:
+            for sql, plan in self.plans(method, url, **kwargs):
+                with self.subTest(url=url, sql=sql):
+                    self.assertFalse([step for step in plan if self.FULL_SCAN.match(step)], plan)
+
+    def test_date_access_paths_use_the_composite_indexes(self):
+        plans = self.plans('get', reverse('dashboard'))
+        meals = self.plan_of(plans, 'caloe_meal')
+        # Both columns searched and the index already in created_at order
+        self.assertIn('caloe_meal_user_date_idx (user_id=? AND date=?)', meals)
+        self.assertNotIn('TEMP B-TREE', meals)
+
+        plans = self.plans('get', reverse('water_tracker'))
+        intakes = [' | '.join(plan) for sql, plan in plans if 'FROM "caloe_waterintake"' in sql]
+        self.assertEqual(len(intakes), 2)
+        for plan in intakes:
+            self.assertIn('caloe_water_user_date_idx (user_id=? AND date=?)', plan)
+            self.assertNotIn('TEMP B-TREE', plan)
+        # The day's total is read from the index alone
+        self.assertTrue(any('COVERING INDEX' in plan for plan in intakes))
+
+        photos = self.plan_of(self.plans('get', reverse('progress_photos')), 'caloe_progressphoto')
+        self.assertIn('caloe_photo_user_date_idx', photos)
+        self.assertNotIn('TEMP B-TREE', photos)
+
+        water = self.plan_of(self.plans('get', reverse('analytics_series', args=['water'])), 'caloe_waterintake')
+        self.assertIn('COVERING INDEX caloe_water_user_date_idx (user_id=? AND date>? AND date<?)', water)
+        self.assertNotIn('TEMP B-TREE', water)
+
+
+class ConcurrentMealLoggingTests(TransactionTestCase):
+    def test_parallel_submissions_keep_exact_totals(self):
+        user = make_user()
+        food = FoodItem.objects.create(name='Rice', calories=130, protein=2.5, carbs=28, fat=0.5)
+        clients = []
+        for _ in range(6):
+            client = Client()
+            client.force_login(user)
+            clients.append(client)
+
+        barrier = threading.Barrier(len(clients))
+        errors = []
+
+        def submit(client):
+            try:
+                barrier.wait()
+                for _ in range(5):
+                    response = post_meal(client, [{'food_id': food.id, 'quantity': 1}])
+                    if response.status_code != 200:
+                        errors.append(response.status_code)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=submit, args=(client,)) for client in clients]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(Meal.objects.filter(user=user).count(), 30)
+        progress = DailyProgress.objects.get(user=user)
+        self.assertAlmostEqual(progress.total_calories_consumed, 30 * 130)
+        self.assertAlmostEqual(progress.total_protein, 30 * 2.5)
+        self.assertAlmostEqual(progress.total_carbs, 30 * 28)
+        self.assertAlmostEqual(progress.total_fat, 30 * 0.5)
+
+
+class DashboardQueryBudgetTests(TestCase):
+    # session, user, DailyProgress, meals with totals, prefetched line items
+    QUERY_BUDGET = 5
+
+    def setUp(self):
+        self.user = make_user()
+        self.client.force_login(self.user)
+        self.foods = [FoodItem.objects.create(name=f'Food {i}', calories=50 * (i + 1)) for i in range(3)]
+
+    def log_meals(self, count):
+        for _ in range(count):
+            post_meal(self.client, [{'food_id': food.id, 'quantity': 1} for food in self.foods])
+
+    def test_reading_an_empty_day_creates_no_row(self):
+        for url in (reverse('dashboard'), reverse('daily_progress')):
+            self.assertEqual(self.client.get(url).status_code, 200)
+        self.assertFalse(DailyProgress.objects.exists())
+
+    def test_query_count_does_not_grow_with_meals(self):
+        for meals in (1, 8):
+            self.log_meals(meals)
+            with self.assertNumQueries(self.QUERY_BUDGET):
+                response = self.client.get(reverse('dashboard'))
+            self.assertEqual(response.status_code, 200)
+
+    def test_meal_totals_are_stored(self):
+        self.log_meals(2)
+        response = self.client.get(reverse('dashboard'))
+        meals = list(response.context['today_meals'])
+        self.assertEqual([meal['total_calories'] for meal in meals], [300, 300])
+        self.assertAlmostEqual(response.context['calories_remaining'], max(0, self.user.get_daily_calorie_target() - 600))
+
+
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        self.user = make_user()
+        self.client.force_login(self.user)
+        self.food = FoodItem.objects.create(name='Oatmeal', calories=150)
+
+    def urls(self):
+        return [
+            (reverse('daily_progress'), {}),
+            (reverse('get_quick_add_foods'), {}),
+            (reverse('food_search'), {'search_query': 'oat', 'HTTP_X_REQUESTED_WITH': 'XMLHttpRequest'}),
+        ]
+
+    def get(self, url, extra, etag=None):
+        params = {'search_query': extra['search_query']} if 'search_query' in extra else {}
+        headers = {key: value for key, value in extra.items() if key.startswith('HTTP_')}
+        if etag:
+            headers['HTTP_IF_NONE_MATCH'] = etag
+        return self.client.get(url, params, **headers)
+
+    def test_unchanged_data_is_answered_with_304_before_the_main_queries(self):
+        for url, extra in self.urls():
+            response = self.get(url, extra)
+            self.assertEqual(response.status_code, 200)
+            self.assertFalse(response['ETag'].startswith('W/'))
+            # session and user, plus the catalog version where system foods are listed
+            with self.assertNumQueries(2 if url == reverse('daily_progress') else 3):
+                response = self.get(url, extra, response['ETag'])
+            self.assertEqual(response.status_code, 304)
+
+    def test_writes_change_the_etag(self):
+        etags = [self.get(url, extra)['ETag'] for url, extra in self.urls()]
+        post_meal(self.client, [{'food_id': self.food.id}])
+        for (url, extra), etag in zip(self.urls(), etags):
+            self.assertEqual(self.get(url, extra, etag).status_code, 200)
+
+    def test_catalog_changes_and_profile_edits_change_the_etag(self):
+        for change in (
+            lambda: FoodItem.objects.create(name='Oat Bran', calories=250),
+            lambda: CustomUser.objects.get(pk=self.user.pk).save(),
+        ):
+            url, extra = self.urls()[2]
+            etag = self.get(url, extra)['ETag']
+            change()
+            self.assertEqual(self.get(url, extra, etag).status_code, 200)
+
+    def test_system_food_changes_bump_the_catalog_not_every_user(self):
+        other = make_user('bob')
+        versions = lambda: (catalog_version(), *CustomUser.objects.order_by('pk').values_list('data_version', flat=True))
+        progress_etag = self.get(reverse('daily_progress'), {})['ETag']
+        before = versions()
+
+        # The food and one catalog row, however many users there are
+        with self.assertNumQueries(2):
+            self.food.save(update_fields=['calories'])
+        self.assertEqual(versions(), (before[0] + 1, *before[1:]))
+        self.assertEqual(self.get(reverse('daily_progress'), {}, progress_etag).status_code, 304)
+
+        FoodItem.objects.create(name='Bob Bars', calories=300, created_by=other, is_custom=True)
+        self.assertEqual(versions(), (before[0] + 1, before[1], before[2] + 1))
+
+    def test_full_saves_do_not_write_back_a_stale_version(self):
+        stale = CustomUser.objects.get(pk=self.user.pk)
+        self.user.bump_data_version()
+        self.user.bump_data_version()
+        stale.first_name = 'Alice'
+        stale.save()
+        self.user.refresh_from_db()
+        # Two bumps plus the save's own, none lost to the stale copy
+        self.assertEqual(self.user.data_version, stale.data_version + 3)
+        self.assertEqual(self.user.first_name, 'Alice')
+
+
+class UserCacheTests(TestCase):
+    def setUp(self):
+        self.user = make_user()
+        self.client.force_login(self.user)
+        self.food = FoodItem.objects.create(name='Oatmeal', calories=150)
+        reset_cache_stats()
+
+    def test_repeat_reads_are_served_from_the_cache(self):
+        post_meal(self.client, [{'food_id': self.food.id}])
+        self.client.get(reverse('dashboard'))
+        # session and user only
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('dashboard'))
+        self.assertEqual([meal['total_calories'] for meal in response.context['today_meals']], [150])
+        self.assertEqual(cache_stats()['dashboard'], {
+            'hits': 1, 'stale': 0, 'waits': 0, 'misses': 1, 'refreshes': 0, 'hit_ratio': 0.5,
+        })
+
+    def test_dashboard_entries_hold_plain_values(self):
+        today = timezone.now().date()
+        for log in (False, True):
+            if log:
+                post_meal(self.client, [{'food_id': self.food.id}])
+            self.client.get(reverse('dashboard'))
+            self.user.refresh_from_db()
+            value, _, _ = cache_backend().get(user_key(self.user, 'dashboard', (today,)))
+            stored = pickle.dumps(value)
+            self.assertNotIn(self.user.password.encode(), stored)
+            self.assertNotIn(b'django.db.models', stored)
+            self.assertNotIn(b'caloe.models', stored)
+        self.assertEqual(value['meals'][0]['food_items'][0]['food_name'], 'Oatmeal')
+
+    def test_a_write_invalidates_every_entry_of_the_user(self):
+        urls = [reverse('dashboard'), reverse('get_quick_add_foods'), reverse('food_search'), reverse('analytics')]
+        for url in urls:
+            self.client.get(url)
+        post_meal(self.client, [{'food_id': self.food.id}])
+        response = self.client.get(reverse('dashboard'))
+        self.assertEqual(len(response.context['today_meals']), 1)
+        for url in urls[1:]:
+            self.client.get(url)
+        stats = cache_stats()
+        self.assertEqual({entry['hits'] for entry in stats.values()}, {0})
+        self.assertEqual({stats[name]['misses'] for name in ('dashboard', 'quick_add', 'food_search', 'analytics_stats')}, {2})
+
+    def test_catalog_changes_reach_every_user(self):
+        self.client.get(reverse('food_search'))
+        FoodItem.objects.create(name='Oat Bran', calories=250)
+        response = self.client.get(reverse('food_search'))
+        self.assertEqual(len(response.context['food_items']), 2)
+
+    @mock.patch('caloe.views.FOOD_CATALOG_PAGE_SIZE', 2)
+    def test_catalog_pages_are_bounded_before_caching(self):
+        for name in ('Oat Bran', 'Oat Milk', 'Rolled Oats'):
+            FoodItem.objects.create(name=name, calories=100)
+        for params in ({}, {'search_query': 'oat'}):
+            response = self.client.get(reverse('food_search'), params)
+            self.assertEqual([food['name'] for food in response.context['food_items']], ['Oat Bran', 'Oat Milk'])
+            self.assertTrue(response.context['has_more'])
+            self.assertContains(response, 'Showing the first 2 matches')
+
+    def test_keys_are_per_user_and_version(self):
+        other = make_user('bob')
+        key = user_key(self.user, 'dashboard', (date(2024, 3, 1),))
+        self.assertNotEqual(key, user_key(other, 'dashboard', (date(2024, 3, 1),)))
+        self.assertNotEqual(key, user_key(self.user, 'dashboard', (date(2024, 3, 2),)))
+        self.user.bump_data_version()
+        self.user.refresh_from_db()
+        self.assertNotEqual(key, user_key(self.user, 'dashboard', (date(2024, 3, 1),)))
+
+        cached(self.user, 'stats', (), lambda: 'alice')
+        self.assertEqual(cached(other, 'stats', (), lambda: 'bob'), 'bob')
+
+    def test_metrics_are_staff_only(self):
+        self.client.get(reverse('dashboard'))
+        self.assertEqual(self.client.get(reverse('cache_metrics')).status_code, 302)
+        CustomUser.objects.filter(pk=self.user.pk).update(is_staff=True)
+        response = self.client.get(reverse('cache_metrics'))
+        self.assertEqual(response.json()['entries']['dashboard']['misses'], 1)
+
+
+class SingleFlightTests(SimpleTestCase):
+    def setUp(self):
+        self.user = mock.Mock(pk=1, date_joined=timezone.now(), data_version=0)
+        self.computations = 0
+        reset_cache_stats()
+
+    def slow_compute(self, started=None, release=None):
+        def compute():
+            self.computations += 1
+            if started:
+                started.set()
+            release.wait(5) if release else time.sleep(0.2)
+            return self.computations
+        return compute
+
+    def run_concurrently(self, count, target):
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(target())) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_concurrent_misses_share_one_computation(self):
+        compute = self.slow_compute()
+        results = self.run_concurrently(8, lambda: cached(self.user, 'stats', ('year',), compute))
+        self.assertEqual(self.computations, 1)
+        self.assertEqual(results, [1] * 8)
+        stats = cache_stats()['stats']
+        self.assertEqual((stats['misses'], stats['waits']), (1, 7))
+
+    def test_stale_value_is_served_while_one_request_refreshes(self):
+        cached(self.user, 'stats', (), lambda: 'old', timeout=60)
+        started, release = threading.Event(), threading.Event()
+        later = time.time() + 61
+        with mock.patch('caloe.cache.time.time', return_value=later):
+            refresh = threading.Thread(target=cached, args=(self.user, 'stats', (), self.slow_compute(started, release)))
+            refresh.start()
+            started.wait(5)
+            # The refresh holds the lock; everyone else gets the old value
+            results = self.run_concurrently(4, lambda: cached(self.user, 'stats', (), self.slow_compute()))
+            release.set()
+            refresh.join()
+            self.assertEqual(results, ['old'] * 4)
+            self.assertEqual(self.computations, 1)
+            self.assertEqual(cached(self.user, 'stats', (), self.slow_compute()), 1)
+        stats = cache_stats()['stats']
+        self.assertEqual((stats['refreshes'], stats['stale']), (1, 4))
+
+    def test_refreshes_start_early_with_rising_probability(self):
+        now = time.time()
+        with mock.patch('caloe.cache.random.random', return_value=0.5):
+            # -ln(0.5) of a one second computation, about 0.69s, before expiry
+            self.assertFalse(refresh_due(1, now + 5))
+            self.assertTrue(refresh_due(1, now + 0.5))
+        self.assertTrue(refresh_due(0, now - 1))
+
+    def test_a_failed_computation_releases_the_key(self):
+        def fail():
+            raise ValueError('boom')
+        with self.assertRaises(ValueError):
+            cached(self.user, 'stats', (), fail)
+        self.assertEqual(cached(self.user, 'stats', (), lambda: 'ok'), 'ok')
+
+
+class PerformanceMiddlewareTests(TestCase):
+    def setUp(self):
+        self.user = make_user()
+        self.client.force_login(self.user)
+        for histogram in HISTOGRAMS:
+            histogram.clear()
+
+    def test_server_timing_reports_queries_and_templates(self):
+        response = self.client.get(reverse('dashboard'))
+        timing = dict(re.match(r'(\w+);dur=([\d.]+)', part.strip()).groups() for part in response['Server-Timing'].split(','))
+        self.assertEqual(set(timing), {'app', 'db', 'tpl'})
+        self.assertGreater(float(timing['tpl']), 0)
+        self.assertLessEqual(float(timing['db']) + float(timing['tpl']), float(timing['app']))
+        # session, user, DailyProgress, meals
+        self.assertIn('desc="4 queries"', response['Server-Timing'])
+
+    def test_metrics_expose_per_view_histograms(self):
+        self.client.get(reverse('dashboard'))
+        self.client.get(reverse('dashboard'))
+        with self.settings(CALOE_METRICS_ALLOWED_IPS=['127.0.0.1']):
+            response = self.client.get(reverse('metrics'))
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        body = response.content.decode()
+        self.assertIn('caloe_request_duration_seconds_count{view="dashboard",method="GET"} 2', body)
+        self.assertIn('caloe_request_queries_bucket{view="dashboard",method="GET",le="5"} 2', body)
+        self.assertIn('caloe_response_size_bytes_bucket{view="dashboard",method="GET",le="+Inf"} 2', body)
+        self.assertIn('caloe_cache_requests_total{name="dashboard",outcome="hit"}', body)
+
+    def test_metrics_need_an_allowed_address_or_staff(self):
+        self.assertEqual(reverse('metrics'), '/metrics/')
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        with self.settings(CALOE_METRICS_ALLOWED_IPS=['127.0.0.1']):
+            self.assertEqual(self.client.get(reverse('metrics')).status_code, 200)
+        CustomUser.objects.filter(pk=self.user.pk).update(is_staff=True)
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 200)
+
+    def test_slow_requests_are_logged_with_their_slowest_queries(self):
+        with self.settings(CALOE_SLOW_REQUEST_MS=0), self.assertLogs('caloe.performance', 'WARNING') as logs:
+            self.client.get(reverse('dashboard'))
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual((record['event'], record['view'], record['status']), ('slow_request', 'dashboard', 200))
+        self.assertEqual(len(record['slowest_queries']), record['queries'])
+        self.assertTrue(all(query['sql'].startswith('SELECT') for query in record['slowest_queries']))
+
+    def test_unsampled_requests_are_not_recorded(self):
+        with self.settings(CALOE_PERF_SAMPLE_RATE=0):
+            response = self.client.get(reverse('dashboard'))
+        self.assertNotIn('Server-Timing', response)
+        self.assertEqual(REQUEST_SECONDS.series, {})
+
+
+class LocalBrokerTests(SimpleTestCase):
+    async def test_publish_from_another_thread_reaches_subscribers(self):
+        broker = LocalBroker()
+        first = broker.subscribe('user:1')
+        second = broker.subscribe('user:1')
+        other = broker.subscribe('user:2')
+
+        publisher = threading.Thread(target=broker.publish, args=('user:1', {'total_consumed': 300}))
+        publisher.start()
+        publisher.join()
+        for subscription in (first, second):
+            self.assertEqual(await asyncio.wait_for(subscription.get(), 1), {'total_consumed': 300})
+        self.assertTrue(other.queue.empty())
+
+        for subscription in (first, second):
+            subscription.close()
+        self.assertFalse(broker.has_subscribers('user:1'))
+        self.assertTrue(broker.has_subscribers('user:2'))
+
+    async def test_slow_subscribers_keep_the_latest_messages(self):
+        broker = LocalBroker()
+        subscription = broker.subscribe('user:1')
+        for total in range(SUBSCRIBER_BUFFER + 3):
+            broker.publish('user:1', total)
+        await asyncio.sleep(0)
+        received = [subscription.queue.get_nowait() for _ in range(subscription.queue.qsize())]
+        self.assertEqual(received, list(range(3, SUBSCRIBER_BUFFER + 3)))
+
+
+class ProgressStreamTests(TransactionTestCase):
+    async def test_stream_pushes_totals_after_each_write(self):
+        user = await sync_to_async(make_user)()
+        food = await FoodItem.objects.acreate(name='Rice', calories=130)
+        await self.async_client.aforce_login(user)
+
+        response = await self.async_client.get(reverse('progress_stream'))
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        events = aiter(response.streaming_content)
+
+        async def next_totals():
+            chunk = await asyncio.wait_for(anext(events), 5)
+            chunk = chunk.decode() if isinstance(chunk, bytes) else chunk
+            self.assertTrue(chunk.startswith('event: progress\n'))
+            return json.loads(chunk.split('data: ', 1)[1])
+
+        self.assertEqual((await next_totals())['total_consumed'], 0)
+        await sync_to_async(log_meal)(user, 'LUNCH', [(food.id, 2)])
+        self.assertEqual((await next_totals())['total_consumed'], 260)
+        await sync_to_async(log_water)(user, timezone.now().date(), 500)
+        self.assertEqual((await next_totals())['water_ml'], 500)
+
+        # A client disconnect cancels the pending read, which unsubscribes
+        reader = asyncio.ensure_future(anext(events))
+        await asyncio.sleep(0.05)
+        reader.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await reader
+        self.assertFalse(get_broker().has_subscribers(user_channel(user.pk)))
+
+    def test_wsgi_requests_are_told_not_to_reconnect(self):
+        user = make_user()
+        self.client.force_login(user)
+        response = self.client.get(reverse('progress_stream'))
+        self.assertEqual(response.status_code, 204)
+        self.assertFalse(response.streaming)
+        self.assertFalse(get_broker().has_subscribers(user_channel(user.pk)))
+
+    def test_writes_without_an_open_stream_skip_the_read(self):
+        user = make_user()
+        food = FoodItem.objects.create(name='Rice', calories=130)
+        # Same count as AddMealTests: nothing is read for the stream
+        with self.assertNumQueries(16):
+            log_meal(user, 'LUNCH', [(food.id, 1)])
+
+
+class DashboardReadContentionTests(TransactionTestCase):
+    READERS = 4
+    READS_PER_READER = 10
+
+    def test_reads_proceed_while_a_writer_holds_the_lock(self):
+        user = make_user()
+        clients = []
+        for _ in range(self.READERS):
+            client = Client()
+            client.force_login(user)
+            clients.append(client)
+
+        # Stand-in for an in-flight meal write: hold SQLite's write lock
+        writer = sqlite3.connect(connection.settings_dict['NAME'])
+        writer.execute('BEGIN IMMEDIATE')
+        latencies = []
+        errors = []
+
+        def read(client):
+            try:
+                for _ in range(self.READS_PER_READER):
+                    for url in (reverse('dashboard'), reverse('daily_progress')):
+                        start = time.perf_counter()
+                        response = client.get(url)
+                        latencies.append(time.perf_counter() - start)
+                        if response.status_code != 200:
+                            errors.append(response.status_code)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        try:
+            threads = [threading.Thread(target=read, args=(client,)) for client in clients]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            writer.rollback()
+            writer.close()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(len(latencies), self.READERS * self.READS_PER_READER * 2)
+        # A read that needed the write lock would block for the full busy timeout
+        self.assertLess(max(latencies), 1.0)
+        self.assertFalse(DailyProgress.objects.exists())
+
+
+class SQLiteTuningTests(TransactionTestCase):
+    def test_connections_get_the_configured_pragmas(self):
+        with connection.cursor() as cursor:
+            for name, expected in (('journal_mode', 'wal'), ('synchronous', 1), ('temp_store', 2)):
+                cursor.execute(f'PRAGMA {name}')
+                self.assertEqual(cursor.fetchone()[0], expected, name)
+
+    def test_settings_override_single_pragmas(self):
+        with self.settings(CALOE_SQLITE_PRAGMAS={'mmap_size': 0}):
+            pragmas = sqlite_pragmas()
+        self.assertEqual(pragmas, {**DEFAULT_PRAGMAS, 'mmap_size': 0})
+
+    @mock.patch('caloe.db.time.sleep')
+    def test_retried_deletes_still_delete(self, sleep):
+        user = make_user()
+        food = FoodItem.objects.create(name='Rice', calories=200)
+        meal = log_meal(user, 'LUNCH', [(food.id, 1), (food.id, 2)])
+        line = meal.food_items.first()
+        water = log_water(user, timezone.localdate(), 250)
+        real_refresh = tracking.refresh_rollups
+
+        def busy_once(*args, **kwargs):
+            # The first attempt fails after its delete, as a busy commit would
+            if not busy_once.raised:
+                busy_once.raised = True
+                raise OperationalError('database is locked')
+            return real_refresh(*args, **kwargs)
+
+        for remove, instance in ((remove_meal_line, line), (remove_meal, meal), (delete_water, water)):
+            busy_once.raised = False
+            instance.refresh_from_db()
+            with mock.patch('caloe.tracking.refresh_rollups', busy_once):
+                remove(instance)
+            self.assertTrue(busy_once.raised)
+            self.assertFalse(type(instance).objects.filter(pk=instance.pk).exists())
+        self.assertEqual(DailyProgress.objects.get(user=user).total_calories_consumed, 0)
+        self.assertEqual(find_drift(), [])
+
+    def test_writes_wait_for_the_lock_instead_of_failing(self):
+        user = make_user()
+        holder = sqlite3.connect(connection.settings_dict['NAME'], check_same_thread=False)
+        holder.execute('BEGIN IMMEDIATE')
+        release = threading.Timer(0.3, holder.rollback)
+        release.start()
+        try:
+            started = time.perf_counter()
+            log_water(user, timezone.localdate(), 250)
+            waited = time.perf_counter() - started
+        finally:
+            release.join()
+            holder.close()
+        self.assertGreaterEqual(waited, 0.25)
+        self.assertEqual(WaterIntake.objects.filter(user=user).count(), 1)
+
+
+class RetryOnBusyTests(SimpleTestCase):
+    def flaky(self, errors):
+        calls = []
+
+        @retry_on_busy
+        def write():
+            calls.append(1)
+            if len(calls) <= errors:
+                raise OperationalError('database is locked')
+            return 'done'
+        return write, calls
+
+    @mock.patch('caloe.db.random.uniform', return_value=1)
+    @mock.patch('caloe.db.time.sleep')
+    def test_busy_writes_are_retried_with_growing_delays(self, sleep, uniform):
+        write, calls = self.flaky(2)
+        self.assertEqual(write(), 'done')
+        self.assertEqual(len(calls), 3)
+        first, second = (call.args[0] for call in sleep.call_args_list)
+        self.assertLess(first, second)
+
+    @mock.patch('caloe.db.time.sleep')
+    def test_retries_give_up(self, sleep):
+        write, calls = self.flaky(10)
+        with self.assertRaises(OperationalError):
+            write()
+        self.assertEqual(len(calls), BUSY_RETRIES + 1)
+
+    def test_other_errors_are_not_retried(self):
+        @retry_on_busy
+        def write():
+            raise OperationalError('no such table: caloe_meal')
+        with self.assertRaises(OperationalError):
+            write()
+
+
+class AnalyticsSeriesTests(TestCase):
+    def setUp(self):
+        self.user = make_user()
+        self.start = date(2024, 1, 1)  # a Monday
+        for offset, calories in ((0, 1800), (1, 2000), (3, 2400), (8, 1000)):
+            DailyProgress.objects.create(
+                user=self.user, date=self.start + timedelta(days=offset),
+                total_calories_consumed=calories, calorie_target=2000,
+            )
+        WaterIntake.objects.create(user=self.user, date=self.start, amount_ml=500)
+        WaterIntake.objects.create(user=self.user, date=self.start, amount_ml=250)
+        WeightLog.objects.create(user=self.user, date=self.start + timedelta(days=3), weight=60.5)
+
+    def load(self, days=14):
+        return analytics.load_daily_series(self.user, self.start, self.start + timedelta(days=days - 1))
+
+    def chart(self, name, group_by='day', points=analytics.DEFAULT_POINTS):
+        return analytics.chart_series(name, *analytics.grouped_columns(
+            self.load(), group_by, analytics.CHART_SERIES[name][1]
+        ), group_by, points)
+
+    def test_days_without_data_are_explicit_gaps(self):
+        calories = self.chart('calories')
+        self.assertEqual(len(calories['labels']), 14)
+        self.assertEqual(calories['datasets']['calories'][:4], [1800, 2000, None, 2400])
+        self.assertEqual(self.chart('water')['datasets']['water'][:2], [750, None])
+        self.assertEqual(self.chart('weight')['datasets']['weight'][3], 60.5)
+
+    def test_grouping_and_trend_skip_gaps(self):
+        calories = self.chart('calories', 'week')
+        self.assertEqual(calories['labels'], ['Week of Jan 01', 'Week of Jan 08'])
+        self.assertEqual(calories['datasets']['calories'], [round((1800 + 2000 + 2400) / 3, 1), 1000])
+        # The trend averages weekly means, not the days behind them
+        self.assertEqual(calories['datasets']['trend'][1], round(((1800 + 2000 + 2400) / 3 + 1000) / 2, 1))
+
+    def test_long_ranges_are_downsampled_to_logged_points(self):
+        calories = self.chart('calories', points=3)
+        self.assertEqual(calories['downsampled_from'], 14)
+        # LTTB keeps the first and last logged days and the largest swing between
+        self.assertEqual(calories['dates'], ['2024-01-01', '2024-01-04', '2024-01-09'])
+        self.assertEqual(calories['datasets']['calories'], [1800, 2400, 1000])
+
+    def test_ranges_with_few_logged_points_keep_their_gaps(self):
+        calories = self.chart('calories', points=5)
+        self.assertIsNone(calories['downsampled_from'])
+        self.assertEqual(calories['points'], 14)
+        self.assertEqual(calories['datasets']['calories'][:4], [1800, 2000, None, 2400])
+        # A range with nothing logged is all gaps, however many points are asked for
+        weight = analytics.chart_series('weight', *analytics.grouped_columns(
+            analytics.load_daily_series(self.user, date(2020, 1, 1), date(2020, 1, 14)), 'day', ['weight']
+        ), 'day', 3)
+        self.assertIsNone(weight['downsampled_from'])
+        self.assertEqual(weight['datasets']['weight'], [None] * 14)
+
+    def test_adherence_and_period_comparison(self):
+        series = self.load()
+        # 1800 and 2000 are within 10% of 2000; 2400 and 1000 are not
+        self.assertEqual(analytics.adherence_percentage(series), 50.0)
+        comparison = analytics.compare_periods(
+            series.between(self.start + timedelta(days=7), self.start + timedelta(days=13)),
+            series.between(self.start, self.start + timedelta(days=6)),
+        )
+        self.assertAlmostEqual(comparison['calories']['change'], 1000 - (1800 + 2000 + 2400) / 3)
+        self.assertIsNone(comparison['weight']['current'])
+
+    def test_analytics_page_renders_every_period(self):
+        self.client.force_login(self.user)
+        for period in ('day', 'week', 'month', 'year'):
+            response = self.client.get(reverse('analytics'), {'period': period})
+            self.assertEqual(response.status_code, 200)
+
+    def test_series_endpoint(self):
+        self.client.force_login(self.user)
+        url = reverse('analytics_series', args=['calories'])
+        response = self.client.get(url, {'start': '2024-01-01', 'end': '2024-01-14', 'points': 3})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('max-age=300', response['Cache-Control'])
+        self.assertEqual(response.json()['points'], 3)
+
+        rebuild_user_rollups(self.user)
+        monthly = self.client.get(url, {'start': '2024-01-01', 'end': '2024-02-29', 'group': 'month'}).json()
+        self.assertEqual(monthly['labels'], ['Jan 2024', 'Feb 2024'])
+        self.assertEqual(monthly['datasets']['calories'], [1800, None])
+
+        self.assertEqual(self.client.get(url, {'start': '2024-01-14', 'end': '2024-01-01'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'points': 'many'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('analytics_series', args=['mood'])).status_code, 404)
+
+    def test_month_groups_are_clipped_to_the_range(self):
+        DailyProgress.objects.create(user=self.user, date=date(2024, 2, 10), total_calories_consumed=1500)
+        DailyProgress.objects.create(user=self.user, date=date(2024, 3, 20), total_calories_consumed=2500)
+        DailyProgress.objects.create(user=self.user, date=date(2024, 3, 25), total_calories_consumed=3000)
+        WeightLog.objects.create(user=self.user, date=date(2024, 3, 1), weight=61)
+        rebuild_user_rollups(self.user)
+
+        def monthly(name, start, end):
+            return analytics.load_chart_series(self.user, name, start, end, 'month')['datasets'][name]
+
+        # Jan 04 and 09 but not Jan 01-02, all of February, Mar 20 but not Mar 25
+        self.assertEqual(monthly('calories', date(2024, 1, 4), date(2024, 3, 20)), [1700, 1500, 2500])
+        self.assertEqual(monthly('calories', date(2024, 1, 4), date(2024, 1, 8)), [2400])
+        self.assertEqual(monthly('calories', date(2024, 1, 5), date(2024, 1, 8)), [None])
+        self.assertEqual(monthly('weight', date(2024, 1, 5), date(2024, 3, 1)), [None, None, 61])
+        # Whole months still match their rollups
+        self.assertEqual(monthly('calories', date(2024, 1, 1), date(2024, 3, 31)), [1800, 1500, 2750])
+
+
+class AnalyticsStatsTests(TestCase):
+    def setUp(self):
+        self.user = make_user()
+        self.start = date(2024, 3, 1)
+        for offset, calories in enumerate((1800, 2200)):
+            DailyProgress.objects.create(
+                user=self.user, date=self.start + timedelta(days=offset),
+                total_calories_consumed=calories, total_protein=100,
+            )
+        for offset, amounts in enumerate(([500, 500, 1000], [1000])):
+            for amount in amounts:
+                WaterIntake.objects.create(user=self.user, date=self.start + timedelta(days=offset), amount_ml=amount)
+        for offset, weight in ((0, 61.0), (5, 60.4), (3, 60.8)):
+            WeightLog.objects.create(user=self.user, date=self.start + timedelta(days=offset), weight=weight)
+
+    def test_stats_take_two_queries(self):
+        with self.assertNumQueries(2):
+            stats = calculate_analytics_stats(self.user, self.start, self.start + timedelta(days=6))
+        self.assertEqual(stats['days_logged'], 2)
+        self.assertAlmostEqual(stats['avg_calories'], 2000)
+        self.assertAlmostEqual(stats['total_calories'], 4000)
+        self.assertAlmostEqual(stats['weight_change'], 60.4 - 61.0)
+        # Water is averaged per day (2000 ml and 1000 ml), not per intake
+        self.assertEqual(stats['water_days'], 2)
+        self.assertAlmostEqual(stats['avg_water'], 1500)
+        self.assertEqual((stats['min_water'], stats['max_water']), (1000, 2000))
+        self.assertAlmostEqual(stats['stddev_water'], 500)
+
+    def test_empty_range(self):
+        stats = calculate_analytics_stats(self.user, date(2020, 1, 1), date(2020, 1, 7))
+        self.assertEqual(stats['avg_calories'], 0)
+        self.assertEqual(stats['avg_water'], 0)
+        self.assertEqual(stats['weight_change'], 0)
+        self.assertEqual(stats['days_count'], 7)
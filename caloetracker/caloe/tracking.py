@@ -0,0 +1,327 @@
+"""
+Write paths for meal, water and weight logging.
+
+Views go through these helpers so every way of logging food costs a fixed
+number of queries and updates DailyProgress atomically in SQL instead of
+with a read-modify-write in Python. Meal adds and deletes, and edits of
+their line items, append their delta to the nutrition ledger in the same
+transaction as the DailyProgress update they fold into (see caloe.ledger).
+Each write also refreshes the affected weekly and monthly rollups and the
+user's food usage scores, bumps their data_version and, once committed,
+pushes the day's totals to the user's open progress streams. The entry
+points retry when SQLite reports the database busy (caloe.db).
+"""
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Case, F, FloatField, Sum, Value, When
+
+from .db import retry_on_busy
+from .events import get_broker, user_channel
+from .models import (
+    DailyProgress, FoodItem, Meal, MealFoodItem, NutritionLedgerEntry, WaterIntake, WeightLog, MAX_ID,
+    claim_change_seqs,
+)
+from .rollups import NUTRITION, WATER, WEIGHT, refresh_rollups
+from .search import visible_food_items
+from .usage import record_usage
+
+NUTRIENTS = ('calories', 'protein', 'carbs', 'fat')
+PROGRESS_NUTRIENTS = {
+    'total_calories_consumed': 'calories',
+    'total_protein': 'protein',
+    'total_carbs': 'carbs',
+    'total_fat': 'fat',
+}
+
+
+def read_daily_progress(user, date):
+    """
+    The user's saved DailyProgress for date, or an unsaved all-zero row.
+
+    Read paths use this instead of get_or_create so a page view never opens a
+    write transaction; the row is created by the first real write of the day.
+    """
+    try:
+        return DailyProgress.objects.get(user=user, date=date)
+    except DailyProgress.DoesNotExist:
+        return DailyProgress(user=user, date=date)
+
+
+def daily_totals(user, date):
+    """The payload of a progress stream event for the user's day"""
+    daily_progress = read_daily_progress(user, date)
+    daily_target = user.get_daily_calorie_target()
+    return {
+        'date': date.isoformat(),
+        'total_consumed': daily_progress.total_calories_consumed,
+        'calories_remaining': daily_progress.calories_remaining(daily_target),
+        'daily_target': daily_target,
+        'progress_percentage': daily_progress.progress_percentage(daily_target),
+        'protein': daily_progress.total_protein,
+        'carbs': daily_progress.total_carbs,
+        'fat': daily_progress.total_fat,
+        'water_ml': WaterIntake.objects.filter(user=user, date=date).aggregate(total=Sum('amount_ml'))['total'] or 0,
+        'weight': WeightLog.objects.filter(user=user, date=date).values_list('weight', flat=True).first(),
+    }
+
+
+def publish_daily_totals(user, date):
+    """
+    Push the user's totals for date to their open progress streams after
+    the current transaction commits. With no stream open this costs nothing,
+    not even the read.
+    """
+    def publish():
+        broker = get_broker()
+        channel = user_channel(user.pk)
+        if broker.has_subscribers(channel):
+            broker.publish(channel, daily_totals(user, date))
+    transaction.on_commit(publish)
+
+
+def log_meal(user, meal_type, items):
+    """
+    Log a meal from (food_id, quantity) pairs.
+
+    All foods are fetched with one in_bulk query. Raises FoodItem.DoesNotExist
+    if any id is unknown or not visible to the user.
+    """
+    items = list(items)
+    # Ids no row can have would overflow the query; they are reported missing
+    foods = visible_food_items(user).in_bulk({food_id for food_id, _ in items if abs(food_id) <= MAX_ID})
+    missing = {food_id for food_id, _ in items if food_id not in foods}
+    if missing:
+        raise FoodItem.DoesNotExist(f"Unknown food ids: {sorted(missing)}")
+    return record_meal(user, meal_type, [(foods[food_id], quantity) for food_id, quantity in items])
+
+
+@retry_on_busy
+def record_meal(user, meal_type, lines):
+    """
+    Save a meal from (FoodItem, quantity) pairs in one transaction: the meal
+    with its totals, one bulk insert for its line items with their nutrient
+    snapshots, its ledger entry, one atomic DailyProgress update and one
+    usage update for all of its foods.
+    """
+    meal, items = prepare_meal(user, meal_type, lines)
+    with transaction.atomic():
+        meal.save()
+        for item in items:
+            item.meal = meal
+        MealFoodItem.objects.bulk_create(items)
+        record_nutrition_change(user, meal.date, 'ADD', meal.pk, **meal_totals(meal))
+        refresh_rollups(user, meal.date, [NUTRITION])
+        record_usage(user, [food_item.id for food_item, _ in lines], meal.created_at)
+        user.bump_data_version()
+        publish_daily_totals(user, meal.date)
+    return meal
+
+
+@retry_on_busy
+def remove_meal(meal):
+    """
+    Delete a meal and take its calories and macros back out of the day it
+    was logged on, with the same ledger entry and DailyProgress update as
+    record_meal() in reverse. The amounts come from the meal's stored
+    totals, so neither the foods nor the line items are read.
+    """
+    user, meal_pk = meal.user, meal.pk
+    with transaction.atomic():
+        food_ids = meal.food_items.exclude(food_item=None).values_list('food_item_id', flat=True)
+        record_usage(user, food_ids, meal.created_at, uses=-1)
+        # Through the queryset: meal.delete() would clear meal.pk, and a
+        # retry after a busy error calls this again with the same instance
+        Meal.objects.filter(pk=meal_pk).delete()
+        record_nutrition_change(user, meal.date, 'DELETE', meal_pk, **{
+            name: -value for name, value in meal_totals(meal).items()
+        })
+        refresh_rollups(user, meal.date, [NUTRITION])
+        user.bump_data_version()
+        publish_daily_totals(user, meal.date)
+
+
+@retry_on_busy
+def save_meal_line(item):
+    """
+    Save a new or edited line item of a logged meal, as the admin does, and
+    carry the difference into the meal's totals, the ledger, DailyProgress,
+    the rollups and food usage. A line whose food changes is captured again
+    from the food; a new quantity scales the line's own snapshot.
+    """
+    with transaction.atomic():
+        old = MealFoodItem.objects.select_related('meal__user').filter(pk=item.pk).first() if item.pk else None
+        if old is None or old.food_item_id != item.food_item_id or not old.quantity:
+            if item.food_item is not None:
+                item.capture_nutrients()
+        elif item.quantity != old.quantity:
+            for name in NUTRIENTS:
+                setattr(item, f'total_{name}', getattr(old, f'total_{name}') * item.quantity / old.quantity)
+        if old is None:
+            # Skips MealFoodItem.save(), which would add to the meal's totals too
+            MealFoodItem.objects.bulk_create([item])
+        else:
+            item.save()
+
+        changes = defaultdict(lambda: dict.fromkeys(NUTRIENTS, 0.0))
+        if old is not None:
+            for name, value in line_totals(old).items():
+                changes[old.meal][name] -= value
+        for name, value in line_totals(item).items():
+            changes[item.meal][name] += value
+        if old is None or (old.meal_id, old.food_item_id) != (item.meal_id, item.food_item_id):
+            if old is not None:
+                update_line_usage(old.meal, old.food_item_id, item.pk, -1)
+            update_line_usage(item.meal, item.food_item_id, item.pk, 1)
+        record_meal_changes(changes)
+    return item
+
+
+@retry_on_busy
+def remove_meal_line(item):
+    """Delete a line item of a logged meal, the reverse of save_meal_line()"""
+    item_pk, meal = item.pk, item.meal
+    with transaction.atomic():
+        # Keeps item.pk for a retry, as in remove_meal()
+        MealFoodItem.objects.filter(pk=item_pk).delete()
+        update_line_usage(meal, item.food_item_id, item_pk, -1)
+        record_meal_changes({meal: {name: -value for name, value in line_totals(item).items()}})
+
+
+def line_totals(item):
+    return {name: getattr(item, f'total_{name}') for name in NUTRIENTS}
+
+
+def update_line_usage(meal, food_id, item_pk, uses):
+    """record_usage() for a food gaining or losing its only line in meal"""
+    if food_id is None or meal.food_items.filter(food_item_id=food_id).exclude(pk=item_pk).exists():
+        return
+    record_usage(meal.user, [food_id], meal.created_at, uses)
+
+
+def record_meal_changes(changes):
+    """
+    Add {meal: nutrient deltas} to each meal's totals, with a new change
+    sequence number for the sync feed, and to its day as an EDIT ledger entry
+    """
+    for meal, totals in changes.items():
+        Meal.objects.filter(pk=meal.pk).update(
+            change_seq=claim_change_seqs(meal.user_id)[0],
+            **{f'total_{name}': F(f'total_{name}') + value for name, value in totals.items()},
+        )
+        record_nutrition_change(meal.user, meal.date, 'EDIT', meal.pk, **totals)
+        refresh_rollups(meal.user, meal.date, [NUTRITION])
+        meal.user.bump_data_version()
+        publish_daily_totals(meal.user, meal.date)
+
+
+def prepare_meal(user, meal_type, lines, **fields):
+    """
+    An unsaved meal and its unsaved line items from (FoodItem, quantity)
+    pairs, with the nutrient snapshots and meal totals filled in
+    """
+    items = []
+    for food_item, quantity in lines:
+        item = MealFoodItem(food_item=food_item, quantity=quantity)
+        item.capture_nutrients(food_item)
+        items.append(item)
+    meal = Meal(user=user, meal_type=meal_type, **fields, **{
+        f'total_{name}': sum(getattr(item, f'total_{name}') for item in items) for name in NUTRIENTS
+    })
+    return meal, items
+
+
+def meal_totals(meal):
+    return {name: getattr(meal, f'total_{name}') for name in NUTRIENTS}
+
+
+def record_nutrition_change(user, date, kind, meal_pk=None, calories=0, protein=0, carbs=0, fat=0):
+    """Append a delta to the nutrition ledger and fold it into the day's totals"""
+    NutritionLedgerEntry.objects.create(
+        user=user, date=date, kind=kind, meal_pk=meal_pk,
+        calories=calories, protein=protein, carbs=carbs, fat=fat,
+    )
+    add_to_daily_progress(user, date, calories=calories, protein=protein, carbs=carbs, fat=fat)
+
+
+def add_to_daily_progress(user, date, calories=0, protein=0, carbs=0, fat=0):
+    """
+    Add to a day's totals with an atomic UPDATE. The first write of a day
+    inserts an empty row holding the user's current targets (ignoring a
+    concurrent insert) and updates it again.
+    """
+    increments = {
+        'total_calories_consumed': F('total_calories_consumed') + calories,
+        'total_protein': F('total_protein') + protein,
+        'total_carbs': F('total_carbs') + carbs,
+        'total_fat': F('total_fat') + fat,
+    }
+    day = DailyProgress.objects.filter(user=user, date=date)
+    if not day.update(**increments):
+        first_write = DailyProgress(user=user, date=date)
+        first_write.capture_targets(user)
+        DailyProgress.objects.bulk_create([first_write], ignore_conflicts=True)
+        day.update(**increments)
+
+
+def add_to_daily_progress_by_date(user, totals_by_date):
+    """
+    add_to_daily_progress() for many days at once, given {date: {nutrient:
+    amount}}: one insert ignoring existing rows and one UPDATE with a CASE
+    per day, however many days there are.
+    """
+    if not totals_by_date:
+        return
+    first_writes = []
+    for date in totals_by_date:
+        first_write = DailyProgress(user=user, date=date)
+        first_write.capture_targets(user)
+        first_writes.append(first_write)
+    DailyProgress.objects.bulk_create(first_writes, ignore_conflicts=True)
+    DailyProgress.objects.filter(user=user, date__in=list(totals_by_date)).update(**{
+        field: F(field) + Case(
+            *(When(date=date, then=Value(totals[name])) for date, totals in totals_by_date.items()),
+            default=Value(0.0),
+            output_field=FloatField(),
+        )
+        for field, name in PROGRESS_NUTRIENTS.items()
+    })
+
+
+@retry_on_busy
+def log_water(user, date, amount_ml):
+    """Record a water intake and refresh that day's rollups"""
+    with transaction.atomic():
+        water_intake = WaterIntake.objects.create(user=user, date=date, amount_ml=amount_ml)
+        refresh_rollups(user, date, [WATER])
+        user.bump_data_version()
+        publish_daily_totals(user, date)
+    return water_intake
+
+
+@retry_on_busy
+def delete_water(water_intake):
+    with transaction.atomic():
+        # Keeps water_intake.pk for a retry, as in remove_meal()
+        WaterIntake.objects.filter(pk=water_intake.pk).delete()
+        refresh_rollups(water_intake.user, water_intake.date, [WATER])
+        water_intake.user.bump_data_version()
+        publish_daily_totals(water_intake.user, water_intake.date)
+
+
+@retry_on_busy
+def log_weight(user, date, weight, notes=''):
+    """
+    Record the user's weight for date, replacing an existing entry for that
+    day. Returns (weight_log, created).
+    """
+    with transaction.atomic():
+        weight_log, created = WeightLog.objects.update_or_create(
+            user=user,
+            date=date,
+            defaults={'weight': weight, 'notes': notes},
+        )
+        refresh_rollups(user, date, [WEIGHT])
+        user.bump_data_version()
+        publish_daily_totals(user, date)
+    return weight_log, created
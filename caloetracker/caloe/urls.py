@@ -9,8 +9,11 @@ urlpatterns = [
     path('profile/', views.profile_view, name='profile'),
     path('food-search/', views.food_search, name='food_search'),
     path('add-meal/', views.add_meal, name='add_meal'),
+    path('sync/', views.sync_entries, name='sync_entries'),
+    path('sync/changes/', views.sync_changes, name='sync_changes'),
     path('delete-meal/<int:meal_id>/', views.delete_meal, name='delete_meal'),
     path('daily-progress/', views.get_daily_progress, name='daily_progress'),
+    path('progress-stream/', views.progress_stream, name='progress_stream'),
     path('add-food-item/', views.add_food_item, name='add_food_item'),
     path('my-food-items/', views.my_food_items, name='my_food_items'),
     path('delete-food-item/<int:food_id>/', views.delete_food_item, name='delete_food_item'),
@@ -22,4 +25,7 @@ urlpatterns = [
     path('quick-add/<int:food_id>/', views.quick_add_food, name='quick_add_food'),
     path('quick-add-foods/', views.get_quick_add_foods, name='get_quick_add_foods'),
     path('analytics/', views.analytics, name='analytics'),
+    path('analytics/series/<str:series>/', views.analytics_series, name='analytics_series'),
+    path('cache-metrics/', views.cache_metrics, name='cache_metrics'),
+    path('metrics/', views.metrics, name='metrics'),
 ]
\ No newline at end of file
@@ -0,0 +1,118 @@
+"""
+Recency-weighted food usage behind quick-add.
+
+Scores use forward decay: a use at time t adds 2 ** ((t - EPOCH) / HALF_LIFE)
+instead of 1 and nothing is ever decayed in place. Every score shares the
+same growing scale, so ordering by the stored score is the same as ordering
+by exponentially decayed use counts, and a new use is a single increment.
+decayed_score() converts a stored score back to "uses, halving every
+HALF_LIFE_DAYS" for display.
+
+The scale doubles every half-life, so it runs out of float range: with a
+30-day half-life a weight passes 2 ** 1024 (OverflowError) about 84 years
+after EPOCH, early in 2108, and a score summing many weights a few
+half-lives sooner. EPOCH has to move forward well before then. Moving it by
+n half-lives and multiplying every stored score by 2 ** -n keeps both the
+order and the decayed values.
+"""
+from collections import defaultdict
+from datetime import datetime, timezone as dt_timezone
+
+from django.db.models import Case, DateTimeField, F, FloatField, PositiveIntegerField, Value, When
+from django.utils import timezone
+
+from .models import FoodUsage, MealFoodItem
+
+HALF_LIFE_DAYS = 30
+EPOCH = datetime(2024, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def usage_weight(moment):
+    """What one use at moment adds to a score"""
+    return 2 ** ((moment - EPOCH).total_seconds() / 86400 / HALF_LIFE_DAYS)
+
+
+def decayed_score(score, now=None):
+    """A stored score as of now, in decayed uses"""
+    return score / usage_weight(now or timezone.now())
+
+
+def record_usage(user, food_ids, moment, uses=1):
+    """
+    Add (or, with uses=-1, take back) one use of each food at moment, with
+    an insert that ignores existing rows and one UPDATE for all of them.
+    """
+    food_ids = set(food_ids)
+    if not food_ids:
+        return
+    if uses > 0:
+        FoodUsage.objects.bulk_create(
+            [FoodUsage(user=user, food_item_id=food_id) for food_id in food_ids],
+            ignore_conflicts=True,
+        )
+    changes = {
+        'score': F('score') + uses * usage_weight(moment),
+        'use_count': F('use_count') + uses,
+    }
+    if uses > 0:
+        changes['last_used'] = moment
+    FoodUsage.objects.filter(user=user, food_item_id__in=food_ids).update(**changes)
+
+
+def record_meal_usages(user, meals):
+    """
+    record_usage() for many meals at once, given as (food_ids, moment) pairs:
+    one insert and one UPDATE with a CASE per food, however many meals.
+    """
+    scores, counts, last_used = defaultdict(float), defaultdict(int), {}
+    for food_ids, moment in meals:
+        for food_id in set(food_ids):
+            scores[food_id] += usage_weight(moment)
+            counts[food_id] += 1
+            last_used[food_id] = max(moment, last_used.get(food_id, moment))
+    if not scores:
+        return
+    FoodUsage.objects.bulk_create(
+        [FoodUsage(user=user, food_item_id=food_id) for food_id in scores],
+        ignore_conflicts=True,
+    )
+
+    def per_food(values, output_field):
+        return Case(
+            *(When(food_item_id=food_id, then=Value(value)) for food_id, value in values.items()),
+            output_field=output_field,
+        )
+    FoodUsage.objects.filter(user=user, food_item_id__in=scores).update(
+        score=F('score') + per_food(scores, FloatField()),
+        use_count=F('use_count') + per_food(counts, PositiveIntegerField()),
+        # Not Greatest(): on SQLite it is NULL while last_used is still NULL
+        last_used=Case(
+            When(last_used__gt=per_food(last_used, DateTimeField()), then=F('last_used')),
+            default=per_food(last_used, DateTimeField()),
+        ),
+    )
+
+
+def top_foods(user, limit):
+    """The user's most used foods, best first, from the (user, score) index"""
+    usages = FoodUsage.objects.filter(user=user, use_count__gt=0).select_related('food_item').order_by('-score')
+    return [usage.food_item for usage in usages[:limit]]
+
+
+def rebuild_food_usage(user):
+    """Recompute a user's usage rows from their meal history"""
+    FoodUsage.objects.filter(user=user).delete()
+    usages = defaultdict(lambda: FoodUsage(user=user, score=0, use_count=0))
+    # One use per meal a food appears in, as record_usage() counts them
+    lines = MealFoodItem.objects.filter(meal__user=user, food_item__isnull=False).values_list(
+        'food_item_id', 'meal_id', 'meal__created_at'
+    ).distinct().order_by()
+    for food_id, _, created_at in lines.iterator():
+        usage = usages[food_id]
+        usage.food_item_id = food_id
+        usage.score += usage_weight(created_at)
+        usage.use_count += 1
+        if usage.last_used is None or created_at > usage.last_used:
+            usage.last_used = created_at
+    FoodUsage.objects.bulk_create(usages.values(), batch_size=1000)
+    return len(usages)
@@ -1,15 +1,45 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth import login, logout, authenticate
-from django.contrib.auth.decorators import login_required
+from django.contrib.auth.decorators import login_required, user_passes_test
 from django.contrib import messages
-from django.http import JsonResponse
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils.cache import patch_cache_control
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
 from django.utils import timezone
 from django.db import models
-from django.db.models import Sum, Avg
-from datetime import timedelta
-from .models import CustomUser, FoodItem, Meal, MealFoodItem, DailyProgress, WeightLog, ProgressPhoto, WaterIntake, WaterGoal
+from django.db.models import Sum, Avg, Count, Min, Max, StdDev, F, OuterRef, Subquery, Window
+from django.db.models.expressions import RowRange
+from django.db.models.functions import FirstValue, JSONObject, LastValue
+from datetime import date, timedelta
+from .models import CustomUser, FoodItem, Meal, MealFoodItem, DailyProgress, WeightLog, ProgressPhoto, WaterIntake, WaterGoal, MAX_ID, catalog_version
+from .search import RESULT_FIELDS, search_page, visible_food_items
+from .rollups import NUTRITION
+from .usage import top_foods
+from .cache import cached, cache_stats
+from .metrics import render_metrics
+from .recommendations import MEAL_TYPE_INDEX, recommend_foods
+from .analytics import CHART_SERIES, DEFAULT_POINTS, GROUPINGS, adherence_percentage, compare_periods, load_chart_series, load_daily_series, previous_period
+from .sync import SyncError, import_entries
+from .changes import MAX_PAGE_SIZE, PAGE_SIZE, changes_since, decode_cursor, encode_cursor
+from .tracking import daily_totals, delete_water, log_meal, log_water, log_weight, read_daily_progress, record_meal, remove_meal
+from .events import event_stream, get_broker, user_channel
 from .forms import CustomUserCreationForm, CustomAuthenticationForm, UserProfileForm, FoodSearchForm, MealForm, FoodItemForm, WeightLogForm, ProgressPhotoForm, WaterIntakeForm, WaterGoalForm
+from asgiref.sync import sync_to_async
+import hashlib
 import json
+import math
+
+FOOD_SEARCH_DEFAULT_LIMIT = 20
+FOOD_SEARCH_MAX_LIMIT = 100
+FOOD_CATALOG_PAGE_SIZE = 100
+CATALOG_FIELDS = ('name', 'calories', 'protein', 'carbs', 'fat', 'serving_size')
+ANALYTICS_SERIES_MAX_POINTS = 2000
+ANALYTICS_SERIES_MAX_DAYS = 20 * 366
+# Already picked foods a quick-add request may name; the rest are ignored
+QUICK_ADD_MAX_WITH = 20
 
 def register_view(request):
     if request.method == 'POST':
@@ -47,25 +77,55 @@ def logout_view(request):
 def dashboard(request):
     today = timezone.now().date()
     
-    # Get or create daily progress
-    daily_progress, created = DailyProgress.objects.get_or_create(
-        user=request.user,
-        date=today,
-        defaults={'total_calories_consumed': 0}
-    )
+    # Cached until the user's next write, see caloe.cache
+    summary = cached(request.user, 'dashboard', (today,), lambda: dashboard_summary(request.user, today))
+    daily_progress = DailyProgress(user=request.user, date=today, **summary['totals'])
     
-    # Get today's meals
-    today_meals = Meal.objects.filter(user=request.user, date=today).order_by('-created_at')
+    # Compute the target once instead of once per template lookup
+    daily_target = request.user.get_daily_calorie_target()
     
     context = {
         'user': request.user,
         'daily_progress': daily_progress,
-        'today_meals': today_meals,
-        'maintenance_calories': request.user.calculate_maintenance_calories(),
-        'daily_target': request.user.get_daily_calorie_target(),
+        'today_meals': summary['meals'],
+        'maintenance_calories': request.user.maintenance_calories,
+        'daily_target': daily_target,
+        'calories_remaining': daily_progress.calories_remaining(daily_target),
+        'progress_percentage': daily_progress.progress_percentage(daily_target),
     }
     return render(request, 'dashboard.html', context)
 
+DASHBOARD_TOTALS = ('total_calories_consumed', 'total_protein', 'total_carbs', 'total_fat')
+DASHBOARD_LINE_FIELDS = ('meal_id', 'food_name', 'quantity', 'total_calories')
+
+def dashboard_summary(user, day):
+    """
+    The day's totals and meals as plain values, so the cached entry holds no
+    model instances: nothing of the user's row, and nothing a schema change
+    can break
+    """
+    # Read-only: an unsaved zero row stands in until the first meal is logged
+    daily_progress = read_daily_progress(user, day)
+    
+    # The day's meals and their line items in two queries; both carry
+    # stored totals, so no food is joined
+    meal_types = dict(Meal.MEAL_TYPES)
+    meals = [
+        {**meal, 'meal_type_display': meal_types.get(meal['meal_type'], meal['meal_type']), 'food_items': []}
+        for meal in Meal.objects.filter(user=user, date=day).order_by('-created_at').values(
+            'id', 'meal_type', 'created_at', 'total_calories'
+        )
+    ]
+    by_id = {meal['id']: meal for meal in meals}
+    if by_id:
+        lines = MealFoodItem.objects.filter(meal_id__in=list(by_id)).order_by('pk').values(*DASHBOARD_LINE_FIELDS)
+        for line in lines:
+            by_id[line['meal_id']]['food_items'].append(line)
+    return {
+        'totals': {field: getattr(daily_progress, field) for field in DASHBOARD_TOTALS},
+        'meals': meals,
+    }
+
 @login_required
 def profile_view(request):
     if request.method == 'POST':
@@ -79,88 +139,103 @@ def profile_view(request):
     
     context = {
         'form': form,
-        'maintenance_calories': request.user.calculate_maintenance_calories(),
+        'maintenance_calories': request.user.maintenance_calories,
         'daily_target': request.user.get_daily_calorie_target(),
     }
     return render(request, 'profile.html', context)
 
 @login_required
 def food_search(request):
-    # Show both system foods and user's custom foods
-    food_items = FoodItem.objects.filter(
-        models.Q(created_by__isnull=True) |  # System foods
-        models.Q(created_by=request.user)    # User's custom foods
-    )
-    
     form = FoodSearchForm(request.GET or None)
     
-    if form.is_valid() and form.cleaned_data['search_query']:
-        query = form.cleaned_data['search_query']
-        food_items = food_items.filter(name__icontains=query)
-    
     if request.headers.get('x-requested-with') == 'XMLHttpRequest':
-        food_data = [{
-            'id': food.id,
-            'name': food.name,
-            'calories': food.calories,
-            'protein': food.protein,
-            'carbs': food.carbs,
-            'fat': food.fat,
-            'serving_size': food.serving_size,
-            'is_custom': food.is_custom
-        } for food in food_items]
-        return JsonResponse(food_data, safe=False)
-    
-    return render(request, 'food_search.html', {'form': form, 'food_items': food_items})
+        return food_search_json(request, form)
+    
+    # First page of system foods and the user's custom foods, all of them
+    # without a query. Only the page is cached, as plain values, so neither
+    # the catalog size nor free-text queries can grow an entry.
+    query = form.cleaned_data['search_query'] if form.is_valid() else ''
+    food_items, next_cursor = cached(
+        request.user, 'food_search', (request_catalog_version(request), query, FOOD_CATALOG_PAGE_SIZE),
+        lambda: search_page(request.user, query, FOOD_CATALOG_PAGE_SIZE, fields=CATALOG_FIELDS)
+    )
+    
+    return render(request, 'food_search.html', {'form': form, 'food_items': food_items, 'has_more': next_cursor is not None})
+
+def user_data_etag(request, *args, **kwargs):
+    """
+    Strong ETag for per-user JSON endpoints. It changes only when the user's
+    data_version does (or the day rolls over), so a matching If-None-Match
+    is answered with a 304 before any of the view's queries run. The query
+    string is part of it so every search or page gets its own tag.
+    """
+    params = hashlib.sha1(request.GET.urlencode().encode()).hexdigest()[:12]
+    return f'{request.user.pk}-{request.user.data_version}-{timezone.now().date():%Y%m%d}-{params}'
+
+def request_catalog_version(request):
+    """The system catalog version, read at most once per request"""
+    if not hasattr(request, '_catalog_version'):
+        request._catalog_version = catalog_version()
+    return request._catalog_version
+
+def catalog_etag(request, *args, **kwargs):
+    """user_data_etag() for responses that also list system foods"""
+    return f'{user_data_etag(request)}-{request_catalog_version(request)}'
+
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=catalog_etag)
+def food_search_json(request, form):
+    """Bounded page of search results for the XHR type-ahead"""
+    query = form.cleaned_data['search_query'] if form.is_valid() else ''
+    
+    try:
+        limit = min(max(int(request.GET.get('limit', FOOD_SEARCH_DEFAULT_LIMIT)), 1), FOOD_SEARCH_MAX_LIMIT)
+    except ValueError:
+        return JsonResponse({'error': 'limit must be an integer'}, status=400)
+    
+    fields = RESULT_FIELDS
+    if 'fields' in request.GET:
+        fields = tuple(dict.fromkeys(f.strip() for f in request.GET['fields'].split(',') if f.strip()))
+        if not fields:
+            return JsonResponse({'error': f'fields must name at least one of {", ".join(RESULT_FIELDS)}'}, status=400)
+        unknown = [f for f in fields if f not in RESULT_FIELDS]
+        if unknown:
+            return JsonResponse({'error': f'Unknown fields: {", ".join(unknown)}'}, status=400)
+    
+    cursor = request.GET.get('cursor')
+    try:
+        results, next_cursor = cached(
+            request.user, 'food_search_page', (request_catalog_version(request), query, limit, cursor, fields),
+            lambda: search_page(request.user, query, limit, cursor, fields)
+        )
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    
+    return JsonResponse({
+        'results': results,
+        'has_more': next_cursor is not None,
+        'next_cursor': next_cursor,
+    })
 
 @login_required
 def add_meal(request):
     if request.method == 'POST':
-        data = json.loads(request.body)
-        meal_type = data.get('meal_type')
-        food_items = data.get('food_items', [])
-        
-        # Create meal
-        meal = Meal.objects.create(user=request.user, meal_type=meal_type)
-        
-        # Add food items to meal and calculate totals
-        total_calories = 0
-        total_protein = 0
-        total_carbs = 0
-        total_fat = 0
-        
-        for item in food_items:
-            food_item = FoodItem.objects.get(id=item['food_id'])
-            quantity = item.get('quantity', 1)
-            MealFoodItem.objects.create(
-                meal=meal,
-                food_item=food_item,
-                quantity=quantity
-            )
-            total_calories += food_item.calories * quantity
-            total_protein += food_item.protein * quantity
-            total_carbs += food_item.carbs * quantity
-            total_fat += food_item.fat * quantity
+        try:
+            data = json.loads(request.body)
+            meal_type = data.get('meal_type')
+            items = [(int(item['food_id']), float(item.get('quantity', 1))) for item in data.get('food_items', [])]
+        except (ValueError, TypeError, KeyError, AttributeError):
+            return JsonResponse({'success': False, 'error': 'Invalid meal data'}, status=400)
         
-        # Update daily progress with macros
-        today = timezone.now().date()
-        daily_progress, created = DailyProgress.objects.get_or_create(
-            user=request.user,
-            date=today,
-            defaults={
-                'total_calories_consumed': total_calories,
-                'total_protein': total_protein,
-                'total_carbs': total_carbs,
-                'total_fat': total_fat
-            }
-        )
+        if meal_type not in dict(Meal.MEAL_TYPES) or not items or any(not math.isfinite(quantity) or quantity <= 0 for _, quantity in items):
+            return JsonResponse({'success': False, 'error': 'Invalid meal data'}, status=400)
         
-        if not created:
-            daily_progress.total_calories_consumed += total_calories
-            daily_progress.total_protein += total_protein
-            daily_progress.total_carbs += total_carbs
-            daily_progress.total_fat += total_fat
-            daily_progress.save()
+        # One query for the foods, then one transaction for the meal, its
+        # line items and the daily totals
+        try:
+            meal = log_meal(request.user, meal_type, items)
+        except FoodItem.DoesNotExist:
+            return JsonResponse({'success': False, 'error': 'Unknown food item'}, status=400)
         
         return JsonResponse({'success': True, 'meal_id': meal.id})
     
@@ -168,39 +243,93 @@ def add_meal(request):
     return render(request, 'add_meal.html', {'form': form})
 
 @login_required
+def sync_entries(request):
+    """
+    Offline sync: meals, water and weigh-ins across any past days, validated
+    as a whole and written in one transaction (see caloe.sync)
+    """
+    if request.method != 'POST':
+        return JsonResponse({'success': False, 'error': 'POST required'}, status=405)
+    try:
+        payload = json.loads(request.body)
+    except ValueError:
+        return JsonResponse({'success': False, 'error': 'Invalid JSON'}, status=400)
+    
+    try:
+        result = import_entries(request.user, payload)
+    except SyncError as exc:
+        return JsonResponse({'success': False, 'errors': exc.errors}, status=400)
+    
+    return JsonResponse({'success': True, **result})
+
+@login_required
+def sync_changes(request):
+    """
+    Delta sync feed: records created, updated or deleted since the cursor
+    of the previous page (see caloe.changes). Keep paging while has_more.
+    """
+    try:
+        seq = decode_cursor(request.user, request.GET.get('cursor'))
+        limit = min(max(int(request.GET.get('limit', PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+    except ValueError:
+        return JsonResponse({'success': False, 'error': 'Invalid cursor or limit'}, status=400)
+    
+    feed = changes_since(request.user, seq, limit)
+    return JsonResponse({
+        'cursor': encode_cursor(request.user, feed['seq']),
+        'has_more': feed['has_more'],
+        'changes': feed['changes'],
+        'deleted': feed['deleted'],
+    })
+
+@login_required
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=user_data_etag)
 def get_daily_progress(request):
     today = timezone.now().date()
-    daily_progress, created = DailyProgress.objects.get_or_create(
-        user=request.user,
-        date=today,
-        defaults={'total_calories_consumed': 0}
-    )
+    daily_progress = read_daily_progress(request.user, today)
+    daily_target = request.user.get_daily_calorie_target()
     
     data = {
         'total_consumed': daily_progress.total_calories_consumed,
-        'calories_remaining': daily_progress.calories_remaining(),
-        'daily_target': request.user.get_daily_calorie_target(),
-        'progress_percentage': daily_progress.progress_percentage(),
+        'calories_remaining': daily_progress.calories_remaining(daily_target),
+        'daily_target': daily_target,
+        'progress_percentage': daily_progress.progress_percentage(daily_target),
     }
     
     return JsonResponse(data)
 
+@login_required
+async def progress_stream(request):
+    """
+    Server-Sent Events stream of the user's daily totals, pushed whenever
+    their meals, water or weight change. Served only under ASGI, where an
+    idle stream is a parked coroutine. A WSGI server would drain the endless
+    generator into a list before sending a byte, holding a thread forever,
+    so there the answer is 204, which tells EventSource not to reconnect;
+    the pages then refetch daily_progress after their own writes.
+    """
+    if not isinstance(request, ASGIRequest):
+        return HttpResponse(status=204)
+    user = await request.auser()
+    # Subscribe before reading so no update can fall in between
+    subscription = get_broker().subscribe(user_channel(user.pk))
+    try:
+        initial = await sync_to_async(daily_totals)(user, timezone.now().date())
+    except BaseException:
+        subscription.close()
+        raise
+    response = StreamingHttpResponse(event_stream(subscription, initial), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Stop nginx from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
 @login_required
 def delete_meal(request, meal_id):
     if request.method == 'DELETE':
         meal = get_object_or_404(Meal, id=meal_id, user=request.user)
-        
-        # Calculate total calories to subtract
-        total_calories = sum(item.total_calories for item in meal.food_items.all())
-        
-        # Update daily progress
-        today = timezone.now().date()
-        daily_progress = get_object_or_404(DailyProgress, user=request.user, date=today)
-        daily_progress.total_calories_consumed = max(0, daily_progress.total_calories_consumed - total_calories)
-        daily_progress.save()
-        
-        # Delete meal
-        meal.delete()
+        remove_meal(meal)
         
         return JsonResponse({'success': True})
 
@@ -244,19 +373,17 @@ def weight_log(request):
     if request.method == 'POST':
         form = WeightLogForm(request.POST)
         if form.is_valid():
-            weight_log = form.save(commit=False)
-            weight_log.user = request.user
-            
-            # Check if entry already exists for this date
-            existing_log = WeightLog.objects.filter(user=request.user, date=weight_log.date).first()
-            if existing_log:
-                existing_log.weight = weight_log.weight
-                existing_log.notes = weight_log.notes
-                existing_log.save()
-                messages.success(request, f'Weight updated for {weight_log.date}')
-            else:
-                weight_log.save()
+            # Replaces an existing entry for the same date
+            weight_log, created = log_weight(
+                request.user,
+                form.cleaned_data['date'],
+                form.cleaned_data['weight'],
+                form.cleaned_data['notes'],
+            )
+            if created:
                 messages.success(request, f'Weight logged for {weight_log.date}')
+            else:
+                messages.success(request, f'Weight updated for {weight_log.date}')
             
             return redirect('weight_log')
     else:
@@ -326,10 +453,7 @@ def water_tracker(request):
         if 'add_water' in request.POST:
             water_form = WaterIntakeForm(request.POST)
             if water_form.is_valid():
-                water_intake = water_form.save(commit=False)
-                water_intake.user = request.user
-                water_intake.date = today
-                water_intake.save()
+                water_intake = log_water(request.user, today, water_form.cleaned_data['amount_ml'])
                 messages.success(request, f'Added {water_intake.amount_ml}ml water intake!')
                 return redirect('water_tracker')
         
@@ -357,7 +481,7 @@ def water_tracker(request):
 def delete_water_intake(request, intake_id):
     water_intake = get_object_or_404(WaterIntake, id=intake_id, user=request.user)
     if request.method == 'POST':
-        water_intake.delete()
+        delete_water(water_intake)
         messages.success(request, 'Water intake deleted successfully!')
         return redirect('water_tracker')
     return redirect('water_tracker')
@@ -366,56 +490,67 @@ def delete_water_intake(request, intake_id):
 @login_required
 def quick_add_food(request, food_id):
     """Quick add a common food to today's meals"""
-    food_item = get_object_or_404(FoodItem, id=food_id)
+    food_item = get_object_or_404(visible_food_items(request.user), id=food_id)
     
     if request.method == 'POST':
         # Create a quick snack meal
-        meal = Meal.objects.create(user=request.user, meal_type='SNACK')
-        MealFoodItem.objects.create(meal=meal, food_item=food_item, quantity=1)
-        
-        # Update daily progress
-        today = timezone.now().date()
-        daily_progress, created = DailyProgress.objects.get_or_create(
-            user=request.user,
-            date=today,
-            defaults={
-                'total_calories_consumed': food_item.calories,
-                'total_protein': food_item.protein,
-                'total_carbs': food_item.carbs,
-                'total_fat': food_item.fat
-            }
-        )
-        
-        if not created:
-            daily_progress.total_calories_consumed += food_item.calories
-            daily_progress.total_protein += food_item.protein
-            daily_progress.total_carbs += food_item.carbs
-            daily_progress.total_fat += food_item.fat
-            daily_progress.save()
+        record_meal(request.user, 'SNACK', [(food_item, 1)])
         
         messages.success(request, f'Added {food_item.name} to your daily log!')
         return redirect('dashboard')
     
     return redirect('dashboard')
 
+def quick_add_context(request):
+    """Meal type, hour and already picked food ids a quick-add request asks about"""
+    meal_type = request.GET.get('meal_type', '').upper()
+    if meal_type not in MEAL_TYPE_INDEX:
+        meal_type = ''
+    try:
+        hour = int(request.GET['hour'])
+    except (KeyError, ValueError):
+        hour = None
+    if hour is None or not 0 <= hour < 24:
+        hour = timezone.localtime().hour
+    with_food_ids = []
+    for food_id in request.GET.getlist('with')[:QUICK_ADD_MAX_WITH]:
+        # isdecimal(), unlike isdigit(), rejects digits int() cannot parse, like '²'
+        if food_id.isdecimal() and 0 < int(food_id) <= MAX_ID:
+            with_food_ids.append(int(food_id))
+    return meal_type, hour, with_food_ids
+
+def quick_add_etag(request, *args, **kwargs):
+    # Without an explicit hour the answer changes as the clock does
+    return f'{catalog_etag(request)}-{quick_add_context(request)[1]}'
+
 @login_required
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=quick_add_etag)
 def get_quick_add_foods(request):
-    """Get commonly logged foods for quick add"""
-    # Get user's most frequently logged foods
-    common_foods = FoodItem.objects.filter(
-        mealfooditem__meal__user=request.user
-    ).annotate(
-        log_count=models.Count('mealfooditem')
-    ).order_by('-log_count')[:6]
+    """Get foods to quick add for a meal type and hour of day"""
+    meal_type, hour, with_food_ids = quick_add_context(request)
+    food_data = cached(
+        request.user, 'quick_add', (request_catalog_version(request), meal_type, hour, tuple(with_food_ids)),
+        lambda: quick_add_foods(request.user, meal_type, hour, with_food_ids)
+    )
+    return JsonResponse(food_data, safe=False)
+
+def quick_add_foods(user, meal_type, hour, with_food_ids):
+    # Precomputed recommendations for the context, then the user's most used
+    # foods for users the batch job has not seen yet
+    common_foods = recommend_foods(user, meal_type, hour, with_food_ids, 6)
+    if len(common_foods) < 6:
+        seen = {f.id for f in common_foods} | set(with_food_ids)
+        common_foods += [f for f in top_foods(user, 6 + len(seen)) if f.id not in seen][:6-len(common_foods)]
     
     # If not enough, get system common foods
     if len(common_foods) < 6:
         system_foods = FoodItem.objects.filter(created_by__isnull=True).exclude(
-            id__in=[f.id for f in common_foods]
+            id__in=[f.id for f in common_foods] + with_food_ids
         )[:6-len(common_foods)]
         common_foods = list(common_foods) + list(system_foods)
     
-    food_data = [{
+    return [{
         'id': food.id,
         'name': food.name,
         'calories': food.calories,
@@ -424,8 +559,6 @@ def get_quick_add_foods(request):
         'fat': food.fat,
         'serving_size': food.serving_size
     } for food in common_foods]
-    
-    return JsonResponse(food_data, safe=False)
 
 @login_required
 def analytics(request):
@@ -437,7 +570,7 @@ def analytics(request):
     
     if period == 'day':
         start_date = end_date
-        group_by = 'hour'
+        group_by = 'day'
     elif period == 'week':
         start_date = end_date - timedelta(days=7)
         group_by = 'day'
@@ -451,148 +584,145 @@ def analytics(request):
         start_date = end_date - timedelta(days=7)
         group_by = 'day'
     
-    # Get calorie data
-    calorie_data = DailyProgress.objects.filter(
-        user=request.user,
-        date__range=[start_date, end_date]
-    ).order_by('date')
-    
-    # Get water data
-    water_data = WaterIntake.objects.filter(
-        user=request.user,
-        date__range=[start_date, end_date]
-    ).values('date').annotate(total_water=Sum('amount_ml')).order_by('date')
-    
-    # Get weight data
-    weight_data = WeightLog.objects.filter(
-        user=request.user,
-        date__range=[start_date, end_date]
-    ).order_by('date')
-    
-    # Prepare data for charts
-    calorie_chart_data = prepare_calorie_chart_data(calorie_data, period, group_by)
-    water_chart_data = prepare_water_chart_data(water_data, period, group_by)
-    weight_chart_data = prepare_weight_chart_data(weight_data, period, group_by)
+    # Charts load their series from analytics_series, so the page only needs
+    # the stats plus, for daily periods, adherence and the period comparison.
+    # Each is cached until the user's next write and computed once however
+    # many requests ask for it at the same time.
+    adherence = None
+    comparison = None
+    if group_by == 'day':
+        adherence, comparison = cached(
+            request.user, 'analytics_comparison', (start_date, end_date),
+            lambda: analytics_comparison(request.user, start_date, end_date)
+        )
     
     # Calculate statistics
-    stats = calculate_analytics_stats(request.user, start_date, end_date)
+    stats = cached(request.user, 'analytics_stats', (start_date, end_date), lambda: calculate_analytics_stats(request.user, start_date, end_date))
     
     context = {
         'period': period,
-        'calorie_chart_data': calorie_chart_data,
-        'water_chart_data': water_chart_data,
-        'weight_chart_data': weight_chart_data,
+        'group_by': group_by,
         'stats': stats,
+        'adherence': adherence,
+        'comparison': comparison,
         'start_date': start_date,
         'end_date': end_date,
     }
     return render(request, 'analytics.html', context)
 
-# Helper functions for data preparation
-def prepare_calorie_chart_data(calorie_data, period, group_by):
-    labels = []
-    consumed_data = []
-    target_data = []
-    
-    for progress in calorie_data:
-        if group_by == 'day':
-            labels.append(progress.date.strftime('%b %d'))
-        elif group_by == 'month':
-            month_label = progress.date.strftime('%b %Y')
-            if month_label not in labels:
-                labels.append(month_label)
-        elif group_by == 'hour':
-            labels.append(progress.date.strftime('%H:%M'))
-        
-        consumed_data.append(progress.total_calories_consumed)
-        target_data.append(progress.user.get_daily_calorie_target())
-    
-    return {
-        'labels': labels,
-        'consumed': consumed_data,
-        'target': target_data
-    }
-
-def prepare_water_chart_data(water_data, period, group_by):
-    labels = []
-    water_amounts = []
-    
-    for data in water_data:
-        if group_by == 'day':
-            labels.append(data['date'].strftime('%b %d'))
-        elif group_by == 'month':
-            month_label = data['date'].strftime('%b %Y')
-            if month_label not in labels:
-                labels.append(month_label)
-        
-        water_amounts.append(data['total_water'])
-    
-    return {
-        'labels': labels,
-        'amounts': water_amounts
-    }
+def analytics_comparison(user, start_date, end_date):
+    """Adherence over the range and its comparison with the period before"""
+    # Load the previous period in the same queries for the comparison
+    previous_start, previous_end = previous_period(start_date, end_date)
+    series = load_daily_series(user, previous_start, end_date, [NUTRITION])
+    current = series.between(start_date, end_date)
+    return adherence_percentage(current), compare_periods(current, series.between(previous_start, previous_end))
 
-def prepare_weight_chart_data(weight_data, period, group_by):
-    labels = []
-    weights = []
-    
-    for weight_log in weight_data:
-        if group_by == 'day':
-            labels.append(weight_log.date.strftime('%b %d'))
-        elif group_by == 'month':
-            month_label = weight_log.date.strftime('%b %Y')
-            if month_label not in labels:
-                labels.append(month_label)
-        
-        weights.append(weight_log.weight)
+@login_required
+def analytics_series(request, series):
+    """One chart series for an arbitrary date range as JSON, downsampled server-side"""
+    if series not in CHART_SERIES:
+        return JsonResponse({'error': f'Unknown series {series!r}'}, status=404)
     
-    return {
-        'labels': labels,
-        'weights': weights
-    }
+    today = timezone.now().date()
+    try:
+        end_date = date.fromisoformat(request.GET['end']) if request.GET.get('end') else today
+        start_date = date.fromisoformat(request.GET['start']) if request.GET.get('start') else end_date - timedelta(days=30)
+        points = int(request.GET.get('points', DEFAULT_POINTS))
+    except ValueError:
+        return JsonResponse({'error': 'start and end must be YYYY-MM-DD dates and points an integer'}, status=400)
+    group_by = request.GET.get('group', 'day')
+    if group_by not in GROUPINGS:
+        return JsonResponse({'error': f'group must be one of {", ".join(GROUPINGS)}'}, status=400)
+    if not start_date <= end_date or (end_date - start_date).days > ANALYTICS_SERIES_MAX_DAYS:
+        return JsonResponse({'error': f'start must be on or before end, at most {ANALYTICS_SERIES_MAX_DAYS} days apart'}, status=400)
+    if not 3 <= points <= ANALYTICS_SERIES_MAX_POINTS:
+        return JsonResponse({'error': f'points must be between 3 and {ANALYTICS_SERIES_MAX_POINTS}'}, status=400)
+    
+    data = cached(
+        request.user, 'analytics_series', (series, start_date, end_date, group_by, points),
+        lambda: load_chart_series(request.user, series, start_date, end_date, group_by, points)
+    )
+    response = JsonResponse(data)
+    # Past days rarely change; ranges including today change with every log
+    patch_cache_control(response, private=True, max_age=300 if end_date < today else 30)
+    return response
 
 def calculate_analytics_stats(user, start_date, end_date):
-    # Calorie stats
-    calorie_stats = DailyProgress.objects.filter(
-        user=user,
+    """
+    Range statistics in two queries: nutrition and weight as subqueries on
+    the user's row, and water aggregated over per-day totals
+    """
+    nutrition = DailyProgress.objects.filter(
+        user=OuterRef('pk'),
         date__range=[start_date, end_date]
-    ).aggregate(
+    ).values('user').annotate(stats=JSONObject(
+        days_logged=Count('id'),
         avg_calories=Avg('total_calories_consumed'),
         total_calories=Sum('total_calories_consumed'),
         avg_protein=Avg('total_protein'),
         avg_carbs=Avg('total_carbs'),
         avg_fat=Avg('total_fat')
-    )
+    )).values('stats')
     
-    # Water stats
+    # Window values are the same on every row, so any single row carries them
+    weight = WeightLog.objects.filter(
+        user=OuterRef('pk'),
+        date__range=[start_date, end_date]
+    ).order_by().annotate(
+        first_weight=Window(FirstValue('weight'), order_by=F('date').asc()),
+        last_weight=Window(LastValue('weight'), order_by=F('date').asc(), frame=RowRange(start=None, end=None)),
+        weight_count=Window(Count('id'))
+    ).values(stats=JSONObject(first=F('first_weight'), last=F('last_weight'), count=F('weight_count')))[:1]
+    
+    row = CustomUser.objects.filter(pk=user.pk).values(
+        nutrition=Subquery(nutrition, output_field=models.JSONField()),
+        weight_stats=Subquery(weight, output_field=models.JSONField())
+    ).get()
+    calorie_stats = row['nutrition'] or {}
+    weight_stats = row['weight_stats'] or {}
+    
+    # Water stats are per day, not per intake row
     water_stats = WaterIntake.objects.filter(
         user=user,
         date__range=[start_date, end_date]
-    ).aggregate(
-        avg_water=Avg('amount_ml'),
-        total_water=Sum('amount_ml')
+    ).values('date').annotate(day_total=Sum('amount_ml')).order_by().aggregate(
+        water_days=Count('date'),
+        total_water=Sum('day_total'),
+        avg_water=Avg('day_total'),
+        min_water=Min('day_total'),
+        max_water=Max('day_total'),
+        stddev_water=StdDev('day_total')
     )
     
-    # Weight stats
-    weight_logs = WeightLog.objects.filter(
-        user=user,
-        date__range=[start_date, end_date]
-    ).order_by('date')
-    
     weight_change = 0
-    if weight_logs.count() >= 2:
-        first_weight = weight_logs.first().weight
-        last_weight = weight_logs.last().weight
-        weight_change = last_weight - first_weight
+    if weight_stats.get('count', 0) >= 2:
+        weight_change = weight_stats['last'] - weight_stats['first']
     
     return {
-        'avg_calories': calorie_stats['avg_calories'] or 0,
-        'total_calories': calorie_stats['total_calories'] or 0,
-        'avg_protein': calorie_stats['avg_protein'] or 0,
-        'avg_carbs': calorie_stats['avg_carbs'] or 0,
-        'avg_fat': calorie_stats['avg_fat'] or 0,
+        'avg_calories': calorie_stats.get('avg_calories') or 0,
+        'total_calories': calorie_stats.get('total_calories') or 0,
+        'avg_protein': calorie_stats.get('avg_protein') or 0,
+        'avg_carbs': calorie_stats.get('avg_carbs') or 0,
+        'avg_fat': calorie_stats.get('avg_fat') or 0,
+        'days_logged': calorie_stats.get('days_logged', 0),
         'avg_water': water_stats['avg_water'] or 0,
         'total_water': water_stats['total_water'] or 0,
+        'min_water': water_stats['min_water'] or 0,
+        'max_water': water_stats['max_water'] or 0,
+        'stddev_water': water_stats['stddev_water'] or 0,
+        'water_days': water_stats['water_days'],
         'weight_change': weight_change,
         'days_count': (end_date - start_date).days + 1
-    }
\ No newline at end of file
+    }
+
+@user_passes_test(lambda user: user.is_staff)
+def cache_metrics(request):
+    """Hit and miss counts of caloe.cache entries in this process, for monitoring"""
+    return JsonResponse({'entries': cache_stats()})
+
+def metrics(request):
+    """Prometheus scrape target for this process's request and cache metrics"""
+    if request.META.get('REMOTE_ADDR') not in getattr(settings, 'CALOE_METRICS_ALLOWED_IPS', ()) and not request.user.is_staff:
+        return HttpResponse(status=403)
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
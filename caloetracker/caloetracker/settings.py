@@ -28,6 +28,8 @@ INSTALLED_APPS = [
 AUTH_USER_MODEL = 'caloe.CustomUser'  # Updated to 'caloe'
 
 MIDDLEWARE = [
+    # Outermost, so its timings cover the other middleware too
+    'caloe.middleware.PerformanceMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -41,7 +43,8 @@ ROOT_URLCONF = 'caloetracker.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates that reports render time to PerformanceMiddleware
+        'BACKEND': 'caloe.middleware.TimedDjangoTemplates',
         'DIRS': [BASE_DIR / "templates"],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -62,9 +65,55 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # File-backed test database so threaded tests get real SQLite locking
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
+        # Keep connections (and their PRAGMAs and page cache) across requests
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            # Writers take the lock at BEGIN, see caloe.db. How long they wait
+            # for it is the busy_timeout pragma in caloe.db.DEFAULT_PRAGMAS.
+            'transaction_mode': 'IMMEDIATE',
+        },
     }
 }
 
+# Every SQLite connection gets caloe.db.DEFAULT_PRAGMAS (WAL and friends).
+# Set CALOE_SQLITE_PRAGMAS to a dict to override single entries, e.g.
+# {'mmap_size': 0}.
+
+# Retries of a write transaction that still timed out waiting for the lock
+CALOE_SQLITE_BUSY_RETRIES = 3
+
+# Per-user read models, see caloe.cache. CALOE_CACHE_BACKEND picks the
+# backend; the in-process default needs no server and is what tests use.
+CALOE_CACHE_BACKENDS = {
+    'locmem': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'caloe',
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+    'file': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('CALOE_CACHE_LOCATION', BASE_DIR / 'cache'),
+    },
+    'memcached': {
+        'BACKEND': 'django.core.cache.backends.memcached.PyMemcacheCache',
+        'LOCATION': os.environ.get('CALOE_CACHE_LOCATION', '127.0.0.1:11211'),
+    },
+    'redis': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ.get('CALOE_CACHE_LOCATION', 'redis://127.0.0.1:6379/1'),
+    },
+}
+CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'caloe': CALOE_CACHE_BACKENDS[os.environ.get('CALOE_CACHE_BACKEND', 'locmem')],
+}
+CALOE_CACHE = 'caloe'
+# Seconds an entry lives; writes make entries unreachable well before that
+CALOE_CACHE_TIMEOUT = 60 * 60
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -101,6 +150,30 @@ LOGIN_REDIRECT_URL = 'dashboard'
 LOGOUT_REDIRECT_URL = 'login'
 LOGIN_URL = 'login'
 
+# Pub/sub behind the live progress stream. The default fans out within one
+# process; point this at a shared broker when running several ASGI workers.
+CALOE_EVENT_BROKER = 'caloe.events.LocalBroker'
+
+# Request instrumentation, see caloe.middleware. Share of requests timed;
+# the rest pass straight through.
+CALOE_PERF_SAMPLE_RATE = 1.0
+# Requests at least this slow are logged with their slowest queries
+CALOE_SLOW_REQUEST_MS = 500
+# Addresses that may scrape /metrics/ without a staff login, e.g.
+# ['127.0.0.1', '::1']. Empty leaves the endpoint to staff only.
+CALOE_METRICS_ALLOWED_IPS = []
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'caloe.performance': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
+    },
+}
+
 # Media files
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'